@@ -0,0 +1,385 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+import os
+
+for name, value in {"connection_url" : "mongodb://benchmark", "collection_list" : "[]", "database_name" : "benchmark", "query" : ""}.items():
+    os.environ.setdefault(name, value)
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+import types
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Callable, Iterator
+from bson import ObjectId
+from src.DBAgent import DBQueryAgent, AsyncDBQueryAgent
+from src.DBReader import MongoReader, AsyncMongoReader
+from src.MongoClientRegistry import MongoClientRegistry
+from src.SchemaCache import SchemaCache
+from src.AnswerCache import AnswerCache
+from src.ContextCompactor import ContextCompactor
+from src.SchemaPruner import SchemaPruner
+from src.Telemetry import Telemetry
+from src.Schemas import QueryInput
+from src.llm import BaseLLM
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+COLLECTIONS = ["users", "orders", "products"]
+COUNTRIES = ["IN", "US", "DE", "FR", "BR", "JP"]
+PLANS = ["free", "basic", "premium"]
+STATUSES = ["pending", "shipped", "delivered", "cancelled"]
+CATEGORIES = ["books", "electronics", "garden", "toys"]
+
+# Each scripted question lists the tool outputs of its successive generations; the first one may be rejected on purpose.
+DEFAULT_QUESTIONS = [
+    {"query" : "How many users signed up per country?", "responses" : [
+        {"collection_name" : "users", "mongodb_pipeline" : [{"$group" : {"_id" : "$country", "count" : {"$sum" : 1}}}]},
+    ]},
+    {"query" : "What is the total order amount by status?", "responses" : [
+        {"collection_name" : "orders", "mongodb_pipeline" : [{"$group" : {"_id" : "$status", "total" : {"$sum" : "$amount"}}}]},
+    ]},
+    {"query" : "What is the average age of users on the premium plan?", "responses" : [
+        {"collection_name" : "users", "mongodb_pipeline" : [{"$match" : {"plan" : "premium"}}, {"$group" : {"_id" : None, "average_age" : {"$avg" : "$age"}}}]},
+    ]},
+    {"query" : "Which are the 5 most expensive products?", "responses" : [
+        {"collection_name" : "products", "mongodb_pipeline" : [{"$sort" : {"cost" : -1}}, {"$limit" : 5}]},
+        {"collection_name" : "products", "mongodb_pipeline" : [{"$sort" : {"price" : -1}}, {"$limit" : 5}, {"$project" : {"_id" : 0, "title" : 1, "price" : 1}}]},
+    ]},
+    {"query" : "How many orders were created since 2024-01-01?", "responses" : [
+        {"collection_name" : "orders", "mongodb_pipeline" : [{"$match" : {"created_at" : {"$gte" : "2024-01-01"}}}, {"$count" : "orders"}]},
+    ]},
+]
+
+
+def get_bson_type(value : object) -> str:
+    if(isinstance(value, bool)):
+        return "bool"
+    if(isinstance(value, int)):
+        return "int"
+    if(isinstance(value, float)):
+        return "double"
+    if(isinstance(value, datetime)):
+        return "date"
+    if(isinstance(value, ObjectId)):
+        return "objectId"
+    if(isinstance(value, dict)):
+        return "object"
+    if(isinstance(value, list)):
+        return "array"
+    if(value is None):
+        return "null"
+    return "string"
+
+
+class MongomockKeyTypes:
+    # mongomock has no $type expression, so key types are derived in Python from the first value of each key.
+    def get_key_stages(self) -> list[dict]:
+        stages = super().get_key_stages()
+        stages[-1]["$group"]["types"] = {"$first" : "$arrayofkeyvalue.v"}
+        return stages
+
+    def fold_collection_keys(self, key_docs : list[dict], sampled : bool) -> dict[str, dict]:
+        for doc in key_docs:
+            doc["types"] = [get_bson_type(doc["types"])]
+        return super().fold_collection_keys(key_docs, sampled)
+
+
+class MongomockReader(MongomockKeyTypes, MongoReader):
+    pass
+
+
+class AsyncMongomockCursor:
+    def __init__(self, cursor : object) -> None:
+        self.cursor = cursor
+
+    async def to_list(self, length : int | None = None) -> list[dict]:
+        return list(itertools.islice(self.cursor, length))
+
+    async def close(self) -> None:
+        self.cursor.close()
+
+
+class AsyncMongomockCollection:
+    def __init__(self, collection : object) -> None:
+        self.collection = collection
+
+    def aggregate(self, pipeline : list[dict], **options : object) -> AsyncMongomockCursor:
+        return AsyncMongomockCursor(self.collection.aggregate(pipeline, **options))
+
+    async def index_information(self) -> dict:
+        return self.collection.index_information()
+
+    async def estimated_document_count(self) -> int:
+        return self.collection.estimated_document_count()
+
+
+class AsyncMongomockDatabase:
+    def __init__(self, database : object) -> None:
+        self.database = database
+
+    def __getitem__(self, collection_name : str) -> AsyncMongomockCollection:
+        return AsyncMongomockCollection(self.database[collection_name])
+
+    async def command(self, *args : object, **options : object) -> dict:
+        return self.database.command(*args, **options)
+
+
+class AsyncMongomockClient:
+    # Exposes the Motor calls AsyncMongoReader makes on top of the same in-memory mongomock client.
+    def __init__(self, client : object) -> None:
+        self.client = client
+
+    def __getitem__(self, database_name : str) -> AsyncMongomockDatabase:
+        return AsyncMongomockDatabase(self.client[database_name])
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class AsyncMongomockReader(MongomockKeyTypes, AsyncMongoReader):
+    pass
+
+
+class StageRecorder(Telemetry):
+    def __init__(self) -> None:
+        super().__init__()
+        self.durations : dict[str, list[float]] = defaultdict(list)
+
+    @contextmanager
+    def span(self, stage : str, attach : bool = True, **attributes : object) -> Iterator[dict]:
+        start_time = time.perf_counter()
+        try:
+            with super().span(stage, attach, **attributes) as values:
+                yield values
+        finally:
+            self.durations[stage].append(time.perf_counter() - start_time)
+
+
+class ScriptedLLM(BaseLLM):
+    def __init__(self, telemetry : Telemetry, latency_ms : float) -> None:
+        self.telemetry = telemetry
+        self.latency_ms = latency_ms
+        self.script : dict = {}
+        self.generation_count = 0
+        self.calls : dict[str, int] = defaultdict(int)
+
+    def set_script(self, script : dict) -> None:
+        self.script = script
+        self.generation_count = 0
+
+    def get_chat_message(self, content : str, role : str) -> dict:
+        return {"role" : role, "content" : content}
+
+    def get_chat_content(self, message : dict) -> str:
+        return message["content"]
+
+    def get_chat_role(self, message : dict) -> str:
+        return message["role"]
+
+    def respond(self, operation : str) -> str | dict:
+        if(operation == "test_mongo_pipeline"):
+            responses = self.script.get("responses") or [{"collection_name" : self.script["collection_list"][0], "mongodb_pipeline" : [{"$group" : {"_id" : None, "count" : {"$sum" : 1}}}]}]
+            response = responses[min(self.generation_count, len(responses) - 1)]
+            self.generation_count += 1
+            return {"collection_name" : response["collection_name"], "mongodb_pipeline" : json.dumps(response["mongodb_pipeline"]), "query_analysis_failed" : response.get("query_analysis_failed", False)}
+
+        if(operation == "analyze_mongodb_pipeline"):
+            verdict = {}
+            for condition in ["intermediate_query", "contains_DML_operation", "contains_raw_output", "incorrect_query"]:
+                verdict[condition] = False
+                verdict[f"reason_for_{condition}"] = "Scripted benchmark verdict."
+            return verdict
+
+        return self.script.get("answer", "Scripted benchmark answer.")
+
+    def record_scripted_usage(self, attributes : dict, model : str, operation : str, start_time : float, messages : list[dict], output : str | dict, usage_callback : Callable[[int | None, int | None, int | None], None] | None) -> None:
+        prompt_characters = sum(len(message["content"]) for message in messages)
+        usage = types.SimpleNamespace(prompt_tokens=prompt_characters // 4, completion_tokens=len(str(output)) // 4)
+        self.record_usage(attributes, model, operation, start_time, usage, usage_callback)
+
+    def invoke(self, model : str, messages : list[dict], temperature : float, tools : dict = None, return_tool : bool = True, usage_callback : Callable[[int | None, int | None, int | None], None] | None = None) -> str | dict:
+        operation = self.get_operation(tools, return_tool)
+        self.calls[operation] += 1
+        with self.telemetry.span("llm", model=model, operation=operation) as attributes:
+            start_time = time.perf_counter()
+            time.sleep(self.latency_ms / 1000)
+            output = self.respond(operation)
+            self.record_scripted_usage(attributes, model, operation, start_time, messages, output, usage_callback)
+        return output
+
+    async def invoke_async(self, model : str, messages : list[dict], temperature : float, tools : dict = None, return_tool : bool = True, usage_callback : Callable[[int | None, int | None, int | None], None] | None = None) -> str | dict:
+        operation = self.get_operation(tools, return_tool)
+        self.calls[operation] += 1
+        with self.telemetry.span("llm", model=model, operation=operation) as attributes:
+            start_time = time.perf_counter()
+            await asyncio.sleep(self.latency_ms / 1000)
+            output = self.respond(operation)
+            self.record_scripted_usage(attributes, model, operation, start_time, messages, output, usage_callback)
+        return output
+
+    async def stream_async(self, model : str, messages : list[dict], temperature : float, usage_callback : Callable[[int | None, int | None, int | None], None] | None = None) -> AsyncIterator[str]:
+        yield await self.invoke_async(model, messages, temperature, return_tool=False, usage_callback=usage_callback)
+
+
+def seed_dataset(database : object, size : int, seed : int) -> None:
+    rng = random.Random(seed)
+    start_date = datetime(2023, 1, 1)
+
+    products = [
+        {"_id" : ObjectId(), "title" : f"product {index}", "category" : rng.choice(CATEGORIES), "price" : round(rng.uniform(1, 900), 2), "in_stock" : rng.random() > 0.2}
+        for index in range(max(size // 10, 10))
+    ]
+    users = [
+        {"_id" : ObjectId(), "name" : f"user {index}", "country" : rng.choice(COUNTRIES), "plan" : rng.choice(PLANS), "age" : rng.randint(18, 80), "signup_date" : start_date + timedelta(days=rng.randint(0, 700))}
+        for index in range(size)
+    ]
+    orders = [
+        {
+            "user_id" : rng.choice(users)["_id"],
+            "status" : rng.choice(STATUSES),
+            "amount" : round(rng.uniform(5, 500), 2),
+            "created_at" : start_date + timedelta(days=rng.randint(0, 700), minutes=rng.randint(0, 1440)),
+            "items" : [{"product_id" : rng.choice(products)["_id"], "quantity" : rng.randint(1, 4)} for _ in range(rng.randint(1, 3))],
+        }
+        for _ in range(size)
+    ]
+
+    database["products"].insert_many(products)
+    database["users"].insert_many(users)
+    database["orders"].insert_many(orders)
+
+
+def load_questions(path : str | None) -> list[dict]:
+    if(path is None):
+        return DEFAULT_QUESTIONS
+
+    questions = []
+    with open(path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if(len(line) == 0):
+                continue
+            record = json.loads(line)
+            query = record.get("query") or record.get("question") or record.get("title")
+            if(query):
+                questions.append({**record, "query" : query})
+    return questions
+
+
+def percentile(values : list[float], fraction : float) -> float:
+    if(len(values) == 0):
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def run_dataset(size : int, questions : list[dict], args : argparse.Namespace) -> dict:
+    client = mongomock.MongoClient()
+    seed_dataset(client[args.database_name], size, args.seed)
+
+    telemetry = StageRecorder()
+    llm = ScriptedLLM(telemetry, args.llm_latency_ms)
+    schema_cache = None if args.no_schema_cache else SchemaCache()
+    if(args.async_agent):
+        registry = MongoClientRegistry(client_factory=lambda url, **options : AsyncMongomockClient(client), health_check_interval=0)
+        reader = AsyncMongomockReader("mongodb://benchmark", args.database_name, registry, schema_cache)
+        agent_class = AsyncDBQueryAgent
+    else:
+        registry = MongoClientRegistry(client_factory=lambda url, **options : client, health_check_interval=0)
+        reader = MongomockReader("mongodb://benchmark", args.database_name, registry, schema_cache)
+        agent_class = DBQueryAgent
+    agent = agent_class(
+        llm,
+        reader,
+        answer_cache=AnswerCache() if args.answer_cache else None,
+        use_rule_validator=not args.no_rule_validator,
+        context_compactor=ContextCompactor(),
+        schema_pruner=SchemaPruner() if args.schema_pruning else None,
+        telemetry=telemetry,
+    )
+
+    generations : list[int] = []
+    failures = 0
+    for _ in range(args.repeat):
+        for question in questions:
+            collection_list = question.get("collection_list") or COLLECTIONS
+            llm.set_script({**question, "collection_list" : collection_list})
+            input_parameters = QueryInput(query=question["query"], collection_list=collection_list, database_name=args.database_name, connection_url="mongodb://benchmark", use_answer_cache=args.answer_cache)
+
+            # The schema stage is reported on its own, and the question latency excludes it.
+            schema_seconds = sum(telemetry.durations["schema"])
+            start_time = time.perf_counter()
+            try:
+                if(args.async_agent):
+                    asyncio.run(agent.execute_agent(input_parameters))
+                else:
+                    agent.execute_agent(input_parameters)
+            except Exception:
+                failures += 1
+            request_seconds = time.perf_counter() - start_time
+            telemetry.durations["request"].append(request_seconds)
+            telemetry.durations["question"].append(request_seconds - (sum(telemetry.durations["schema"]) - schema_seconds))
+            generations.append(llm.generation_count)
+
+    registry.close_all()
+    return {
+        "dataset_size" : size,
+        "agent" : agent_class.__name__,
+        "questions" : len(questions) * args.repeat,
+        "failures" : failures,
+        "stages" : {
+            stage : {"count" : len(values), "p50_ms" : percentile(values, 0.5) * 1000, "p99_ms" : percentile(values, 0.99) * 1000}
+            for stage, values in telemetry.durations.items()
+        },
+        "llm_calls" : dict(llm.calls),
+        "generations_per_question" : {"mean" : sum(generations) / max(len(generations), 1), "max" : max(generations, default=0)},
+    }
+
+
+def print_report(report : dict) -> None:
+    print(f"\n{report['agent']}   dataset size : {report['dataset_size']} documents per collection   questions : {report['questions']}   failures : {report['failures']}")
+    print(f"{'stage':<18}{'count':>8}{'p50 ms':>12}{'p99 ms':>12}")
+    for stage, stats in sorted(report["stages"].items()):
+        print(f"{stage:<18}{stats['count']:>8}{stats['p50_ms']:>12.2f}{stats['p99_ms']:>12.2f}")
+    print(f"llm calls : {report['llm_calls']}")
+    print(f"generations per question : mean {report['generations_per_question']['mean']:.2f}, max {report['generations_per_question']['max']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive DBQueryAgent or AsyncDBQueryAgent end to end offline with a scripted LLM and a mongomock database, and report per-stage latency.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000])
+    parser.add_argument("--questions", default=None, help="JSONL file of questions (query, question or title field), optionally with scripted responses and collection_list.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--llm_latency_ms", type=float, default=0.0)
+    parser.add_argument("--database_name", default="benchmark")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--async_agent", action="store_true", help="Replay through AsyncDBQueryAgent.execute_agent on an async view of the same mongomock database.")
+    parser.add_argument("--no_schema_cache", action="store_true", help="Infer the schema on every question instead of once per collection.")
+    parser.add_argument("--answer_cache", action="store_true")
+    parser.add_argument("--schema_pruning", action="store_true")
+    parser.add_argument("--no_rule_validator", action="store_true")
+    parser.add_argument("--output", default=None, help="Append one JSON report per dataset size to this file.")
+    args = parser.parse_args()
+
+    if(mongomock is None):
+        raise SystemExit("The agent replay benchmark needs mongomock: pip install mongomock")
+
+    questions = load_questions(args.questions)
+    for size in args.sizes:
+        report = run_dataset(size, questions, args)
+        print_report(report)
+        if(args.output is not None):
+            with open(args.output, "a") as file:
+                file.write(json.dumps(report) + "\n")
@@ -0,0 +1,108 @@
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from src.DateCoercer import DateCoercer
+
+
+def legacy_convert_dates_in_query(query : list[dict]) -> list[dict]:
+    # The JSON round trip and double parse of every string, as before the schema-aware coercion.
+    date_format = "%Y-%m-%d"
+
+    def is_date(string : str) -> bool:
+        check_date = []
+        try:
+            datetime.strptime(string, date_format)
+            check_date.append(True)
+        except:
+            check_date.append(False)
+
+        try:
+            datetime.fromisoformat(string)
+            check_date.append(True)
+        except:
+            check_date.append(False)
+
+        return bool(sum(check_date))
+
+    def convert_dates(obj : dict | list) -> None:
+        if isinstance(obj, dict):
+            for key, value in obj.items():
+                if isinstance(value, str) and is_date(value):
+                    try:
+                        obj[key] = datetime.strptime(value, date_format)
+                    except:
+                        obj[key] = datetime.fromisoformat(value)
+
+                elif isinstance(value, dict) or isinstance(value, list):
+                    convert_dates(value)
+        elif isinstance(obj, list):
+            for item in obj:
+                convert_dates(item)
+
+    query_copy = json.loads(json.dumps(query))
+    convert_dates(query_copy)
+    return query_copy
+
+
+def build_pipeline(in_size : int) -> list[dict]:
+    start = datetime(2020, 1, 1)
+    return [
+        {"$match": {
+            "status": {"$in": [f"status_{index}" for index in range(in_size)]},
+            "customer_id": {"$in": [f"{random.getrandbits(96):024x}" for _ in range(in_size)]},
+            "created_at": {"$in": [(start + timedelta(days=index)).strftime("%Y-%m-%d") for index in range(in_size)]},
+            "updated_at": {"$gte": "2024-01-01T00:00:00Z", "$lt": "2024-07-01T00:00:00+02:00"},
+            "$or": [{"updated_at": (start + timedelta(hours=index)).isoformat()} for index in range(in_size)],
+        }},
+        {"$group": {"_id": "$status", "total": {"$sum": "$amount"}, "last": {"$max": "$created_at"}}},
+        {"$sort": {"total": -1}},
+        {"$limit": 10},
+    ]
+
+
+def count_dates(value : object) -> int:
+    if(isinstance(value, datetime)):
+        return 1
+    if(isinstance(value, list)):
+        return sum(count_dates(item) for item in value)
+    if(isinstance(value, dict)):
+        return sum(count_dates(item) for item in value.values())
+    return 0
+
+
+def run_benchmark(in_sizes : list[int], repeat : int) -> None:
+    collection_schema = {"orders" : {
+        "status" : {"data_type" : ["string"]},
+        "customer_id" : {"data_type" : ["string"]},
+        "amount" : {"data_type" : ["double"]},
+        "created_at" : {"data_type" : ["date"]},
+        "updated_at" : {"data_type" : ["date"]},
+    }}
+
+    runs = {
+        "json round trip + strptime/fromisoformat (before)" : lambda pipeline : legacy_convert_dates_in_query(pipeline),
+        "single pass, no schema" : lambda pipeline : DateCoercer().coerce(pipeline, "orders"),
+        "single pass, schema-aware (after)" : lambda pipeline : DateCoercer(collection_schema).coerce(pipeline, "orders"),
+    }
+
+    for in_size in in_sizes:
+        pipeline = build_pipeline(in_size)
+        print(f"$in and $or lists of {in_size} values")
+        for name, run in runs.items():
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                coerced = run(pipeline)
+                timings.append(time.perf_counter() - start)
+            print(f"  {name:<52} dates in $in : {count_dates(coerced[0]['$match']['created_at']):>7}   dates in $or : {count_dates(coerced[0]['$match']['$or']):>7}   best : {min(timings) * 1000:>9.2f}ms   mean : {sum(timings) / repeat * 1000:>9.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the wall-time of date coercion on generated pipelines before and after the schema-aware single pass.")
+    parser.add_argument("--in_sizes", nargs="+", type=int, default=[10, 1000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    run_benchmark(args.in_sizes, args.repeat)
@@ -0,0 +1,79 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+import argparse
+import os
+import time
+import pymongo
+from pymongo import monitoring
+from src.DBReader import MongoReader
+from src.MongoClientRegistry import MongoClientRegistry
+
+
+class AggregateCounter(monitoring.CommandListener):
+    def __init__(self) -> None:
+        self.count = 0
+
+    def started(self, event : monitoring.CommandStartedEvent) -> None:
+        if(event.command_name == "aggregate"):
+            self.count += 1
+
+    def succeeded(self, event : monitoring.CommandSucceededEvent) -> None:
+        pass
+
+    def failed(self, event : monitoring.CommandFailedEvent) -> None:
+        pass
+
+
+def legacy_collection_schema_json(reader : MongoReader, collection_list : list[str], max_key_example_count : int) -> dict[str, dict]:
+    # Per-key distinct lookups, one collection after the other, as before the $facet batching.
+    collection_key_list = {}
+    for collection_name in collection_list:
+        source_stages, sampled = reader.get_source_stages(collection_name)
+        collection_keys = reader.infer_collection_keys(collection_name, source_stages, sampled)
+        schema = {}
+        for key, key_data in collection_keys.items():
+            key_count = max_key_example_count
+            if(key_data["types"][0] in ["date", "objectId"]):
+                key_count = 1
+            result = list(reader.get_distinct_keys(collection_name, key, key_count))
+            schema[key] = {"data_type" : key_data["types"], "Example_values" : [str(doc["_id"])[0 : 100] for doc in result]}
+        collection_key_list[collection_name] = schema
+    return collection_key_list
+
+
+def run_benchmark(connection_url : str, database_name : str, collection_list : list[str], max_key_example_count : int, repeat : int) -> None:
+    counter = AggregateCounter()
+    registry = MongoClientRegistry(client_factory=lambda url, **options : pymongo.MongoClient(url, event_listeners=[counter], **options))
+    reader = MongoReader(connection_url, database_name, registry)
+
+    runs = {
+        "per-key $group (before)" : lambda : legacy_collection_schema_json(reader, collection_list, max_key_example_count),
+        "$facet + concurrent collections (after)" : lambda : reader.prepare_collection_schema_json(collection_list, max_key_example_count),
+    }
+
+    try:
+        for name, run in runs.items():
+            timings = []
+            counter.count = 0
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - start)
+            print(f"{name:<42} aggregate scans/run : {counter.count / repeat:>6.1f}   best wall-time : {min(timings):.3f}s   mean wall-time : {sum(timings) / repeat:.3f}s")
+    finally:
+        registry.close_all()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare aggregate scan count and wall-time of schema introspection before and after $facet batching.")
+    parser.add_argument("--connection_url", default=os.environ.get("connection_url"))
+    parser.add_argument("--database_name", default=os.environ.get("database_name"))
+    parser.add_argument("--collection_list", nargs="+", required=True)
+    parser.add_argument("--example_count", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    run_benchmark(args.connection_url, args.database_name, args.collection_list, args.example_count, args.repeat)
@@ -0,0 +1,14 @@
+import os
+from src.Constant import SERVER_WORKERS, SERVER_WORKER_TIMEOUT
+
+
+bind = "0.0.0.0:9000"
+workers = int(os.environ.get("SERVER_WORKERS", SERVER_WORKERS))
+worker_class = "uvicorn.workers.UvicornWorker"
+keepalive = 9000
+timeout = int(os.environ.get("SERVER_WORKER_TIMEOUT", SERVER_WORKER_TIMEOUT))
+graceful_timeout = 30
+
+# The app and the Container are imported once in the master and shared copy-on-write by the forked workers.
+# Container singletons are created lazily, so connections and event loops are still opened in each worker.
+preload_app = True
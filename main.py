@@ -3,51 +3,299 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
-from fastapi import Depends, FastAPI
-from src.Exception import handle_exceptions
-from src.Container import Container
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Query
+from src.Exception import handle_exceptions, get_error_details
+from src.Container import Container, llm_router_enabled, llm_cache_enabled
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import JSONResponse
-from src.Schemas import TaskResponse, QueryInput
-from src.utils import check_token
-from src.Constant import MONGODB, MISTRAL_CODE_MODEL, OPENAI_GPT4_MODEL
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from src.DBAgent import AsyncDBQueryAgent
+from src.DBReader import AsyncMongoReader
+from src.AnswerCache import AnswerCache
+from src.Schemas import TaskResponse, QueryInput, JobInput, BatchQueryInput
+from src.utils import check_token, format_stream_event, with_heartbeat
+from src.Telemetry import configure_logging
+from src.Constant import MONGODB, MISTRAL_CODE_MODEL, OPENAI_GPT4_MODEL, STREAM_FORMAT_NDJSON, STREAM_FORMAT_SSE, STREAM_HEARTBEAT_INTERVAL, STREAM_EVENT_ERROR, STREAM_EVENT_BATCH_RESULT, STREAM_EVENT_BATCH_DONE, BATCH_MAX_QUERIES, BATCH_CONCURRENCY, LOG_LEVEL, LOG_SAMPLE_RATE, SERVER_WORKERS
 import uvicorn
 
 
-app = FastAPI()
-auth_scheme = HTTPBearer()
+configure_logging(os.environ.get("LOG_LEVEL", LOG_LEVEL), float(os.environ.get("LOG_SAMPLE_RATE", LOG_SAMPLE_RATE)))
 container = Container()
+batch_max_queries = int(os.environ.get("BATCH_MAX_QUERIES", BATCH_MAX_QUERIES))
+batch_concurrency = int(os.environ.get("BATCH_CONCURRENCY", BATCH_CONCURRENCY))
+
+
+@asynccontextmanager
+async def lifespan(app : FastAPI):
+    await container.schema_catalog().start()
+    await container.job_manager().start(run_job)
+    yield
+    await container.job_manager().stop()
+    await container.schema_catalog().stop()
+    container.mongo_client_registry().close_all()
+    container.async_mongo_client_registry().close_all()
+    container.telemetry().shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+auth_scheme = HTTPBearer()
+
+def get_db_agent(input_data: QueryInput, database: AsyncMongoReader | None = None) -> AsyncDBQueryAgent:
+    if(input_data.llm_name not in [MISTRAL_CODE_MODEL, OPENAI_GPT4_MODEL]):
+        raise Exception("Not Implemented")
+
+    if(llm_router_enabled):
+        llm = container.llm_router()
+    elif(input_data.llm_name == MISTRAL_CODE_MODEL):
+        llm = container.mistral_llm()
+    else:
+        llm = container.openai_llm()
+
+    if(llm_cache_enabled and input_data.use_llm_cache):
+        llm = container.cached_llm(llm)
+    
+    if(database is None):
+        if(input_data.database_type != MONGODB):
+            raise Exception("Not Implemented")
+        database = container.async_mongo_client(input_data.connection_url, input_data.database_name)
+    
+    return container.async_db_agent(llm, database)
+
+
+async def run_job(input_data: QueryInput) -> str:
+    db_agent = get_db_agent(input_data)
+    with container.telemetry().span("request", endpoint="jobs", model=input_data.llm_name):
+        return await db_agent.execute_agent(input_data)
+
 
 @app.post("/analyze_db")
 @handle_exceptions
-def index_data(
+async def index_data(
     input_data: QueryInput,
     api_key: HTTPAuthorizationCredentials = Depends(auth_scheme),
 ):
     
     check_token(api_key)
-    if(input_data.llm_name == MISTRAL_CODE_MODEL):
-        llm = container.mistral_llm()
-    elif(input_data.llm_name == OPENAI_GPT4_MODEL):
-        llm = container.openai_llm()
-    else:
-        raise Exception("Not Implemented")
-    
-    if(input_data.database_type == MONGODB):
-        database = container.mongo_client(input_data.connection_url, input_data.database_name)
-    else:
-        raise Exception("Not Implemented")
-    
-    db_agent = container.db_agent(llm, database)
-    result = db_agent.execute_agent(input_data)
+    db_agent = get_db_agent(input_data)
+    telemetry = container.telemetry()
+    status = "error"
+    try:
+        with telemetry.span("request", endpoint="analyze_db", model=input_data.llm_name):
+            result = await db_agent.execute_agent(input_data)
+        status = "success"
+    finally:
+        telemetry.record_request("analyze_db", status)
 
     task_response = TaskResponse()
     task_response.output = result
 
     return JSONResponse(content=task_response.model_dump(), status_code=200)
+
+
+@app.post("/analyze_db/stream")
+@handle_exceptions
+async def stream_data(
+    input_data: QueryInput,
+    stream_format: str = Query(STREAM_FORMAT_NDJSON, alias="format"),
+    api_key: HTTPAuthorizationCredentials = Depends(auth_scheme),
+):
+    check_token(api_key)
+    if(stream_format not in [STREAM_FORMAT_NDJSON, STREAM_FORMAT_SSE]):
+        raise HTTPException(status_code=400, detail=f"Unsupported stream format: {stream_format}")
+
+    db_agent = get_db_agent(input_data)
+
+    telemetry = container.telemetry()
+
+    async def event_stream():
+        status = "success"
+        with telemetry.span("request", attach=False, endpoint="analyze_db_stream", model=input_data.llm_name):
+            try:
+                async for event in with_heartbeat(db_agent.stream_agent(input_data), STREAM_HEARTBEAT_INTERVAL):
+                    yield format_stream_event(event, stream_format)
+            except Exception as exc:
+                status = "error"
+                error, error_data = get_error_details(exc)
+                yield format_stream_event({"event" : STREAM_EVENT_ERROR, "data" : {"error" : error, "error_data" : error_data}}, stream_format)
+            finally:
+                telemetry.record_request("analyze_db_stream", status)
+
+    media_type = "text/event-stream" if stream_format == STREAM_FORMAT_SSE else "application/x-ndjson"
+    return StreamingResponse(event_stream(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/analyze_db/batch")
+@handle_exceptions
+async def batch_data(
+    input_data: BatchQueryInput,
+    stream_format: str = Query(STREAM_FORMAT_NDJSON, alias="format"),
+    api_key: HTTPAuthorizationCredentials = Depends(auth_scheme),
+):
+    check_token(api_key)
+    if(stream_format not in [STREAM_FORMAT_NDJSON, STREAM_FORMAT_SSE]):
+        raise HTTPException(status_code=400, detail=f"Unsupported stream format: {stream_format}")
+    if(len(input_data.queries) == 0 or len(input_data.queries) > batch_max_queries):
+        raise HTTPException(status_code=400, detail=f"A batch must hold between 1 and {batch_max_queries} queries")
+
+    # One reader serves every question, so the schema is introspected once and the Mongo client is shared.
+    schema_agent = get_db_agent(input_data)
+    database = schema_agent.database
+    telemetry = container.telemetry()
+    semaphore = asyncio.Semaphore(max(1, min(input_data.max_concurrency or batch_concurrency, batch_concurrency)))
+
+    # Identical questions run once, and their result is sent for every position they hold in the batch.
+    question_indexes : dict[str, list[int]] = {}
+    for index, query in enumerate(input_data.queries):
+        question_indexes.setdefault(AnswerCache.normalize_query(query), []).append(index)
+
+    async def answer_question(indexes : list[int], collection_data : tuple) -> dict:
+        question = QueryInput(**input_data.model_dump(exclude={"queries", "max_concurrency", "query"}), query=input_data.queries[indexes[0]])
+        async with semaphore:
+            try:
+                output = await get_db_agent(question, database).execute_agent(question, collection_data)
+                return {"indexes" : indexes, "query" : question.query, "output" : output}
+            except Exception as exc:
+                error, error_data = get_error_details(exc)
+                return {"indexes" : indexes, "query" : question.query, "error" : error, "error_data" : error_data}
+
+    async def batch_events():
+        collection_data = await schema_agent.load_collection_schema(input_data)
+        tasks = [asyncio.ensure_future(answer_question(indexes, collection_data)) for indexes in question_indexes.values()]
+        failed = 0
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                failed += int("error" in result)
+                yield {"event" : STREAM_EVENT_BATCH_RESULT, "data" : result}
+        finally:
+            for task in tasks:
+                task.cancel()
+        yield {"event" : STREAM_EVENT_BATCH_DONE, "data" : {"queries" : len(input_data.queries), "unique_queries" : len(question_indexes), "failed" : failed}}
+
+    async def event_stream():
+        status = "success"
+        with telemetry.span("request", attach=False, endpoint="analyze_db_batch", model=input_data.llm_name):
+            try:
+                async for event in with_heartbeat(batch_events(), STREAM_HEARTBEAT_INTERVAL):
+                    yield format_stream_event(event, stream_format)
+            except Exception as exc:
+                status = "error"
+                error, error_data = get_error_details(exc)
+                yield format_stream_event({"event" : STREAM_EVENT_ERROR, "data" : {"error" : error, "error_data" : error_data}}, stream_format)
+            finally:
+                telemetry.record_request("analyze_db_batch", status)
+
+    media_type = "text/event-stream" if stream_format == STREAM_FORMAT_SSE else "application/x-ndjson"
+    return StreamingResponse(event_stream(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/jobs")
+@handle_exceptions
+def submit_job(
+    input_data: JobInput,
+    api_key: HTTPAuthorizationCredentials = Depends(auth_scheme),
+):
+    check_token(api_key)
+    job = container.job_manager().submit(input_data)
+    return JSONResponse(content=job.model_dump(), status_code=202)
+
+
+@app.get("/jobs/stats")
+@handle_exceptions
+def job_stats(
+    api_key: HTTPAuthorizationCredentials = Depends(auth_scheme),
+):
+    check_token(api_key)
+    return JSONResponse(content=container.job_manager().get_stats(), status_code=200)
+
+
+@app.get("/jobs/{job_id}")
+@handle_exceptions
+def get_job(
+    job_id: str,
+    api_key: HTTPAuthorizationCredentials = Depends(auth_scheme),
+):
+    check_token(api_key)
+    job = container.job_manager().get(job_id)
+    if(job is None):
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return JSONResponse(content=job.model_dump(), status_code=200)
+
+
+@app.delete("/jobs/{job_id}")
+@handle_exceptions
+def cancel_job(
+    job_id: str,
+    api_key: HTTPAuthorizationCredentials = Depends(auth_scheme),
+):
+    check_token(api_key)
+    job = container.job_manager().cancel(job_id)
+    if(job is None):
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return JSONResponse(content=job.model_dump(), status_code=200)
+
+
+@app.get("/answer_cache/stats")
+@handle_exceptions
+def answer_cache_stats(
+    api_key: HTTPAuthorizationCredentials = Depends(auth_scheme),
+):
+    check_token(api_key)
+    return JSONResponse(content=container.answer_cache().get_stats(), status_code=200)
+
+
+@app.get("/llm_cache/stats")
+@handle_exceptions
+def llm_cache_stats(
+    api_key: HTTPAuthorizationCredentials = Depends(auth_scheme),
+):
+    check_token(api_key)
+    return JSONResponse(content=container.llm_response_cache().get_stats(), status_code=200)
+
+
+@app.get("/schema_cache/stats")
+@handle_exceptions
+def schema_cache_stats(
+    api_key: HTTPAuthorizationCredentials = Depends(auth_scheme),
+):
+    check_token(api_key)
+    return JSONResponse(content=container.schema_cache().get_stats(), status_code=200)
+
+
+@app.get("/schema_catalog/stats")
+@handle_exceptions
+def schema_catalog_stats(
+    api_key: HTTPAuthorizationCredentials = Depends(auth_scheme),
+):
+    check_token(api_key)
+    return JSONResponse(content=container.schema_catalog().get_stats(), status_code=200)
+
+
+@app.get("/metrics")
+@handle_exceptions
+def metrics(
+    api_key: HTTPAuthorizationCredentials = Depends(auth_scheme),
+):
+    check_token(api_key)
+    return PlainTextResponse(content=container.telemetry().render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/context/stats")
+@handle_exceptions
+def context_stats(
+    api_key: HTTPAuthorizationCredentials = Depends(auth_scheme),
+):
+    check_token(api_key)
+    return JSONResponse(content=container.context_compactor().get_stats(), status_code=200)
    
 
 if __name__ == "__main__":
+    # Several workers are served by gunicorn, which imports the app once and forks the workers from it.
+    if(int(os.environ.get("SERVER_WORKERS", SERVER_WORKERS)) > 1):
+        os.execvp("gunicorn", ["gunicorn", "--config", "gunicorn.conf.py", "main:app"])
+
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+from src.Schemas import QueryInput
+from src.Constant import ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, PIPELINE_CACHE_SIZE, PIPELINE_CACHE_TTL
+
+
+class MemoryCacheTier:
+    def __init__(self, max_size : int, ttl : float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries : OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits" : 0, "misses" : 0, "expired" : 0, "evicted" : 0}
+
+    def get(self, key : str) -> Any | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if(entry is None):
+                self.counters["misses"] += 1
+                return None
+
+            created_at, value = entry
+            if(time.time() - created_at > self.ttl):
+                del self.entries[key]
+                self.counters["expired"] += 1
+                self.counters["misses"] += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return value
+
+    def set(self, key : str, value : Any) -> None:
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while(len(self.entries) > self.max_size):
+                self.entries.popitem(last=False)
+                self.counters["evicted"] += 1
+
+    def invalidate(self, key : str) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate" : self.counters["hits"] / lookups if lookups else 0.0,
+                "size" : len(self.entries),
+            }
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        exact_tier : MemoryCacheTier | None = None,
+        pipeline_tier : MemoryCacheTier | None = None,
+        exact_max_size : int = ANSWER_CACHE_SIZE,
+        exact_ttl : float = ANSWER_CACHE_TTL,
+        pipeline_max_size : int = PIPELINE_CACHE_SIZE,
+        pipeline_ttl : float = PIPELINE_CACHE_TTL,
+        enable_pipeline_tier : bool = True,
+    ) -> None:
+        self.exact_tier = exact_tier if exact_tier is not None else MemoryCacheTier(exact_max_size, exact_ttl)
+        self.pipeline_tier = None
+        if(enable_pipeline_tier):
+            self.pipeline_tier = pipeline_tier if pipeline_tier is not None else MemoryCacheTier(pipeline_max_size, pipeline_ttl)
+
+    @staticmethod
+    def normalize_query(query : str) -> str:
+        return re.sub(r"\s+", " ", query).strip().strip("?.!").strip().lower()
+
+    @staticmethod
+    def get_schema_fingerprint(schema_prompt : str) -> str:
+        return hashlib.sha256(schema_prompt.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def hash_key(*parts : object) -> str:
+        return hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest()
+
+    def get_keys(self, input_parameters : QueryInput, schema_prompt : str) -> dict[str, str]:
+        # The pipeline key leaves out the model: a validated pipeline is reusable whichever model formats the answer.
+        scope = [
+            input_parameters.connection_url,
+            input_parameters.database_name,
+            sorted(input_parameters.collection_list),
+            self.get_schema_fingerprint(schema_prompt),
+            self.get_schema_fingerprint(input_parameters.description),
+            self.normalize_query(input_parameters.query),
+            input_parameters.max_output_count,
+        ]
+        return {
+            "exact" : self.hash_key("exact", input_parameters.llm_name, *scope),
+            "pipeline" : self.hash_key("pipeline", *scope),
+        }
+
+    def get_answer(self, cache_keys : dict[str, str]) -> str | None:
+        return self.exact_tier.get(cache_keys["exact"])
+
+    def set_answer(self, cache_keys : dict[str, str], answer : str) -> None:
+        self.exact_tier.set(cache_keys["exact"], answer)
+
+    def get_pipeline(self, cache_keys : dict[str, str]) -> dict | None:
+        if(self.pipeline_tier is None):
+            return None
+        return self.pipeline_tier.get(cache_keys["pipeline"])
+
+    def set_pipeline(self, cache_keys : dict[str, str], collection_name : str, mongodb_pipeline : list[dict]) -> None:
+        if(self.pipeline_tier is None):
+            return
+        self.pipeline_tier.set(cache_keys["pipeline"], {"collection_name" : collection_name, "mongodb_pipeline" : mongodb_pipeline})
+
+    def invalidate_pipeline(self, cache_keys : dict[str, str]) -> None:
+        if(self.pipeline_tier is not None):
+            self.pipeline_tier.invalidate(cache_keys["pipeline"])
+
+    def get_stats(self) -> dict:
+        return {
+            "exact" : self.exact_tier.get_stats(),
+            "pipeline" : self.pipeline_tier.get_stats() if self.pipeline_tier is not None else None,
+        }
@@ -0,0 +1,35 @@
+from src.llm import BaseLLM
+from src.Schemas import QueryInput
+from src.Constant import SPECULATIVE_CANDIDATES, SPECULATIVE_MAX_CANDIDATES, SPECULATIVE_CONCURRENCY, SPECULATIVE_TEMPERATURE_STEP, SPECULATIVE_MAX_TEMPERATURE
+
+
+class CandidatePlanner:
+    def __init__(
+        self,
+        candidate_count : int = SPECULATIVE_CANDIDATES,
+        max_candidates : int = SPECULATIVE_MAX_CANDIDATES,
+        concurrency : int = SPECULATIVE_CONCURRENCY,
+        temperature_step : float = SPECULATIVE_TEMPERATURE_STEP,
+        max_temperature : float = SPECULATIVE_MAX_TEMPERATURE,
+        llms : dict[str, BaseLLM] | None = None,
+    ) -> None:
+        self.candidate_count = candidate_count
+        self.max_candidates = max_candidates
+        self.concurrency = concurrency
+        self.temperature_step = temperature_step
+        self.max_temperature = max_temperature
+        self.llms = llms or {}
+
+    def get_candidate_count(self, input_parameters : QueryInput) -> int:
+        candidate_count = input_parameters.speculative_candidates if input_parameters.speculative_candidates is not None else self.candidate_count
+        return max(1, min(candidate_count, self.max_candidates))
+
+    def plan(self, llm : BaseLLM, input_parameters : QueryInput) -> list[dict]:
+        # Candidates alternate between the requested model and the other backends, and the temperature rises once every backend has been used.
+        backends = [(input_parameters.llm_name, llm)] + [(model, backend) for model, backend in self.llms.items() if model != input_parameters.llm_name]
+        candidates = []
+        for index in range(self.get_candidate_count(input_parameters)):
+            model, backend = backends[index % len(backends)]
+            temperature = input_parameters.temperature + (index // len(backends)) * self.temperature_step
+            candidates.append({"index" : index, "llm" : backend, "model" : model, "temperature" : min(temperature, max(self.max_temperature, input_parameters.temperature))})
+        return candidates
@@ -1,4 +1,5 @@
 from textwrap import dedent
+from datetime import datetime
 import json
 
 MISTRAL_CODE_MODEL = "codestral-latest"
@@ -6,14 +7,170 @@ MISTRAL_LLM_TEMPERATURE = 0.0
 MAX_ITERATION = 10
 MONGODB = "MongoDB"
 OPENAI_GPT4_MODEL = "gpt-4-turbo-2024-04-09"
+OPENAI_PROMPT_CACHE_KEY = True
+
+MONGO_CLIENT_REGISTRY_SIZE = 16
+MONGO_MAX_POOL_SIZE = 50
+MONGO_MIN_POOL_SIZE = 0
+MONGO_MAX_IDLE_TIME_MS = 300000
+MONGO_SERVER_SELECTION_TIMEOUT_MS = 10000
+MONGO_HEALTH_CHECK_INTERVAL = 30.0
+MONGO_CLIENT_CLOSE_GRACE_PERIOD = 300.0
+MONGO_EXECUTION_MAX_TIME_MS = 30000
+MONGO_EXECUTION_ALLOW_DISK_USE = True
+
+SCHEMA_CACHE_SIZE = 256
+SCHEMA_CACHE_TTL = 86400.0
+SCHEMA_CACHE_STATS_TOLERANCE = 0.1
+
+SCHEMA_INFERENCE_AUTO = "auto"
+SCHEMA_INFERENCE_FULL = "full"
+SCHEMA_INFERENCE_SAMPLE = "sample"
+SCHEMA_INFERENCE_FIRST_LAST = "first_last"
+SCHEMA_SAMPLE_SIZE = 1000
+SCHEMA_FULL_SCAN_MAX_DOCUMENTS = 100000
+SCHEMA_INTROSPECTION_CONCURRENCY = 4
+SCHEMA_CATALOG_REFRESH_INTERVAL = 600.0
+SCHEMA_CATALOG_REFRESH_JITTER = 0.1
+SCHEMA_CATALOG_MAX_AGE = 900.0
+SCHEMA_CATALOG_CONCURRENCY = 4
+
+STREAM_FORMAT_NDJSON = "ndjson"
+STREAM_FORMAT_SSE = "sse"
+STREAM_HEARTBEAT_INTERVAL = 15.0
+STREAM_EVENT_STARTED = "started"
+STREAM_EVENT_SCHEMA_READY = "schema_ready"
+STREAM_EVENT_PIPELINE_GENERATED = "pipeline_generated"
+STREAM_EVENT_VALIDATION = "validation"
+STREAM_EVENT_ROWS_FETCHED = "rows_fetched"
+STREAM_EVENT_ANSWER_TOKEN = "answer_token"
+STREAM_EVENT_FINAL_ANSWER = "final_answer"
+STREAM_EVENT_HEARTBEAT = "heartbeat"
+STREAM_EVENT_ERROR = "error"
+STREAM_EVENT_BATCH_RESULT = "batch_result"
+STREAM_EVENT_BATCH_DONE = "batch_done"
+BATCH_MAX_QUERIES = 50
+BATCH_CONCURRENCY = 8
+
+ANSWER_CACHE_TIER_EXACT = "exact"
+ANSWER_CACHE_TIER_PIPELINE = "pipeline"
+ANSWER_CACHE_SIZE = 1024
+ANSWER_CACHE_TTL = 300.0
+PIPELINE_CACHE_SIZE = 4096
+PIPELINE_CACHE_TTL = 86400.0
+LLM_CACHE_SIZE = 2048
+LLM_CACHE_TTL = 3600.0
+LLM_CACHE_DISK_SIZE = 20000
+
+PIPELINE_LIBRARY_MAX_ENTRIES = 5000
+PIPELINE_LIBRARY_TOP_K = 3
+PIPELINE_LIBRARY_MIN_SIMILARITY = 0.2
+PIPELINE_LIBRARY_COMPACT_RATIO = 2
+TEXT_INDEX_REFRESH_CHANGES = 256
+
+ANALYSIS_SOURCE_LLM = "llm"
+ANALYSIS_SOURCE_RULES = "rules"
+
+EXPLAIN_COST_BUDGET = 1000000
+
+CONTEXT_TOKEN_LIMITS = {MISTRAL_CODE_MODEL : 28000, OPENAI_GPT4_MODEL : 120000}
+CONTEXT_DEFAULT_TOKEN_LIMIT = 28000
+CONTEXT_RESULT_TOKEN_LIMIT = 4000
+CONTEXT_SUMMARY_CHARACTERS = 300
+CONTEXT_MIN_MESSAGE_TOKENS = 64
+CONTEXT_TRUNCATION_MARKER = "\n[... truncated to fit the context window ...]\n"
+
+SCHEMA_PRUNING_MAX_COLLECTIONS = 3
+SCHEMA_PRUNING_MAX_FIELDS = 40
+SCHEMA_PRUNING_MIN_SCORE = 0.3
+SCHEMA_PRUNING_RELATIVE_SCORE = 0.5
+SCHEMA_PRUNING_EXAMPLE_COUNT = 3
+
+TELEMETRY_SERVICE_NAME = "querygen"
+TELEMETRY_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+TELEMETRY_DOCUMENT_BUCKETS = [0, 1, 5, 10, 25, 50, 100, 250, 500, 1000]
+TELEMETRY_RATIO_BUCKETS = [0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0]
+LLM_TOKEN_PRICES = {MISTRAL_CODE_MODEL : (1.0, 3.0), OPENAI_GPT4_MODEL : (10.0, 30.0)}
+LOG_LEVEL = "INFO"
+LOG_SAMPLE_RATE = 1.0
+
+SPECULATIVE_CANDIDATES = 1
+SPECULATIVE_MAX_CANDIDATES = 4
+SPECULATIVE_CONCURRENCY = 4
+SPECULATIVE_TEMPERATURE_STEP = 0.3
+SPECULATIVE_MAX_TEMPERATURE = 1.0
+
+BUDGET_LIMIT_ITERATIONS = "iterations"
+BUDGET_LIMIT_WALL_CLOCK = "wall_clock"
+BUDGET_LIMIT_TOKENS = "tokens"
+BUDGET_LIMIT_MONGO_TIME = "mongo_time"
+BUDGET_MAX_ITERATIONS = MAX_ITERATION
+BUDGET_MAX_SECONDS = 120.0
+BUDGET_MAX_TOKENS = 200000
+BUDGET_MAX_MONGO_MS = 60000
+
+LLM_REQUEST_TIMEOUT = 60.0
+LLM_MAX_RETRIES = 3
+LLM_RETRY_BACKOFF = 0.5
+LLM_RETRY_MAX_BACKOFF = 8.0
+LLM_RETRYABLE_STATUS = [408, 409, 425, 429]
+LLM_MAX_CONCURRENCY = {MISTRAL_CODE_MODEL : 8, OPENAI_GPT4_MODEL : 8}
+LLM_REQUESTS_PER_MINUTE = {MISTRAL_CODE_MODEL : 300.0, OPENAI_GPT4_MODEL : 500.0}
+LLM_HEDGE_DELAY = 0.0
+LLM_FAILURE_THRESHOLD = 3
+LLM_FAILURE_COOLDOWN = 30.0
+
+JOB_STATUS_QUEUED = "queued"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_SUCCEEDED = "succeeded"
+JOB_STATUS_FAILED = "failed"
+JOB_STATUS_CANCELLED = "cancelled"
+JOB_PRIORITY_HIGH = "high"
+JOB_PRIORITY_NORMAL = "normal"
+JOB_PRIORITY_LOW = "low"
+JOB_PRIORITIES = {JOB_PRIORITY_HIGH : 0, JOB_PRIORITY_NORMAL : 1, JOB_PRIORITY_LOW : 2}
+JOB_WORKER_COUNT = 4
+JOB_MAX_QUEUED = 100
+JOB_RESULT_TTL = 3600.0
+JOB_POLL_INTERVAL = 1.0
+JOB_WEBHOOK_TIMEOUT = 10.0
+JOB_WEBHOOK_RETRIES = 3
+JOB_LEASE_TIMEOUT = 60.0
+SERVER_WORKERS = 1
+SERVER_WORKER_TIMEOUT = 300
+
+
+AGENT_PROMPT_INSTRUCTIONS = dedent(
+    """
+    As a PyMongo agent, your main responsibility is to interact with a MongoDB database. For each task assigned to you, you must create a syntactically correct pipeline. This pipeline will then be passed to a tool that checks the output of the generated pipeline. The tool is already connected to the database through PyMongo, and the pipeline you provide will be used in the aggregate function associated with the specified collection.
+
+    Answer the following questions as best you can. You have access to the following tools:
+
+    "test_mongo_pipeline_query". 
+    Above function runs given query using PyMongo aggregation pipelines. It returns successful output or associated errors if pipeline is incorrect. 
+    Args:
+        mongodb_pipeline: MongoDb pipeline which need to be test on given collection
+        collection_name: collection_name on which mongodb pipeline will run through pymongo.
+        query_analysis_failed : boolean parameter to specify if given user query is not related to generating mongo pipeline query.
+
+    You must use above tool 'test_mongo_pipeline_query' for analyzing mongodb pipeline.
+
+    You must respond with a single function call and mongodb pipeline and single function input. Multiple function calls are strictly prohibited. 
+
+    EXAMPLES
+    ----
+    user_query: "How many users are there in given users collection?"
+    AI Assistant:
+    "action": "test_mongo_pipeline_query",
+    "action_input": {"mongodb_pipeline": "[{"$group": {"_id": None, "count": {"$sum": 1}}]", "collection_name": "Users", "query_analysis_failed": False}}"
+    """)
 
 
 def get_agent_prompt(collection_list : list[str], collection_explanation : str, db_description : str, database_type : str = MONGODB) -> str:
+    # The instructions come first and the database block last, so every request shares the longest possible cacheable prefix.
     if(database_type == MONGODB):
-        return dedent(
+        return AGENT_PROMPT_INSTRUCTIONS + dedent(
             f"""
-            As a PyMongo agent, your main responsibility is to interact with a MongoDB database. For each task assigned to you, you must create a syntactically correct pipeline. This pipeline will then be passed to a tool that checks the output of the generated pipeline. The tool is already connected to the database through PyMongo, and the pipeline you provide will be used in the aggregate function associated with the specified collection.
-
 
             You have been granted access to the following collections within the User database:
 
@@ -34,30 +191,38 @@ def get_agent_prompt(collection_list : list[str], collection_explanation : str,
     else:
         raise Exception("Not Implemented")
 
-def user_message(collection_list : list[str], collection_explanation : str, db_description : str, user_query : str, database_type : str = MONGODB) -> str:
-    return dedent(
-        f"""
-
-        Answer the following questions as best you can. You have access to the following tools:
+def format_prompt_value(value : object) -> str:
+    if(isinstance(value, datetime)):
+        return value.isoformat() + ("Z" if value.tzinfo is None else "")
+    return str(value)
 
-        "test_mongo_pipeline_query". 
-        Above function runs given query using PyMongo aggregation pipelines. It returns successful output or associated errors if pipeline is incorrect. 
-        Args:
-            mongodb_pipeline: MongoDb pipeline which need to be test on given collection
-            collection_name: collection_name on which mongodb pipeline will run through pymongo.
-            query_analysis_failed : boolean parameter to specify if given user query is not related to generating mongo pipeline query.
+def format_prompt_pipeline(pipeline : list[dict]) -> str:
+    # Dates are written as plain ISO strings, the form the generator is asked to use, instead of {"$date": ...} extended JSON.
+    return json.dumps(pipeline, default=format_prompt_value)
 
-        You must use above tool 'test_mongo_pipeline_query' for analyzing mongodb pipeline.
+def approved_pipeline_examples_msg(examples : list[dict]) -> str:
+    if(len(examples) == 0):
+        return ""
 
-        You must respond with a single function call and mongodb pipeline and single function input. Multiple function calls are strictly prohibited. 
+    output_string = []
+    for example in examples:
+        output_string.append(dedent(
+            f"""
+            user_query: "{example["question"]}"
+            "action_input": {{"mongodb_pipeline": "{format_prompt_pipeline(example["mongodb_pipeline"])}", "collection_name": "{example["collection_name"]}", "query_analysis_failed": False}}
+            """))
 
-        EXAMPLES
+    return dedent(
+        """
+        PREVIOUSLY APPROVED PIPELINES FOR SIMILAR QUESTIONS
         ----
-        user_query: "How many users are there in given users collection?"
-        AI Assistant:
-        "action": "test_mongo_pipeline_query",
-        "action_input": {{"mongodb_pipeline": "[{{"$group": {{"_id": None, "count": {{"$sum": 1}}}}]", "collection_name": "Users", "query_analysis_failed": False}}}}"
-        
+        The following pipelines were validated and executed successfully for similar questions on this database. Reuse their structure where it fits the current question.
+        """) + "".join(output_string)
+
+def user_message(user_query : str, approved_examples : str = "") -> str:
+    # Only the parts that change per question live here; the static instructions are in the system prompt.
+    return approved_examples + dedent(
+        f"""
 
         Begin!
 
@@ -233,13 +398,16 @@ def contains_error_msg(contains_incorrect_query_reason : str) -> str:
         """
     )
 
-def execute_query_user_msg(reached_max_count : bool, max_output_count : int, output_data : list) -> str:
+def execute_query_user_msg(reached_max_count : bool, max_output_count : int, output_data : list, omitted_count : int = 0) -> str:
+    output_string = "\n".join(output_data)
+    if(omitted_count > 0):
+        output_string = f"{output_string}\n... {omitted_count} more results were left out to fit the context window."
     if(reached_max_count == True):
         return dedent(
             f"""
             The AI-generated mongodb_pipeline worked and returned the following results:
             =========================================
-            {str(json.dumps(output_data, indent=4))}
+            {output_string}
             =========================================
 
             However, your search returned more than {max_output_count} results. To keep the output manageable, only the first {max_output_count} results are shown above. Please take a look at the results above and try to format the output in an easy-to-read way for user. """)
@@ -248,11 +416,47 @@ def execute_query_user_msg(reached_max_count : bool, max_output_count : int, out
             f"""
             The AI-generated mongodb_pipeline worked and returned the following results:
             =========================================
-            {str(json.dumps(output_data, indent=4))}
+            {output_string}
             =========================================
 
             Please take a look at the results above and try to format the output in an easy-to-read way for user. """)
     
+def superseded_attempts_assistant_msg(attempts : list[str]) -> str:
+    attempt_string = "\n".join(attempts)
+    return f"Earlier AI-generated mongodb_pipelines, now superseded:\n{attempt_string}"
+
+def superseded_attempts_user_msg(feedback : list[str]) -> str:
+    feedback_string = "\n".join(feedback)
+    return f"Those mongodb_pipelines were rejected for the following reasons, so do not repeat these mistakes:\n{feedback_string}"
+
+def execution_cost_exceeded_msg(collection_name : str, estimated_documents : int, cost_budget : int, indexed_fields : list[str]) -> str:
+    if(len(indexed_fields) > 0):
+        advice = f"Add a $match as the first stage and filter on an indexed field: {', '.join(indexed_fields)}."
+    else:
+        advice = f"The \"{collection_name}\" collection has no secondary index, so add a more selective $match as the first stage or aggregate over fewer documents."
+
+    return f"The mongodb_pipeline was not executed because it scans the whole \"{collection_name}\" collection and would examine about {estimated_documents} documents, above the budget of {cost_budget} documents. {advice}"
+
+def budget_exhausted_msg(limit : str, attempt_count : int, attempt : dict | None) -> str:
+    limit_descriptions = {
+        BUDGET_LIMIT_ITERATIONS : "the maximum number of attempts",
+        BUDGET_LIMIT_WALL_CLOCK : "the time limit",
+        BUDGET_LIMIT_TOKENS : "the token limit",
+        BUDGET_LIMIT_MONGO_TIME : "the database execution time limit",
+    }
+    message = f"I could not find a working mongodb_pipeline for this question before reaching {limit_descriptions.get(limit, limit)} of the request, after {attempt_count} attempts."
+    if(attempt is None):
+        return message
+
+    return dedent(
+            f"""
+            {message}
+
+            The closest attempt was this mongodb_pipeline on the "{attempt['collection_name']}" collection:
+            {format_prompt_pipeline(attempt['mongodb_pipeline'])}
+
+            It failed because: {attempt['feedback'] or 'no reason was given.'}""").strip()
+
 def execute_query_user_error_msg(error_string : str) -> str:
     return dedent(
             f"""
@@ -1,34 +1,287 @@
 from dependency_injector import containers, providers
-from src.DBReader import MongoReader
+from src.DBReader import MongoReader, AsyncMongoReader
+from src.MongoClientRegistry import MongoClientRegistry
+from src.SchemaCache import SchemaCache
+from src.AnswerCache import AnswerCache
+from src.SharedCache import SQLiteCacheTier
+from src.PipelineLibrary import PipelineLibrary
+from src.ContextCompactor import ContextCompactor
+from src.SchemaPruner import SchemaPruner
+from src.Telemetry import Telemetry
+from src.CandidatePlanner import CandidatePlanner
+from src.RequestBudget import BudgetController
+from src.LLMRouter import LLMRouter
+from src.LLMCache import LLMResponseCache, CachedLLM
+from src.SchemaCatalog import SchemaCatalog
+from src.JobQueue import JobManager, MemoryJobStore, SQLiteJobStore
+from src.Constant import MONGO_CLIENT_REGISTRY_SIZE, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_HEALTH_CHECK_INTERVAL, MONGO_CLIENT_CLOSE_GRACE_PERIOD, MONGO_EXECUTION_MAX_TIME_MS, MONGO_EXECUTION_ALLOW_DISK_USE, SCHEMA_CACHE_SIZE, SCHEMA_CACHE_TTL, SCHEMA_CACHE_STATS_TOLERANCE, SCHEMA_INFERENCE_AUTO, SCHEMA_SAMPLE_SIZE, SCHEMA_FULL_SCAN_MAX_DOCUMENTS, SCHEMA_INTROSPECTION_CONCURRENCY, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, PIPELINE_CACHE_SIZE, PIPELINE_CACHE_TTL, PIPELINE_LIBRARY_MAX_ENTRIES, PIPELINE_LIBRARY_TOP_K, PIPELINE_LIBRARY_MIN_SIMILARITY, EXPLAIN_COST_BUDGET, CONTEXT_TOKEN_LIMITS, CONTEXT_DEFAULT_TOKEN_LIMIT, CONTEXT_RESULT_TOKEN_LIMIT, CONTEXT_SUMMARY_CHARACTERS, SCHEMA_PRUNING_MAX_COLLECTIONS, SCHEMA_PRUNING_MAX_FIELDS, SCHEMA_PRUNING_MIN_SCORE, SCHEMA_PRUNING_RELATIVE_SCORE, TELEMETRY_SERVICE_NAME, SPECULATIVE_CANDIDATES, SPECULATIVE_MAX_CANDIDATES, SPECULATIVE_CONCURRENCY, SPECULATIVE_TEMPERATURE_STEP, SPECULATIVE_MAX_TEMPERATURE, BUDGET_MAX_ITERATIONS, BUDGET_MAX_SECONDS, BUDGET_MAX_TOKENS, BUDGET_MAX_MONGO_MS, LLM_REQUEST_TIMEOUT, LLM_MAX_RETRIES, LLM_RETRY_BACKOFF, LLM_RETRY_MAX_BACKOFF, LLM_MAX_CONCURRENCY, LLM_REQUESTS_PER_MINUTE, LLM_HEDGE_DELAY, LLM_FAILURE_THRESHOLD, LLM_FAILURE_COOLDOWN, SCHEMA_CATALOG_REFRESH_INTERVAL, SCHEMA_CATALOG_REFRESH_JITTER, SCHEMA_CATALOG_MAX_AGE, SCHEMA_CATALOG_CONCURRENCY, JOB_WORKER_COUNT, JOB_MAX_QUEUED, JOB_RESULT_TTL, JOB_POLL_INTERVAL, JOB_WEBHOOK_TIMEOUT, JOB_WEBHOOK_RETRIES, JOB_LEASE_TIMEOUT, MISTRAL_CODE_MODEL, OPENAI_GPT4_MODEL, OPENAI_PROMPT_CACHE_KEY, LLM_CACHE_SIZE, LLM_CACHE_TTL, LLM_CACHE_DISK_SIZE
 import os
+import json
 from mistralai.client import MistralClient
+from mistralai.async_client import MistralAsyncClient
+from motor.motor_asyncio import AsyncIOMotorClient
 from src.llm import MistralLLM, OpenAILLM
-from src.DBAgent import DBQueryAgent
-from openai import OpenAI
+from src.DBAgent import DBQueryAgent, AsyncDBQueryAgent
+from openai import OpenAI, AsyncOpenAI
+
+
+mongo_pool_options = dict(
+    max_size = int(os.environ.get("MONGO_CLIENT_REGISTRY_SIZE", MONGO_CLIENT_REGISTRY_SIZE)),
+    max_pool_size = int(os.environ.get("MONGO_MAX_POOL_SIZE", MONGO_MAX_POOL_SIZE)),
+    min_pool_size = int(os.environ.get("MONGO_MIN_POOL_SIZE", MONGO_MIN_POOL_SIZE)),
+    max_idle_time_ms = int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", MONGO_MAX_IDLE_TIME_MS)),
+    server_selection_timeout_ms = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", MONGO_SERVER_SELECTION_TIMEOUT_MS)),
+    close_grace_period = float(os.environ.get("MONGO_CLIENT_CLOSE_GRACE_PERIOD", MONGO_CLIENT_CLOSE_GRACE_PERIOD)),
+)
+
+schema_inference_options = dict(
+    inference_mode = os.environ.get("SCHEMA_INFERENCE_MODE", SCHEMA_INFERENCE_AUTO),
+    sample_size = int(os.environ.get("SCHEMA_SAMPLE_SIZE", SCHEMA_SAMPLE_SIZE)),
+    full_scan_max_documents = int(os.environ.get("SCHEMA_FULL_SCAN_MAX_DOCUMENTS", SCHEMA_FULL_SCAN_MAX_DOCUMENTS)),
+    introspection_concurrency = int(os.environ.get("SCHEMA_INTROSPECTION_CONCURRENCY", SCHEMA_INTROSPECTION_CONCURRENCY)),
+    execution_max_time_ms = int(os.environ.get("MONGO_EXECUTION_MAX_TIME_MS", MONGO_EXECUTION_MAX_TIME_MS)),
+    allow_disk_use = os.environ.get("MONGO_EXECUTION_ALLOW_DISK_USE", str(MONGO_EXECUTION_ALLOW_DISK_USE)).lower() == "true",
+)
+
+# With several worker processes, a shared cache file keeps one copy of the schema, answer and pipeline caches for all of them.
+shared_cache_path = os.environ.get("SHARED_CACHE_PATH")
+
+llm_router_enabled = os.environ.get("LLM_ROUTER_ENABLED", "true").lower() == "true"
+llm_cache_enabled = os.environ.get("LLM_CACHE_ENABLED", "true").lower() == "true"
+# The on-disk LLM response cache defaults to the shared cache file, so repeated calls are answered across restarts and workers.
+llm_cache_path = os.environ.get("LLM_CACHE_PATH", shared_cache_path)
+llm_request_timeout = float(os.environ.get("LLM_REQUEST_TIMEOUT", LLM_REQUEST_TIMEOUT))
 
 
 class Container(containers.DeclarativeContainer):
+    mongo_client_registry = providers.Singleton(
+        MongoClientRegistry,
+        health_check_interval = float(os.environ.get("MONGO_HEALTH_CHECK_INTERVAL", MONGO_HEALTH_CHECK_INTERVAL)),
+        **mongo_pool_options,
+    )
+
+    # Motor clients reconnect on their own and their ping is a coroutine, so the synchronous health check is disabled.
+    async_mongo_client_registry = providers.Singleton(
+        MongoClientRegistry,
+        health_check_interval = 0,
+        client_factory = AsyncIOMotorClient,
+        **mongo_pool_options,
+    )
+
+    shared_schema_tier = providers.Singleton(
+        SQLiteCacheTier, path = shared_cache_path, table = "schemas", max_size = int(os.environ.get("SCHEMA_CACHE_SIZE", SCHEMA_CACHE_SIZE)), ttl = float(os.environ.get("SCHEMA_CACHE_TTL", SCHEMA_CACHE_TTL))
+    ) if shared_cache_path else providers.Object(None)
+
+    shared_answer_tier = providers.Singleton(
+        SQLiteCacheTier, path = shared_cache_path, table = "answers", max_size = int(os.environ.get("ANSWER_CACHE_SIZE", ANSWER_CACHE_SIZE)), ttl = float(os.environ.get("ANSWER_CACHE_TTL", ANSWER_CACHE_TTL))
+    ) if shared_cache_path else providers.Object(None)
+
+    shared_pipeline_tier = providers.Singleton(
+        SQLiteCacheTier, path = shared_cache_path, table = "pipelines", max_size = int(os.environ.get("PIPELINE_CACHE_SIZE", PIPELINE_CACHE_SIZE)), ttl = float(os.environ.get("PIPELINE_CACHE_TTL", PIPELINE_CACHE_TTL))
+    ) if shared_cache_path else providers.Object(None)
+
+    schema_cache = providers.Singleton(
+        SchemaCache,
+        max_size = int(os.environ.get("SCHEMA_CACHE_SIZE", SCHEMA_CACHE_SIZE)),
+        ttl = float(os.environ.get("SCHEMA_CACHE_TTL", SCHEMA_CACHE_TTL)),
+        cache_dir = os.environ.get("SCHEMA_CACHE_DIR"),
+        validate_with_stats = os.environ.get("SCHEMA_CACHE_VALIDATE_STATS", "false").lower() == "true",
+        stats_tolerance = float(os.environ.get("SCHEMA_CACHE_STATS_TOLERANCE", SCHEMA_CACHE_STATS_TOLERANCE)),
+        shared_tier = shared_schema_tier,
+    )
+
+    answer_cache = providers.Singleton(
+        AnswerCache,
+        exact_tier = shared_answer_tier,
+        pipeline_tier = shared_pipeline_tier,
+        exact_max_size = int(os.environ.get("ANSWER_CACHE_SIZE", ANSWER_CACHE_SIZE)),
+        exact_ttl = float(os.environ.get("ANSWER_CACHE_TTL", ANSWER_CACHE_TTL)),
+        pipeline_max_size = int(os.environ.get("PIPELINE_CACHE_SIZE", PIPELINE_CACHE_SIZE)),
+        pipeline_ttl = float(os.environ.get("PIPELINE_CACHE_TTL", PIPELINE_CACHE_TTL)),
+        enable_pipeline_tier = os.environ.get("PIPELINE_CACHE_ENABLED", "true").lower() == "true",
+    )
+
+    pipeline_library = providers.Singleton(
+        PipelineLibrary,
+        index_path = os.environ.get("PIPELINE_LIBRARY_PATH"),
+        max_entries = int(os.environ.get("PIPELINE_LIBRARY_MAX_ENTRIES", PIPELINE_LIBRARY_MAX_ENTRIES)),
+        top_k = int(os.environ.get("PIPELINE_LIBRARY_TOP_K", PIPELINE_LIBRARY_TOP_K)),
+        min_similarity = float(os.environ.get("PIPELINE_LIBRARY_MIN_SIMILARITY", PIPELINE_LIBRARY_MIN_SIMILARITY)),
+    )
+
+    telemetry = providers.Singleton(
+        Telemetry,
+        service_name = os.environ.get("TELEMETRY_SERVICE_NAME", TELEMETRY_SERVICE_NAME),
+        otlp_endpoint = os.environ.get("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT"),
+    )
+
+    context_compactor = providers.Singleton(
+        ContextCompactor,
+        token_limits = json.loads(os.environ.get("CONTEXT_TOKEN_LIMITS", json.dumps(CONTEXT_TOKEN_LIMITS))),
+        default_token_limit = int(os.environ.get("CONTEXT_DEFAULT_TOKEN_LIMIT", CONTEXT_DEFAULT_TOKEN_LIMIT)),
+        result_token_limit = int(os.environ.get("CONTEXT_RESULT_TOKEN_LIMIT", CONTEXT_RESULT_TOKEN_LIMIT)),
+        summary_characters = int(os.environ.get("CONTEXT_SUMMARY_CHARACTERS", CONTEXT_SUMMARY_CHARACTERS)),
+        enabled = os.environ.get("CONTEXT_COMPACTION_ENABLED", "true").lower() == "true",
+    )
+
+    schema_pruner = providers.Singleton(
+        SchemaPruner,
+        max_collections = int(os.environ.get("SCHEMA_PRUNING_MAX_COLLECTIONS", SCHEMA_PRUNING_MAX_COLLECTIONS)),
+        max_fields = int(os.environ.get("SCHEMA_PRUNING_MAX_FIELDS", SCHEMA_PRUNING_MAX_FIELDS)),
+        min_score = float(os.environ.get("SCHEMA_PRUNING_MIN_SCORE", SCHEMA_PRUNING_MIN_SCORE)),
+        relative_score = float(os.environ.get("SCHEMA_PRUNING_RELATIVE_SCORE", SCHEMA_PRUNING_RELATIVE_SCORE)),
+    )
+
+    budget_controller = providers.Singleton(
+        BudgetController,
+        max_iterations = int(os.environ.get("BUDGET_MAX_ITERATIONS", BUDGET_MAX_ITERATIONS)),
+        max_seconds = float(os.environ.get("BUDGET_MAX_SECONDS", BUDGET_MAX_SECONDS)),
+        max_tokens = int(os.environ.get("BUDGET_MAX_TOKENS", BUDGET_MAX_TOKENS)),
+        max_mongo_ms = int(os.environ.get("BUDGET_MAX_MONGO_MS", BUDGET_MAX_MONGO_MS)),
+    )
+
     mongo_client = providers.Factory(
-        MongoReader
+        MongoReader,
+        client_registry = mongo_client_registry,
+        schema_cache = schema_cache,
+        **schema_inference_options,
+    )
+
+    async_mongo_client = providers.Factory(
+        AsyncMongoReader,
+        client_registry = async_mongo_client_registry,
+        schema_cache = schema_cache,
+        **schema_inference_options,
     )
 
+    # SCHEMA_CATALOG lists the databases introspected at startup and kept warm in the background.
+    schema_catalog = providers.Singleton(
+        SchemaCatalog,
+        reader_factory = async_mongo_client.provider,
+        databases = json.loads(os.environ.get("SCHEMA_CATALOG", "[]")),
+        refresh_interval = float(os.environ.get("SCHEMA_CATALOG_REFRESH_INTERVAL", SCHEMA_CATALOG_REFRESH_INTERVAL)),
+        refresh_jitter = float(os.environ.get("SCHEMA_CATALOG_REFRESH_JITTER", SCHEMA_CATALOG_REFRESH_JITTER)),
+        max_age = float(os.environ.get("SCHEMA_CATALOG_MAX_AGE", SCHEMA_CATALOG_MAX_AGE)),
+        concurrency = int(os.environ.get("SCHEMA_CATALOG_CONCURRENCY", SCHEMA_CATALOG_CONCURRENCY)),
+    )
+
+    # The router retries on its own, so the SDK retries are turned off behind it. Mistral counts the first attempt as a retry.
     mistral_client = providers.Singleton(
-        MistralClient, api_key = os.environ["MISTRALAI_API_KEY"]
+        MistralClient, api_key = os.environ["MISTRALAI_API_KEY"], timeout = int(llm_request_timeout), max_retries = 1 if llm_router_enabled else 5
+    )
+
+    mistral_async_client = providers.Singleton(
+        MistralAsyncClient, api_key = os.environ["MISTRALAI_API_KEY"], timeout = int(llm_request_timeout), max_retries = 1 if llm_router_enabled else 5
     )
 
     openai_client = providers.Singleton(
-        OpenAI, api_key = os.environ["OPENAI_API_KEY"]
+        OpenAI, api_key = os.environ["OPENAI_API_KEY"], timeout = llm_request_timeout, max_retries = 0 if llm_router_enabled else 2
+    )
+
+    openai_async_client = providers.Singleton(
+        AsyncOpenAI, api_key = os.environ["OPENAI_API_KEY"], timeout = llm_request_timeout, max_retries = 0 if llm_router_enabled else 2
     )
 
     mistral_llm = providers.Singleton(
-        MistralLLM, mistral_client = mistral_client
+        MistralLLM, mistral_client = mistral_client, mistral_async_client = mistral_async_client, telemetry = telemetry
     )
 
     openai_llm = providers.Singleton(
-        OpenAILLM, openai_client = openai_client
+        OpenAILLM, openai_client = openai_client, openai_async_client = openai_async_client, telemetry = telemetry,
+        prompt_cache_key = os.environ.get("OPENAI_PROMPT_CACHE_KEY", str(OPENAI_PROMPT_CACHE_KEY)).lower() == "true"
+    )
+
+    llm_router = providers.Singleton(
+        LLMRouter,
+        backends = providers.Dict({MISTRAL_CODE_MODEL : mistral_llm, OPENAI_GPT4_MODEL : openai_llm}),
+        telemetry = telemetry,
+        timeout = llm_request_timeout,
+        max_retries = int(os.environ.get("LLM_MAX_RETRIES", LLM_MAX_RETRIES)),
+        retry_backoff = float(os.environ.get("LLM_RETRY_BACKOFF", LLM_RETRY_BACKOFF)),
+        retry_max_backoff = float(os.environ.get("LLM_RETRY_MAX_BACKOFF", LLM_RETRY_MAX_BACKOFF)),
+        max_concurrency = json.loads(os.environ.get("LLM_MAX_CONCURRENCY", json.dumps(LLM_MAX_CONCURRENCY))),
+        requests_per_minute = json.loads(os.environ.get("LLM_REQUESTS_PER_MINUTE", json.dumps(LLM_REQUESTS_PER_MINUTE))),
+        hedge_delay = float(os.environ.get("LLM_HEDGE_DELAY", LLM_HEDGE_DELAY)),
+        failover = os.environ.get("LLM_FAILOVER_ENABLED", "true").lower() == "true",
+        failure_threshold = int(os.environ.get("LLM_FAILURE_THRESHOLD", LLM_FAILURE_THRESHOLD)),
+        failure_cooldown = float(os.environ.get("LLM_FAILURE_COOLDOWN", LLM_FAILURE_COOLDOWN)),
+    )
+
+    llm_cache_tier = providers.Singleton(
+        SQLiteCacheTier, path = llm_cache_path, table = "llm_responses", max_size = int(os.environ.get("LLM_CACHE_DISK_SIZE", LLM_CACHE_DISK_SIZE)), ttl = float(os.environ.get("LLM_CACHE_TTL", LLM_CACHE_TTL))
+    ) if llm_cache_path else providers.Object(None)
+
+    llm_response_cache = providers.Singleton(
+        LLMResponseCache,
+        max_size = int(os.environ.get("LLM_CACHE_SIZE", LLM_CACHE_SIZE)),
+        ttl = float(os.environ.get("LLM_CACHE_TTL", LLM_CACHE_TTL)),
+        disk_tier = llm_cache_tier,
+        telemetry = telemetry,
+    )
+
+    cached_llm = providers.Factory(
+        CachedLLM, cache = llm_response_cache
+    )
+
+    candidate_llms = providers.Dict({MISTRAL_CODE_MODEL : llm_router, OPENAI_GPT4_MODEL : llm_router}) if llm_router_enabled else providers.Dict({MISTRAL_CODE_MODEL : mistral_llm, OPENAI_GPT4_MODEL : openai_llm})
+
+    # With cross-backend speculation the candidates alternate between the Mistral and OpenAI models.
+    candidate_planner = providers.Singleton(
+        CandidatePlanner,
+        candidate_count = int(os.environ.get("SPECULATIVE_CANDIDATES", SPECULATIVE_CANDIDATES)),
+        max_candidates = int(os.environ.get("SPECULATIVE_MAX_CANDIDATES", SPECULATIVE_MAX_CANDIDATES)),
+        concurrency = int(os.environ.get("SPECULATIVE_CONCURRENCY", SPECULATIVE_CONCURRENCY)),
+        temperature_step = float(os.environ.get("SPECULATIVE_TEMPERATURE_STEP", SPECULATIVE_TEMPERATURE_STEP)),
+        max_temperature = float(os.environ.get("SPECULATIVE_MAX_TEMPERATURE", SPECULATIVE_MAX_TEMPERATURE)),
+        llms = candidate_llms if os.environ.get("SPECULATIVE_CROSS_BACKEND", "false").lower() == "true" else None,
     )
     
 
+    # Setting JOB_STORE_PATH keeps the job queue in a SQLite file, so queued and interrupted jobs survive a restart.
+    job_store = providers.Singleton(
+        SQLiteJobStore, path = os.environ["JOB_STORE_PATH"]
+    ) if os.environ.get("JOB_STORE_PATH") else providers.Singleton(MemoryJobStore)
+
+    job_manager = providers.Singleton(
+        JobManager,
+        store = job_store,
+        worker_count = int(os.environ.get("JOB_WORKER_COUNT", JOB_WORKER_COUNT)),
+        max_queued = int(os.environ.get("JOB_MAX_QUEUED", JOB_MAX_QUEUED)),
+        result_ttl = float(os.environ.get("JOB_RESULT_TTL", JOB_RESULT_TTL)),
+        poll_interval = float(os.environ.get("JOB_POLL_INTERVAL", JOB_POLL_INTERVAL)),
+        webhook_timeout = float(os.environ.get("JOB_WEBHOOK_TIMEOUT", JOB_WEBHOOK_TIMEOUT)),
+        webhook_retries = int(os.environ.get("JOB_WEBHOOK_RETRIES", JOB_WEBHOOK_RETRIES)),
+        webhook_secret = os.environ.get("JOB_WEBHOOK_SECRET"),
+        webhook_allowed_hosts = [host.strip() for host in os.environ.get("JOB_WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()],
+        lease_timeout = float(os.environ.get("JOB_LEASE_TIMEOUT", JOB_LEASE_TIMEOUT)),
+        telemetry = telemetry,
+    )
+
     db_agent = providers.Factory(
-        DBQueryAgent
+        DBQueryAgent,
+        answer_cache = answer_cache,
+        pipeline_library = pipeline_library,
+        use_rule_validator = os.environ.get("RULE_VALIDATOR_ENABLED", "true").lower() == "true",
+        explain_cost_budget = int(os.environ.get("EXPLAIN_COST_BUDGET", EXPLAIN_COST_BUDGET)),
+        context_compactor = context_compactor,
+        schema_pruner = schema_pruner if os.environ.get("SCHEMA_PRUNING_ENABLED", "true").lower() == "true" else None,
+        telemetry = telemetry,
+        candidate_planner = candidate_planner,
+        budget_controller = budget_controller,
+        schema_catalog = schema_catalog,
     )
+
+    async_db_agent = providers.Factory(
+        AsyncDBQueryAgent,
+        answer_cache = answer_cache,
+        pipeline_library = pipeline_library,
+        use_rule_validator = os.environ.get("RULE_VALIDATOR_ENABLED", "true").lower() == "true",
+        explain_cost_budget = int(os.environ.get("EXPLAIN_COST_BUDGET", EXPLAIN_COST_BUDGET)),
+        context_compactor = context_compactor,
+        schema_pruner = schema_pruner if os.environ.get("SCHEMA_PRUNING_ENABLED", "true").lower() == "true" else None,
+        telemetry = telemetry,
+        candidate_planner = candidate_planner,
+        budget_controller = budget_controller,
+        schema_catalog = schema_catalog,
+    )
+
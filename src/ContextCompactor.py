@@ -0,0 +1,156 @@
+import threading
+from bson import json_util
+from src.llm import BaseLLM
+from src.Constant import CONTEXT_TOKEN_LIMITS, CONTEXT_DEFAULT_TOKEN_LIMIT, CONTEXT_RESULT_TOKEN_LIMIT, CONTEXT_SUMMARY_CHARACTERS, CONTEXT_MIN_MESSAGE_TOKENS, CONTEXT_TRUNCATION_MARKER, superseded_attempts_assistant_msg, superseded_attempts_user_msg
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+MESSAGE_TOKEN_OVERHEAD = 4
+
+
+class TokenCounter:
+    def __init__(self, encoding_name : str = "cl100k_base") -> None:
+        self.encoding = None
+        if(tiktoken is not None):
+            try:
+                self.encoding = tiktoken.get_encoding(encoding_name)
+            except Exception:
+                self.encoding = None
+
+    def count(self, text : str) -> int:
+        if(self.encoding is not None):
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return (len(text) + 3) // 4
+
+
+class ContextCompactor:
+    def __init__(
+        self,
+        token_counter : TokenCounter | None = None,
+        token_limits : dict[str, int] | None = None,
+        default_token_limit : int = CONTEXT_DEFAULT_TOKEN_LIMIT,
+        result_token_limit : int = CONTEXT_RESULT_TOKEN_LIMIT,
+        summary_characters : int = CONTEXT_SUMMARY_CHARACTERS,
+        enabled : bool = True,
+    ) -> None:
+        self.token_counter = token_counter if token_counter is not None else TokenCounter()
+        self.token_limits = token_limits if token_limits is not None else dict(CONTEXT_TOKEN_LIMITS)
+        self.default_token_limit = default_token_limit
+        self.result_token_limit = result_token_limit
+        self.summary_characters = summary_characters
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.counters = {"compactions" : 0, "tokens_before" : 0, "tokens_after" : 0, "collapsed_attempts" : 0, "truncated_messages" : 0, "omitted_results" : 0, "result_tokens_saved" : 0}
+
+    def get_token_limit(self, model : str) -> int:
+        return self.token_limits.get(model, self.default_token_limit)
+
+    def count_message_tokens(self, llm : BaseLLM, message : object) -> int:
+        return self.token_counter.count(llm.get_chat_content(message) or "") + MESSAGE_TOKEN_OVERHEAD
+
+    def count_tokens(self, llm : BaseLLM, messages : list) -> int:
+        return sum(self.count_message_tokens(llm, message) for message in messages)
+
+    def summarize(self, text : str) -> str:
+        text = " ".join(text.split())
+        if(len(text) > self.summary_characters):
+            return text[: self.summary_characters - 3] + "..."
+        return text
+
+    def truncate_results(self, output_data : list[str]) -> tuple[list[str], int, int]:
+        if(self.enabled == False):
+            return output_data, 0, 0
+
+        kept : list[str] = []
+        used_tokens = 0
+        for document in output_data:
+            tokens = self.token_counter.count(document) + 1
+            if(used_tokens + tokens > self.result_token_limit and len(kept) > 0):
+                break
+            kept.append(document)
+            used_tokens += tokens
+
+        omitted = output_data[len(kept):]
+        tokens_saved = sum(self.token_counter.count(document) + 1 for document in omitted)
+        if(len(omitted) > 0):
+            with self.lock:
+                self.counters["omitted_results"] += len(omitted)
+                self.counters["result_tokens_saved"] += tokens_saved
+        return kept, len(omitted), tokens_saved
+
+    def collapse_attempts(self, llm : BaseLLM, messages : list, attempts : list[dict]) -> tuple[list, int]:
+        # Every attempt but the latest is replaced by a one-line pipeline and the feedback that rejected it.
+        superseded = [attempt for attempt in attempts[:-1] if attempt["start"] < len(messages)]
+        if(len(superseded) == 0):
+            return messages, 0
+
+        pipelines, feedback = [], []
+        for number, attempt in enumerate(superseded, start=1):
+            pipelines.append(f"{number}. {self.summarize(attempt['collection_name'] + ': ' + json_util.dumps(attempt['mongodb_pipeline']))}")
+            feedback.append(f"{number}. {self.summarize(attempt['feedback'] or 'rejected without a reason.')}")
+
+        collapsed = [
+            llm.get_chat_message(role="assistant", content=superseded_attempts_assistant_msg(pipelines)),
+            llm.get_chat_message(role="user", content=superseded_attempts_user_msg(feedback)),
+        ]
+        return messages[: superseded[0]["start"]] + collapsed + messages[attempts[-1]["start"]:], len(superseded)
+
+    def shrink_message(self, llm : BaseLLM, message : object, target_tokens : int) -> object:
+        # The middle is cut so both the opening instructions and the closing question survive.
+        content = llm.get_chat_content(message) or ""
+        tokens = max(self.token_counter.count(content), 1)
+        characters = max(int(len(content) * target_tokens / tokens) - len(CONTEXT_TRUNCATION_MARKER), 0)
+        head = characters // 2
+        tail = characters - head
+        return llm.get_chat_message(role=llm.get_chat_role(message), content=content[:head] + CONTEXT_TRUNCATION_MARKER + (content[-tail:] if tail > 0 else ""))
+
+    def fit_token_limit(self, llm : BaseLLM, messages : list, token_limit : int) -> tuple[list, int]:
+        # The system prompt and the latest message are never shrunk.
+        messages = list(messages)
+        truncated = 0
+        token_counts = [self.count_message_tokens(llm, message) for message in messages]
+
+        while(sum(token_counts) > token_limit):
+            candidates = [index for index in range(1, len(messages) - 1) if token_counts[index] > CONTEXT_MIN_MESSAGE_TOKENS]
+            if(len(candidates) == 0):
+                break
+
+            index = max(candidates, key=lambda candidate : token_counts[candidate])
+            target_tokens = max(token_counts[index] - (sum(token_counts) - token_limit), CONTEXT_MIN_MESSAGE_TOKENS)
+            messages[index] = self.shrink_message(llm, messages[index], target_tokens)
+            new_count = self.count_message_tokens(llm, messages[index])
+            if(new_count >= token_counts[index]):
+                break
+            token_counts[index] = new_count
+            truncated += 1
+
+        return messages, truncated
+
+    def compact(self, llm : BaseLLM, messages : list, model : str, attempts : list[dict]) -> tuple[list, int]:
+        if(self.enabled == False):
+            return messages, 0
+
+        tokens_before = self.count_tokens(llm, messages)
+        compacted, collapsed = self.collapse_attempts(llm, messages, attempts)
+        compacted, truncated = self.fit_token_limit(llm, compacted, self.get_token_limit(model))
+        tokens_after = self.count_tokens(llm, compacted) if (collapsed + truncated) > 0 else tokens_before
+
+        with self.lock:
+            self.counters["compactions"] += 1
+            self.counters["tokens_before"] += tokens_before
+            self.counters["tokens_after"] += tokens_after
+            self.counters["collapsed_attempts"] += collapsed
+            self.counters["truncated_messages"] += truncated
+
+        return compacted, tokens_before - tokens_after
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                **self.counters,
+                "tokens_saved" : self.counters["tokens_before"] - self.counters["tokens_after"] + self.counters["result_tokens_saved"],
+                "tokenizer" : "tiktoken" if self.token_counter.encoding is not None else "characters",
+            }
@@ -1,179 +1,785 @@
 from src.Schemas import QueryInput, GraphState, PipelineCode, AnalyzeConditions
-from src.Constant import get_agent_prompt, MAX_ITERATION, execute_query_user_error_msg, contains_error_msg, prepare_analyze_tools, prepare_execution_tools, generate_pipeline_query_msg, analyze_pipeline_query_user_msg, intermediate_query_error_msg, contains_raw_output_error_msg, contains_DML_operation_error_msg, execute_query_user_msg, analyze_pipeline_query_assistant_msg, analyze_pipeline_query_user_msg_seccond, user_message
+from src.Constant import get_agent_prompt, execute_query_user_error_msg, contains_error_msg, prepare_analyze_tools, prepare_execution_tools, generate_pipeline_query_msg, analyze_pipeline_query_user_msg, intermediate_query_error_msg, contains_raw_output_error_msg, contains_DML_operation_error_msg, execute_query_user_msg, analyze_pipeline_query_assistant_msg, analyze_pipeline_query_user_msg_seccond, user_message, approved_pipeline_examples_msg, execution_cost_exceeded_msg, budget_exhausted_msg, EXPLAIN_COST_BUDGET, STREAM_EVENT_STARTED, STREAM_EVENT_SCHEMA_READY, STREAM_EVENT_PIPELINE_GENERATED, STREAM_EVENT_VALIDATION, STREAM_EVENT_ROWS_FETCHED, STREAM_EVENT_ANSWER_TOKEN, STREAM_EVENT_FINAL_ANSWER, ANSWER_CACHE_TIER_EXACT, ANSWER_CACHE_TIER_PIPELINE, ANALYSIS_SOURCE_LLM, ANALYSIS_SOURCE_RULES
 from src.llm import BaseLLM
 from src.DBReader import BaseDBReader
+from src.AnswerCache import AnswerCache
+from src.PipelineLibrary import PipelineLibrary
+from src.PipelineValidator import PipelineValidator
+from src.DateCoercer import DateCoercer
+from src.ContextCompactor import ContextCompactor
+from src.SchemaPruner import SchemaPruner
+from src.Telemetry import Telemetry
+from src.CandidatePlanner import CandidatePlanner
+from src.RequestBudget import BudgetController, RequestBudget
+from src.SchemaCatalog import SchemaCatalog
+import asyncio
+import contextlib
 import json
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import AsyncIterator, Callable, Iterator
 
 
 class DBQueryAgent:
-    def __init__(self, llm : BaseLLM, database : BaseDBReader) -> None:
+    def __init__(self, llm : BaseLLM, database : BaseDBReader, answer_cache : AnswerCache | None = None, pipeline_library : PipelineLibrary | None = None, use_rule_validator : bool = True, explain_cost_budget : int = EXPLAIN_COST_BUDGET, context_compactor : ContextCompactor | None = None, schema_pruner : SchemaPruner | None = None, telemetry : Telemetry | None = None, candidate_planner : CandidatePlanner | None = None, budget_controller : BudgetController | None = None, schema_catalog : SchemaCatalog | None = None) -> None:
         self.llm = llm
         self.database = database
+        self.answer_cache = answer_cache
+        self.pipeline_library = pipeline_library
+        self.use_rule_validator = use_rule_validator
+        self.explain_cost_budget = explain_cost_budget
+        self.context_compactor = context_compactor
+        self.schema_pruner = schema_pruner
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.candidate_planner = candidate_planner
+        self.budget_controller = budget_controller if budget_controller is not None else BudgetController()
+        self.budget : RequestBudget | None = None
+        self.schema_catalog = schema_catalog
     
-    def prepare_intial_messages(self, collection_list : list[str], collection_explanation : str, user_query : str, db_description : str) -> list:
+    def prepare_intial_messages(self, collection_list : list[str], collection_explanation : str, user_query : str, db_description : str, approved_examples : list[dict] | None = None) -> list:
         messages = [
             self.llm.get_chat_message(role="system", content=get_agent_prompt(collection_list, collection_explanation, db_description)),
-            self.llm.get_chat_message(role="user", content=user_message(collection_list, collection_explanation, db_description, user_query)) 
+            self.llm.get_chat_message(role="user", content=user_message(user_query, approved_examples=approved_pipeline_examples_msg(approved_examples or []))) 
         ]
 
         return messages
     
-    def convert_dates_in_query(self, query : list[dict]) -> list[dict]:
-
-        date_format = "%Y-%m-%d"
+    def convert_dates_in_query(self, query : list[dict], collection_name : str | None = None, collection_schema : dict[str, dict] | None = None) -> list[dict]:
+        return DateCoercer(collection_schema).coerce(query, collection_name)
+    
+    def get_context_messages(self, state : GraphState, input_parameters : QueryInput) -> list:
+        # The full history stays in the state; only the copy sent to the model is compacted.
+        if(self.context_compactor is None):
+            return state.messages
+        messages, tokens_saved = self.context_compactor.compact(self.llm, state.messages, input_parameters.llm_name, state.attempts)
+        state.tokens_saved = state.tokens_saved + tokens_saved
+        return messages
 
-        def is_date(string : str) -> bool:
-            check_date = []
-            try:
-                datetime.strptime(string, date_format)
-                check_date.append(True)
-            except:                    
-                check_date.append(False)
+    def record_attempt(self, state : GraphState) -> None:
+        state.attempts.append({"start" : len(state.messages) - 1, "collection_name" : state.generation.collection_name, "mongodb_pipeline" : state.generation.mongodb_pipeline, "feedback" : None, "stage" : None})
+
+    def record_attempt_feedback(self, state : GraphState, feedback : str, stage : str) -> None:
+        if(len(state.attempts) > 0):
+            state.attempts[-1]["feedback"] = feedback
+            state.attempts[-1]["stage"] = stage
+
+    def start_budget(self, input_parameters : QueryInput) -> RequestBudget:
+        self.budget = self.budget_controller.create(input_parameters)
+        return self.budget
+
+    def record_token_usage(self, prompt_tokens : int | None, completion_tokens : int | None, cached_tokens : int | None = None) -> None:
+        if(self.budget is not None):
+            self.budget.add_tokens(prompt_tokens, completion_tokens, cached_tokens)
+
+    def record_mongo_time(self, execution_ms : float) -> None:
+        if(self.budget is not None):
+            self.budget.add_mongo_ms(execution_ms)
+
+    def get_remaining_mongo_ms(self) -> int | None:
+        if(self.budget is None):
+            return None
+        return self.budget.get_remaining_mongo_ms()
+
+    def get_request_usage(self) -> dict | None:
+        # Reported once per answered request, so the cached-token ratio covers every LLM call the request made.
+        if(self.budget is None):
+            return None
+        usage = self.budget.get_usage()
+        self.telemetry.record_request_usage(usage)
+        return usage
+
+    def get_exhausted_limit(self, state : GraphState, input_parameters : QueryInput) -> str | None:
+        if(self.budget is None):
+            self.start_budget(input_parameters)
+        return self.budget.get_exhausted_limit(len(state.attempts))
+
+    def get_best_attempt(self, state : GraphState) -> dict | None:
+        # A pipeline that passed validation and only failed on execution is closer to an answer than a rejected one.
+        executed_attempts = [attempt for attempt in state.attempts if attempt["stage"] == "execution"]
+        attempts = executed_attempts if len(executed_attempts) > 0 else state.attempts
+        return attempts[-1] if len(attempts) > 0 else None
+
+    def apply_budget_exhausted(self, state : GraphState, limit : str) -> GraphState:
+        self.telemetry.record_budget_exhausted(limit)
+        state.budget_exhausted = limit
+        state.messages.append(self.llm.get_chat_message(role="assistant", content=budget_exhausted_msg(limit, len(state.attempts), self.get_best_attempt(state))))
+        return state
 
-            try:
-                datetime.fromisoformat(string)
-                check_date.append(True)
-            except:                    
-                check_date.append(False)
-            
-            return bool(sum(check_date))
-
-        def convert_dates(obj : dict | list) -> datetime:
-            if isinstance(obj, dict):
-                for key, value in obj.items():
-                    if isinstance(value, str) and is_date(value):
-                        try:
-                            obj[key] = datetime.strptime(value, date_format)
-                        except:
-                            obj[key] = datetime.fromisoformat(value)
-
-                    elif isinstance(value, dict) or isinstance(value, list):
-                        convert_dates(value)
-            elif isinstance(obj, list):
-                for item in obj:
-                    convert_dates(item)
-
-        query_copy = json.loads(json.dumps(query))
-        convert_dates(query_copy)
-        return query_copy
-    
-    def generate_pipeline_query(self, state: GraphState, input_parameters : QueryInput) -> GraphState:
-        output = self.llm.invoke(model = input_parameters.llm_name, temperature = input_parameters.temperature, tools=prepare_execution_tools(), messages = state.messages)    
+    def apply_generation(self, state : GraphState, output : dict) -> GraphState:
         state.generation = PipelineCode(**output)
 
         state.generation.mongodb_pipeline = json.loads(state.generation.mongodb_pipeline)
 
-        if(len(state.messages) > 1):
+        if(len(state.attempts) > 0):
             state.generation.query_analysis_failed = False
-        state.generation.mongodb_pipeline = self.convert_dates_in_query(state.generation.mongodb_pipeline)
+        state.generation.mongodb_pipeline = self.convert_dates_in_query(state.generation.mongodb_pipeline, state.generation.collection_name, state.collection_schema)
         state.messages.append(self.llm.get_chat_message(role="assistant", content=generate_pipeline_query_msg(state.generation.mongodb_pipeline, state.generation.collection_name, state.generation.query_analysis_failed)))
+        self.record_attempt(state)
         state.iterations = state.iterations + 1
 
-        return state 
-    
-    def analyze_pipeline_query(self, state : GraphState, input_parameters : QueryInput) -> GraphState:
+        return state
+
+    def get_usage_callback(self, candidate : dict | None) -> Callable[[int | None, int | None, int | None], None]:
+        # Candidates charge the budget of the round that started them, even when their call ends after the round.
+        if(candidate is None or "usage_callback" not in candidate):
+            return self.record_token_usage
+        return candidate["usage_callback"]
+
+    def get_generation_backend(self, input_parameters : QueryInput, candidate : dict | None) -> tuple[BaseLLM, str, float]:
+        if(candidate is None):
+            return self.llm, input_parameters.llm_name, input_parameters.temperature
+        return candidate["llm"], candidate["model"], candidate["temperature"]
+
+    def get_generation_request(self, state : GraphState, input_parameters : QueryInput, candidate : dict | None) -> tuple[BaseLLM, dict]:
+        llm, model, temperature = self.get_generation_backend(input_parameters, candidate)
+        return llm, {"model" : model, "temperature" : temperature, "tools" : prepare_execution_tools(), "messages" : llm.convert_messages(self.get_context_messages(state, input_parameters), self.llm), "usage_callback" : self.get_usage_callback(candidate)}
+
+    def generate_pipeline_query(self, state: GraphState, input_parameters : QueryInput, candidate : dict | None = None) -> GraphState:
+        llm, request = self.get_generation_request(state, input_parameters, candidate)
+        return self.apply_generation(state, llm.invoke(**request))
+
+    def append_analysis_request(self, state : GraphState, input_parameters : QueryInput) -> GraphState:
         state.messages.append(self.llm.get_chat_message(
             role = "user", 
             content=analyze_pipeline_query_user_msg(input_parameters.query, state.generation.mongodb_pipeline, state.generation.collection_name)))
+        return state
 
-        response = self.llm.invoke(model=input_parameters.llm_name, messages=state.messages, tools=prepare_analyze_tools(input_parameters.query),  temperature = input_parameters.temperature)
+    def validate_with_rules(self, state : GraphState, input_parameters : QueryInput) -> AnalyzeConditions | None:
+        if(self.use_rule_validator == False):
+            return None
+        validator = PipelineValidator(input_parameters.collection_list, state.collection_schema)
+        return validator.validate(state.generation.collection_name, state.generation.mongodb_pipeline)
 
+    def apply_analysis(self, state : GraphState, response : dict, analysis_source : str = ANALYSIS_SOURCE_LLM) -> GraphState:
         response_schema = AnalyzeConditions(**response)
+        state.analysis = response_schema
+        state.analysis_source = analysis_source
 
         state.error = bool(response_schema.intermediate_query + response_schema.contains_raw_output + response_schema.contains_DML_operation + response_schema.incorrect_query)
 
-        if(state.error == False):
-            state = self.execute_query(state, input_parameters)
-        else:
+        if(state.error == True):
             output_message = []
+            feedback = []
             if(response_schema.intermediate_query == True):
                 output_message.append(intermediate_query_error_msg(response_schema.reason_for_intermediate_query))
+                feedback.append(response_schema.reason_for_intermediate_query)
 
             if(response_schema.contains_raw_output == True):
                 output_message.append(contains_raw_output_error_msg(response_schema.reason_for_contains_raw_output))
+                feedback.append(response_schema.reason_for_contains_raw_output)
 
             if(response_schema.contains_DML_operation == True):
                 output_message.append(contains_DML_operation_error_msg(response_schema.reason_for_contains_DML_operation))
+                feedback.append(response_schema.reason_for_contains_DML_operation)
 
             if(response_schema.incorrect_query == True):
                 output_message.append(contains_error_msg(response_schema.reason_for_incorrect_query))
+                feedback.append(response_schema.reason_for_incorrect_query)
+
+            self.record_attempt_feedback(state, " ".join(feedback), "validation")
 
-            state.messages.append(self.llm.get_chat_message(role = "assistant", content = analyze_pipeline_query_assistant_msg()))
+            # A rule verdict has no analysis request in the history, so the acknowledgement would follow another assistant message.
+            if(analysis_source == ANALYSIS_SOURCE_LLM):
+                state.messages.append(self.llm.get_chat_message(role = "assistant", content = analyze_pipeline_query_assistant_msg()))
             
             state.messages.append(self.llm.get_chat_message(role = "user", content = analyze_pipeline_query_user_msg_seccond(output_message, state.generation.mongodb_pipeline)))
+
+        return state
+    
+    def start_validation(self, state : GraphState, input_parameters : QueryInput, candidate : dict | None, attributes : dict) -> tuple[GraphState, dict | None]:
+        # A rule verdict settles the validation locally; otherwise the returned request is sent to the LLM analyzer.
+        rule_verdict = self.validate_with_rules(state, input_parameters)
+        if(rule_verdict is not None):
+            attributes["source"] = ANALYSIS_SOURCE_RULES
+            return self.apply_analysis(state, rule_verdict.model_dump(), ANALYSIS_SOURCE_RULES), None
+
+        state = self.append_analysis_request(state, input_parameters)
+        attributes["source"] = ANALYSIS_SOURCE_LLM
+        return state, {"model" : input_parameters.llm_name, "messages" : self.get_context_messages(state, input_parameters), "tools" : prepare_analyze_tools(input_parameters.query), "temperature" : input_parameters.temperature, "usage_callback" : self.get_usage_callback(candidate)}
+
+    def validate_pipeline_query(self, state : GraphState, input_parameters : QueryInput, candidate : dict | None = None) -> GraphState:
+        with self.telemetry.span("validation") as attributes:
+            state, request = self.start_validation(state, input_parameters, candidate, attributes)
+            if(request is None):
+                return state
+            return self.apply_analysis(state, self.llm.invoke(**request))
+
+    def analyze_pipeline_query(self, state : GraphState, input_parameters : QueryInput) -> GraphState:
+        state = self.validate_pipeline_query(state, input_parameters)
+
+        if(state.error == False):
+            state = self.execute_query(state, input_parameters)
         
         state.iterations = state.iterations + 1
 
         return state
 
-    def execute_query(self, state : GraphState, input_parameters : QueryInput):
+    def record_approved_pipeline(self, state : GraphState, input_parameters : QueryInput, execution_ms : float) -> None:
+        if(self.pipeline_library is not None):
+            self.pipeline_library.add(input_parameters.connection_url, input_parameters.database_name, input_parameters.query, state.generation.collection_name, state.generation.mongodb_pipeline, execution_ms)
+
+    def apply_execution_output(self, state : GraphState, input_parameters : QueryInput, output_data : list[str], reached_max_count : bool, execution_ms : float = 0.0) -> GraphState:
+        state.result_count = len(output_data)
+        state.reached_max_count = reached_max_count
+        omitted_count = 0
+        if(self.context_compactor is not None):
+            output_data, omitted_count, tokens_saved = self.context_compactor.truncate_results(output_data)
+            state.tokens_saved = state.tokens_saved + tokens_saved
+        state.messages.append(self.llm.get_chat_message(role = "user", content = execute_query_user_msg(reached_max_count, input_parameters.max_output_count, output_data, omitted_count)))
+        state.iterations = state.iterations + 1
+        state.error = False
+        return state
+
+    def apply_execution_error(self, state : GraphState, error : Exception) -> GraphState:
+        self.record_attempt_feedback(state, str(error), "execution")
+        state.messages.append(self.llm.get_chat_message(role = "user", content = execute_query_user_error_msg(str(error))))
+        state.iterations = state.iterations + 1
+        state.error = True
+        return state
+
+    def check_execution_cost(self, state : GraphState, estimated_documents : int | None) -> str | None:
+        # The guard is skipped when explain is unavailable, so a missing privilege never blocks execution.
+        if(estimated_documents is None or estimated_documents <= self.explain_cost_budget):
+            return None
+
+        indexes = (state.collection_indexes or {}).get(state.generation.collection_name) or []
+        indexed_fields = [field for field in self.database.get_indexed_fields(indexes) if field != "_id"]
+        return execution_cost_exceeded_msg(state.generation.collection_name, estimated_documents, self.explain_cost_budget, indexed_fields)
+
+    def is_single_aggregate(self, pipeline : object) -> bool:
+        # A total over the whole collection cannot be narrowed by an indexed filter, so the cost guard does not apply to it.
+        if(not isinstance(pipeline, list) or any(not isinstance(stage, dict) or len(stage) != 1 for stage in pipeline)):
+            return False
+        for stage in pipeline:
+            operator, body = next(iter(stage.items()))
+            if(operator == "$count"):
+                return True
+            if(operator == "$group"):
+                group_id = body.get("_id") if isinstance(body, dict) else None
+                return not isinstance(group_id, (dict, list)) and not (isinstance(group_id, str) and group_id.startswith("$"))
+            if(operator not in ["$project", "$addFields", "$set", "$unset", "$unwind"]):
+                return False
+        return False
+
+    def should_estimate_cost(self, state : GraphState) -> bool:
+        return self.explain_cost_budget > 0 and not self.is_single_aggregate(state.generation.mongodb_pipeline)
+
+    def estimate_execution_cost(self, state : GraphState) -> int | None:
+        if(not self.should_estimate_cost(state)):
+            return None
+        with self.telemetry.span("explain", collection=state.generation.collection_name):
+            return self.database.estimate_documents_examined(state.generation.collection_name, state.generation.mongodb_pipeline)
+
+    @contextlib.contextmanager
+    def track_execution(self, state : GraphState) -> Iterator[dict]:
+        # The caller stores what the database returned; Mongo time is charged to the budget even when the query fails.
+        execution = {"output_data" : [], "reached_max_count" : False, "execution_ms" : 0.0}
+        start_time = time.perf_counter()
         try:
-            result = self.database.run_pipeline_query(state.generation.collection_name, state.generation.mongodb_pipeline)
-            output_data = []
-            reached_max_count = False
+            with self.telemetry.span("mongo_execution", collection=state.generation.collection_name) as attributes:
+                yield execution
+                attributes.update(documents=len(execution["output_data"]), reached_max_count=execution["reached_max_count"])
+        finally:
+            execution["execution_ms"] = (time.perf_counter() - start_time) * 1000
+            self.record_mongo_time(execution["execution_ms"])
+        self.telemetry.record_documents(len(execution["output_data"]))
 
-            for i in result:
-                output_data.append(str(i))
-                if(len(output_data) > input_parameters.max_output_count):
-                    reached_max_count = True
-                    break
+    def get_fetch_arguments(self, state : GraphState, input_parameters : QueryInput) -> tuple:
+        return state.generation.collection_name, state.generation.mongodb_pipeline, input_parameters.max_output_count, self.get_remaining_mongo_ms()
 
-            state.messages.append(self.llm.get_chat_message(role = "user", content = execute_query_user_msg(reached_max_count, input_parameters.max_output_count, output_data)))
-            state.iterations = state.iterations + 1
-            state.error = False
-            return state
+    def execute_query(self, state : GraphState, input_parameters : QueryInput):
+        try:
+            cost_error = self.check_execution_cost(state, self.estimate_execution_cost(state))
+            if(cost_error is not None):
+                return self.apply_execution_error(state, Exception(cost_error))
+
+            with self.track_execution(state) as execution:
+                execution["output_data"], execution["reached_max_count"] = self.database.fetch_pipeline_results(*self.get_fetch_arguments(state, input_parameters))
+            self.record_approved_pipeline(state, input_parameters, execution["execution_ms"])
+            return self.apply_execution_output(state, input_parameters, execution["output_data"], execution["reached_max_count"], execution["execution_ms"])
         except Exception as e:
-            state.messages.append(self.llm.get_chat_message(role = "user", content = execute_query_user_error_msg(str(e))))
-            state.iterations = state.iterations + 1
-            state.error = True
-            return state
-    
-    def decide_to_finish(self, state: GraphState) -> bool:
+            return self.apply_execution_error(state, e)
 
-        if state.error == True:
-            return False
-        elif state.iterations > MAX_ITERATION:
-            return True
-        else:
-            return True
-        
-    def prepare_final_response(self, state : GraphState, input_parameters : QueryInput) -> GraphState:
-        output = self.llm.invoke(model = input_parameters.llm_name, temperature = input_parameters.temperature, messages = state.messages, return_tool = False)    
+    def decide_to_finish(self, state: GraphState) -> bool:
+        # A failed round is retried; the request budget is checked before every new round.
+        return state.error == False
         
+    def get_final_response_request(self, state : GraphState, input_parameters : QueryInput) -> dict:
+        return {"model" : input_parameters.llm_name, "temperature" : input_parameters.temperature, "messages" : self.get_context_messages(state, input_parameters), "usage_callback" : self.record_token_usage}
+
+    def apply_final_response(self, state : GraphState, output : str) -> GraphState:
         state.messages.append(self.llm.get_chat_message(content = output, role = "assistant"))
+        return state
+
+    def prepare_final_response(self, state : GraphState, input_parameters : QueryInput) -> GraphState:
+        return self.apply_final_response(state, self.llm.invoke(return_tool = False, **self.get_final_response_request(state, input_parameters)))
 
+    def use_speculation(self, state : GraphState, input_parameters : QueryInput) -> bool:
+        # Only the first round is speculative; later rounds repair a pipeline with the feedback of the previous one.
+        return self.candidate_planner is not None and len(state.attempts) == 0 and self.candidate_planner.get_candidate_count(input_parameters) > 1
+
+    def copy_state(self, state : GraphState) -> GraphState:
+        return state.model_copy(update={"messages" : list(state.messages), "attempts" : [dict(attempt) for attempt in state.attempts]})
+
+    def adopt_state(self, state : GraphState, candidate_state : GraphState) -> GraphState:
+        # Callers keep a reference to the state they passed in, so the selected candidate is copied into it.
+        for field in GraphState.model_fields:
+            setattr(state, field, getattr(candidate_state, field))
         return state
-        
+
+    def is_candidate_accepted(self, state : GraphState | None) -> bool:
+        return state is not None and not self.is_query_analysis_failed(state) and state.error == False and state.result_count is not None
+
+    def select_candidate_state(self, candidate_states : list[GraphState | None], errors : list[Exception | None], winner : int | None) -> GraphState:
+        # Without a passing candidate the loop goes on from the primary one, as the serial loop would have.
+        if(winner is not None):
+            return candidate_states[winner]
+        for candidate_state in candidate_states:
+            if(candidate_state is not None):
+                return candidate_state
+        raise errors[0]
+
+    def is_analysis_passed(self, state : GraphState) -> bool:
+        analysis = state.analysis
+        return analysis is not None and not (analysis.intermediate_query or analysis.contains_raw_output or analysis.contains_DML_operation or analysis.incorrect_query)
+
+    def is_round_stopped(self, candidate : dict, stop_event : threading.Event) -> bool:
+        # The iteration limit is checked between rounds; within a round only tokens, time and Mongo time stop new LLM calls.
+        budget = candidate.get("budget")
+        return stop_event.is_set() or (budget is not None and budget.get_exhausted_limit(0) is not None)
+
+    def run_candidate(self, state : GraphState, input_parameters : QueryInput, candidate : dict, stop_event : threading.Event) -> GraphState | None:
+        # The primary candidate always runs, so the round has a state to go on from.
+        if(candidate["index"] > 0 and self.is_round_stopped(candidate, stop_event)):
+            return None
+        with self.telemetry.span("candidate", model=candidate["model"], index=candidate["index"]):
+            state = self.generate_pipeline_query(state, input_parameters, candidate)
+            if(state.generation.query_analysis_failed == True or self.is_round_stopped(candidate, stop_event)):
+                return state
+
+            state = self.validate_pipeline_query(state, input_parameters, candidate)
+            if(state.error == False and not self.is_round_stopped(candidate, stop_event)):
+                state = self.execute_query(state, input_parameters)
+            state.iterations = state.iterations + 1
+            return state
+
+    def plan_candidates(self, input_parameters : QueryInput) -> list[dict]:
+        candidates = self.candidate_planner.plan(self.llm, input_parameters)
+        if(self.budget is not None):
+            for candidate in candidates:
+                candidate.update(budget=self.budget, usage_callback=self.budget.add_tokens)
+        return candidates
+
+    def collect_candidate(self, candidate_states : list[GraphState | None], errors : list[Exception | None], index : int, completed : object) -> bool:
+        # completed is a finished Future or Task; a failed candidate keeps its error and cannot win.
+        try:
+            candidate_states[index] = completed.result()
+        except Exception as e:
+            errors[index] = e
+            return False
+        return self.is_candidate_accepted(candidate_states[index])
+
+    def finish_speculative_round(self, state : GraphState, candidate_states : list[GraphState | None], errors : list[Exception | None], winner : int | None) -> GraphState:
+        self.telemetry.record_speculative_round(winner)
+        return self.adopt_state(state, self.select_candidate_state(candidate_states, errors, winner))
+
+    def run_speculative_round(self, state : GraphState, input_parameters : QueryInput) -> GraphState:
+        candidates = self.plan_candidates(input_parameters)
+        candidate_states : list[GraphState | None] = [None] * len(candidates)
+        errors : list[Exception | None] = [None] * len(candidates)
+        stop_event = threading.Event()
+        winner = None
+
+        with self.telemetry.span("speculative_generation", candidates=len(candidates)) as attributes:
+            executor = ThreadPoolExecutor(max_workers=max(1, min(self.candidate_planner.concurrency, len(candidates))))
+            futures = {executor.submit(self.run_candidate, self.copy_state(state), input_parameters, candidate, stop_event) : candidate["index"] for candidate in candidates}
+            try:
+                for future in as_completed(futures):
+                    if(self.collect_candidate(candidate_states, errors, futures[future], future)):
+                        winner = futures[future]
+                        break
+            finally:
+                # Candidates still running stop before their next LLM call or execution; their results are discarded.
+                stop_event.set()
+                executor.shutdown(wait=False, cancel_futures=True)
+            attributes["winner"] = winner
+
+        return self.finish_speculative_round(state, candidate_states, errors, winner)
+
     def run_loop(self, graph_state : GraphState, input_parameters : QueryInput) -> str:
         while True:
-            graph_state = self.generate_pipeline_query(graph_state, input_parameters)
+            exhausted_limit = self.get_exhausted_limit(graph_state, input_parameters)
+            if(exhausted_limit is not None):
+                return self.llm.get_chat_content(self.apply_budget_exhausted(graph_state, exhausted_limit).messages[-1])
+
+            speculative = self.use_speculation(graph_state, input_parameters)
+            if(speculative):
+                graph_state = self.run_speculative_round(graph_state, input_parameters)
+            else:
+                graph_state = self.generate_pipeline_query(graph_state, input_parameters)
 
             if graph_state.generation.query_analysis_failed == True:
                 return self.llm.get_chat_content(graph_state.messages[-1])
             
-            graph_state = self.analyze_pipeline_query(graph_state, input_parameters)
+            if(not speculative):
+                graph_state = self.analyze_pipeline_query(graph_state, input_parameters)
 
 
             decision = self.decide_to_finish(graph_state)
 
             if decision == True:
                 return self.llm.get_chat_content(self.prepare_final_response(graph_state, input_parameters).messages[-1])
-    
-    def execute_agent(self, input_parameters : QueryInput) -> str:
-        collection_explanation = self.database.prepare_schema_prompt(input_parameters.collection_list, input_parameters.max_output_count)
-        
-        initial_state = GraphState(
+
+    def get_approved_examples(self, input_parameters : QueryInput, collection_list : list[str]) -> list[dict]:
+        if(self.pipeline_library is None):
+            return []
+        return self.pipeline_library.search(input_parameters.connection_url, input_parameters.database_name, input_parameters.query, collection_list)
+
+    def prepare_initial_state(self, collection_explanation : str, input_parameters : QueryInput, collection_schema : dict[str, dict] | None = None, collection_indexes : dict[str, list[list[str]]] | None = None, prompt_collection_list : list[str] | None = None) -> GraphState:
+        collection_list = prompt_collection_list or input_parameters.collection_list
+        return self.build_initial_state(collection_explanation, input_parameters, collection_schema, collection_indexes, collection_list, self.get_approved_examples(input_parameters, collection_list))
+
+    def build_initial_state(self, collection_explanation : str, input_parameters : QueryInput, collection_schema : dict[str, dict] | None, collection_indexes : dict[str, list[list[str]]] | None, collection_list : list[str], approved_examples : list[dict]) -> GraphState:
+        return GraphState(
             error=False, 
-            messages=self.prepare_intial_messages(input_parameters.collection_list, collection_explanation, input_parameters.query, input_parameters.description),
+            messages=self.prepare_intial_messages(collection_list, collection_explanation, input_parameters.query, input_parameters.description, approved_examples),
             generation=None,
-            iterations=0
+            iterations=0,
+            collection_schema=collection_schema,
+            collection_indexes=collection_indexes
         )
+    
+    def prune_collection_schema(self, input_parameters : QueryInput, collection_schema : dict[str, dict]) -> dict[str, dict] | None:
+        if(self.schema_pruner is None):
+            return None
+        return self.schema_pruner.prune(input_parameters.query, collection_schema)
+
+    def is_query_analysis_failed(self, state : GraphState) -> bool:
+        return state.generation is not None and state.generation.query_analysis_failed == True
+
+    def get_answer_cache_keys(self, input_parameters : QueryInput, collection_explanation : str) -> dict[str, str] | None:
+        if(self.answer_cache is None or input_parameters.use_answer_cache == False):
+            return None
+        return self.answer_cache.get_keys(input_parameters, collection_explanation)
+
+    def apply_cached_pipeline(self, state : GraphState, cached_pipeline : dict) -> GraphState:
+        state.generation = PipelineCode(collection_name=cached_pipeline["collection_name"], mongodb_pipeline=cached_pipeline["mongodb_pipeline"])
+        state.messages.append(self.llm.get_chat_message(role="assistant", content=generate_pipeline_query_msg(state.generation.mongodb_pipeline, state.generation.collection_name, False)))
+        self.record_attempt(state)
+        state.iterations = state.iterations + 1
+        return state
 
-        return self.run_loop(initial_state, input_parameters)
-            
-        
+    def store_cached_answer(self, cache_keys : dict[str, str] | None, state : GraphState, answer : str) -> None:
+        # Only answers backed by a successfully executed pipeline are cached.
+        if(cache_keys is None or state.error == True or state.result_count is None or state.generation is None or state.generation.query_analysis_failed):
+            return
+        self.answer_cache.set_answer(cache_keys, answer)
+        self.answer_cache.set_pipeline(cache_keys, state.generation.collection_name, state.generation.mongodb_pipeline)
+
+    def lookup_schema_catalog(self, input_parameters : QueryInput) -> tuple[dict[str, dict], dict[str, list[list[str]]]] | None:
+        if(self.schema_catalog is None):
+            return None
+        return self.schema_catalog.lookup(input_parameters.connection_url, input_parameters.database_name, input_parameters.collection_list, input_parameters.max_output_count)
+
+    def load_collection_schema(self, input_parameters : QueryInput) -> tuple[dict[str, dict], dict[str, list[list[str]]]]:
+        cataloged = self.lookup_schema_catalog(input_parameters)
+        if(cataloged is not None):
+            return cataloged
+        collection_schema = self.database.prepare_collection_schema_json(input_parameters.collection_list, input_parameters.max_output_count)
+        collection_indexes = self.database.prepare_collection_index_json(input_parameters.collection_list)
+        return collection_schema, collection_indexes
+
+    def execute_agent(self, input_parameters : QueryInput, collection_data : tuple[dict[str, dict], dict[str, list[list[str]]]] | None = None) -> str:
+        # A caller running several questions on the same collections can pass the schema it already loaded.
+        self.start_budget(input_parameters)
+        with self.telemetry.span("schema", collections=len(input_parameters.collection_list)):
+            collection_schema, collection_indexes = collection_data if collection_data is not None else self.load_collection_schema(input_parameters)
+        pruned_schema = self.prune_collection_schema(input_parameters, collection_schema)
+        prompt_schema = pruned_schema if pruned_schema is not None else collection_schema
+        collection_explanation = self.database.render_schema_prompt(prompt_schema, collection_indexes)
         
+        initial_state = self.prepare_initial_state(collection_explanation, input_parameters, collection_schema, collection_indexes, list(prompt_schema.keys()))
+
+        cache_keys = self.get_answer_cache_keys(input_parameters, collection_explanation)
+        if(cache_keys is not None):
+            answer = self.answer_cache.get_answer(cache_keys)
+            if(answer is not None):
+                return answer
+
+            cached_pipeline = self.answer_cache.get_pipeline(cache_keys)
+            if(cached_pipeline is not None):
+                initial_state = self.execute_query(self.apply_cached_pipeline(initial_state, cached_pipeline), input_parameters)
+                if(initial_state.error == False):
+                    answer = self.llm.get_chat_content(self.prepare_final_response(initial_state, input_parameters).messages[-1])
+                    self.answer_cache.set_answer(cache_keys, answer)
+                    return answer
+                self.answer_cache.invalidate_pipeline(cache_keys)
+                initial_state = self.prepare_initial_state(collection_explanation, input_parameters, collection_schema, collection_indexes, list(prompt_schema.keys()))
+
+        answer = self.run_loop(initial_state, input_parameters)
+
+        # A pruned schema may have dropped what the question needed, so an irrelevant verdict is retried on the full schema.
+        if(pruned_schema is not None and self.is_query_analysis_failed(initial_state)):
+            initial_state = self.prepare_initial_state(self.database.render_schema_prompt(collection_schema, collection_indexes), input_parameters, collection_schema, collection_indexes)
+            answer = self.run_loop(initial_state, input_parameters)
+
+        self.get_request_usage()
+        self.store_cached_answer(cache_keys, initial_state, answer)
+        return answer
+
+
+class AsyncDBQueryAgent(DBQueryAgent):
+    async def prepare_initial_state(self, collection_explanation : str, input_parameters : QueryInput, collection_schema : dict[str, dict] | None = None, collection_indexes : dict[str, list[list[str]]] | None = None, prompt_collection_list : list[str] | None = None) -> GraphState:
+        collection_list = prompt_collection_list or input_parameters.collection_list
+        approved_examples = await asyncio.to_thread(self.get_approved_examples, input_parameters, collection_list)
+        return self.build_initial_state(collection_explanation, input_parameters, collection_schema, collection_indexes, collection_list, approved_examples)
+
+    async def load_collection_schema(self, input_parameters : QueryInput) -> tuple[dict[str, dict], dict[str, list[list[str]]]]:
+        cataloged = self.lookup_schema_catalog(input_parameters)
+        if(cataloged is not None):
+            return cataloged
+        return await asyncio.gather(
+            self.database.prepare_collection_schema_json(input_parameters.collection_list, input_parameters.max_output_count),
+            self.database.prepare_collection_index_json(input_parameters.collection_list),
+        )
+
+    async def generate_pipeline_query(self, state: GraphState, input_parameters : QueryInput, candidate : dict | None = None) -> GraphState:
+        llm, request = self.get_generation_request(state, input_parameters, candidate)
+        return self.apply_generation(state, await llm.invoke_async(**request))
 
+    async def validate_pipeline_query(self, state : GraphState, input_parameters : QueryInput, candidate : dict | None = None) -> GraphState:
+        with self.telemetry.span("validation") as attributes:
+            state, request = self.start_validation(state, input_parameters, candidate, attributes)
+            if(request is None):
+                return state
+            return self.apply_analysis(state, await self.llm.invoke_async(**request))
 
+    async def estimate_execution_cost(self, state : GraphState) -> int | None:
+        if(not self.should_estimate_cost(state)):
+            return None
+        with self.telemetry.span("explain", collection=state.generation.collection_name):
+            return await self.database.estimate_documents_examined(state.generation.collection_name, state.generation.mongodb_pipeline)
 
+    async def execute_query(self, state : GraphState, input_parameters : QueryInput):
+        try:
+            cost_error = self.check_execution_cost(state, await self.estimate_execution_cost(state))
+            if(cost_error is not None):
+                return self.apply_execution_error(state, Exception(cost_error))
+
+            with self.track_execution(state) as execution:
+                execution["output_data"], execution["reached_max_count"] = await self.database.fetch_pipeline_results(*self.get_fetch_arguments(state, input_parameters))
+            # The library appends to its file and rebuilds its index under a lock, so it is updated off the event loop.
+            await asyncio.to_thread(self.record_approved_pipeline, state, input_parameters, execution["execution_ms"])
+            return self.apply_execution_output(state, input_parameters, execution["output_data"], execution["reached_max_count"], execution["execution_ms"])
+        except Exception as e:
+            return self.apply_execution_error(state, e)
+
+    async def run_candidate(self, state : GraphState, input_parameters : QueryInput, candidate : dict, semaphore : asyncio.Semaphore, stop_event : threading.Event) -> GraphState | None:
+        async with semaphore:
+            if(candidate["index"] > 0 and self.is_round_stopped(candidate, stop_event)):
+                return None
+            with self.telemetry.span("candidate", model=candidate["model"], index=candidate["index"]):
+                state = await self.generate_pipeline_query(state, input_parameters, candidate)
+                if(state.generation.query_analysis_failed == True or self.is_round_stopped(candidate, stop_event)):
+                    return state
+
+                # The iteration is counted by stream_loop once the round is over.
+                state = await self.validate_pipeline_query(state, input_parameters, candidate)
+                if(state.error == False):
+                    state = await self.execute_query(state, input_parameters)
+                return state
+
+    async def run_speculative_round(self, state : GraphState, input_parameters : QueryInput) -> GraphState:
+        candidates = self.plan_candidates(input_parameters)
+        candidate_states : list[GraphState | None] = [None] * len(candidates)
+        errors : list[Exception | None] = [None] * len(candidates)
+        semaphore = asyncio.Semaphore(max(1, self.candidate_planner.concurrency))
+        stop_event = threading.Event()
+        winner = None
+
+        with self.telemetry.span("speculative_generation", candidates=len(candidates)) as attributes:
+            tasks = {asyncio.ensure_future(self.run_candidate(self.copy_state(state), input_parameters, candidate, semaphore, stop_event)) : candidate["index"] for candidate in candidates}
+            pending = set(tasks)
+            try:
+                while(len(pending) > 0 and winner is None):
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in sorted(done, key=lambda done_task : tasks[done_task]):
+                        if(self.collect_candidate(candidate_states, errors, tasks[task], task) and winner is None):
+                            winner = tasks[task]
+            finally:
+                stop_event.set()
+                for task in pending:
+                    task.cancel()
+            attributes["winner"] = winner
+
+        return self.finish_speculative_round(state, candidate_states, errors, winner)
+
+    async def prepare_final_response(self, state : GraphState, input_parameters : QueryInput) -> GraphState:
+        return self.apply_final_response(state, await self.llm.invoke_async(return_tool = False, **self.get_final_response_request(state, input_parameters)))
+
+    async def stream_final_response(self, state : GraphState, input_parameters : QueryInput) -> AsyncIterator[dict]:
+        output = []
+        async for token in self.llm.stream_async(**self.get_final_response_request(state, input_parameters)):
+            output.append(token)
+            yield {"event" : STREAM_EVENT_ANSWER_TOKEN, "data" : {"token" : token}}
+
+        self.apply_final_response(state, "".join(output))
+
+    async def stream_loop(self, graph_state : GraphState, input_parameters : QueryInput, stream_tokens : bool = True) -> AsyncIterator[dict]:
+        while True:
+            exhausted_limit = self.get_exhausted_limit(graph_state, input_parameters)
+            if(exhausted_limit is not None):
+                graph_state = self.apply_budget_exhausted(graph_state, exhausted_limit)
+                yield {"event" : STREAM_EVENT_FINAL_ANSWER, "data" : {"output" : self.llm.get_chat_content(graph_state.messages[-1]), "budget_exhausted" : exhausted_limit, "tokens_saved" : graph_state.tokens_saved}}
+                return
+
+            # A speculative round already validated and executed the selected candidate, so only its events are emitted.
+            speculative = self.use_speculation(graph_state, input_parameters)
+            if(speculative):
+                graph_state = await self.run_speculative_round(graph_state, input_parameters)
+            else:
+                graph_state = await self.generate_pipeline_query(graph_state, input_parameters)
+
+            if graph_state.generation.query_analysis_failed == True:
+                yield {"event" : STREAM_EVENT_FINAL_ANSWER, "data" : {"output" : self.llm.get_chat_content(graph_state.messages[-1])}}
+                return
+
+            yield {"event" : STREAM_EVENT_PIPELINE_GENERATED, "data" : {
+                "iteration" : graph_state.iterations,
+                "collection_name" : graph_state.generation.collection_name,
+                "mongodb_pipeline" : graph_state.generation.mongodb_pipeline,
+                "speculative" : speculative,
+            }}
+
+            if(not speculative):
+                graph_state = await self.validate_pipeline_query(graph_state, input_parameters)
+            valid = self.is_analysis_passed(graph_state)
+
+            yield {"event" : STREAM_EVENT_VALIDATION, "data" : {
+                "iteration" : graph_state.iterations,
+                "valid" : valid,
+                "analysis_source" : graph_state.analysis_source,
+                "analysis" : graph_state.analysis.model_dump() if graph_state.analysis is not None else None,
+            }}
+
+            if(valid):
+                if(not speculative):
+                    graph_state = await self.execute_query(graph_state, input_parameters)
+
+                yield {"event" : STREAM_EVENT_ROWS_FETCHED, "data" : {
+                    "iteration" : graph_state.iterations,
+                    "success" : not graph_state.error,
+                    "result_count" : graph_state.result_count,
+                    "reached_max_count" : graph_state.reached_max_count,
+                    "error" : self.llm.get_chat_content(graph_state.messages[-1]) if graph_state.error else None,
+                }}
+
+            graph_state.iterations = graph_state.iterations + 1
+
+            decision = self.decide_to_finish(graph_state)
+
+            if decision == True:
+                if(stream_tokens):
+                    async for event in self.stream_final_response(graph_state, input_parameters):
+                        yield event
+                else:
+                    graph_state = await self.prepare_final_response(graph_state, input_parameters)
+
+                yield {"event" : STREAM_EVENT_FINAL_ANSWER, "data" : {"output" : self.llm.get_chat_content(graph_state.messages[-1]), "tokens_saved" : graph_state.tokens_saved}}
+                return
+
+    async def run_loop(self, graph_state : GraphState, input_parameters : QueryInput) -> str:
+        async with contextlib.aclosing(self.stream_loop(graph_state, input_parameters, stream_tokens=False)) as events:
+            async for event in events:
+                if(event["event"] == STREAM_EVENT_FINAL_ANSWER):
+                    event["data"]["usage"] = self.get_request_usage()
+                    return event["data"]["output"]
+
+    async def stream_cached_pipeline(self, state : GraphState, input_parameters : QueryInput, cached_pipeline : dict, stream_tokens : bool) -> AsyncIterator[dict]:
+        state = await self.execute_query(self.apply_cached_pipeline(state, cached_pipeline), input_parameters)
+
+        yield {"event" : STREAM_EVENT_ROWS_FETCHED, "data" : {
+            "iteration" : state.iterations,
+            "success" : not state.error,
+            "result_count" : state.result_count,
+            "reached_max_count" : state.reached_max_count,
+            "cache" : ANSWER_CACHE_TIER_PIPELINE,
+        }}
+
+        if(state.error == True):
+            return
+
+        if(stream_tokens):
+            async for event in self.stream_final_response(state, input_parameters):
+                yield event
+        else:
+            state = await self.prepare_final_response(state, input_parameters)
+
+        yield {"event" : STREAM_EVENT_FINAL_ANSWER, "data" : {"output" : self.llm.get_chat_content(state.messages[-1]), "cache" : ANSWER_CACHE_TIER_PIPELINE, "tokens_saved" : state.tokens_saved}}
+
+    async def stream_agent(self, input_parameters : QueryInput, stream_tokens : bool = True, collection_data : tuple[dict[str, dict], dict[str, list[list[str]]]] | None = None) -> AsyncIterator[dict]:
+        self.start_budget(input_parameters)
+        yield {"event" : STREAM_EVENT_STARTED, "data" : {"collection_list" : input_parameters.collection_list}}
+
+        with self.telemetry.span("schema", collections=len(input_parameters.collection_list)):
+            collection_schema, collection_indexes = collection_data if collection_data is not None else await self.load_collection_schema(input_parameters)
+        pruned_schema = self.prune_collection_schema(input_parameters, collection_schema)
+        prompt_schema = pruned_schema if pruned_schema is not None else collection_schema
+        collection_explanation = self.database.render_schema_prompt(prompt_schema, collection_indexes)
+
+        yield {"event" : STREAM_EVENT_SCHEMA_READY, "data" : {"collection_list" : list(prompt_schema.keys()), "schema_characters" : len(collection_explanation), "pruned" : pruned_schema is not None}}
+
+        initial_state = await self.prepare_initial_state(collection_explanation, input_parameters, collection_schema, collection_indexes, list(prompt_schema.keys()))
+
+        cache_keys = self.get_answer_cache_keys(input_parameters, collection_explanation)
+        if(cache_keys is not None):
+            # The answer cache may be backed by a shared SQLite file, so it is read and written off the event loop.
+            answer = await asyncio.to_thread(self.answer_cache.get_answer, cache_keys)
+            if(answer is not None):
+                yield {"event" : STREAM_EVENT_FINAL_ANSWER, "data" : {"output" : answer, "cache" : ANSWER_CACHE_TIER_EXACT}}
+                return
+
+            cached_pipeline = await asyncio.to_thread(self.answer_cache.get_pipeline, cache_keys)
+            if(cached_pipeline is not None):
+                async with contextlib.aclosing(self.stream_cached_pipeline(initial_state, input_parameters, cached_pipeline, stream_tokens)) as events:
+                    async for event in events:
+                        if(event["event"] == STREAM_EVENT_FINAL_ANSWER):
+                            await asyncio.to_thread(self.answer_cache.set_answer, cache_keys, event["data"]["output"])
+                            event["data"]["usage"] = self.get_request_usage()
+                        yield event
+
+                if(initial_state.error == False):
+                    return
+                await asyncio.to_thread(self.answer_cache.invalidate_pipeline, cache_keys)
+                initial_state = await self.prepare_initial_state(collection_explanation, input_parameters, collection_schema, collection_indexes, list(prompt_schema.keys()))
+
+        # Usage is recorded on the final answer that is actually sent, so a discarded pruned-schema answer is not counted twice.
+        async with contextlib.aclosing(self.stream_loop(initial_state, input_parameters, stream_tokens)) as events:
+            async for event in events:
+                if(event["event"] == STREAM_EVENT_FINAL_ANSWER):
+                    if(pruned_schema is not None and self.is_query_analysis_failed(initial_state)):
+                        break
+                    await asyncio.to_thread(self.store_cached_answer, cache_keys, initial_state, event["data"]["output"])
+                    event["data"]["usage"] = self.get_request_usage()
+                yield event
+            else:
+                return
+
+        # A pruned schema may have dropped what the question needed, so an irrelevant verdict is retried on the full schema.
+        collection_explanation = self.database.render_schema_prompt(collection_schema, collection_indexes)
+        yield {"event" : STREAM_EVENT_SCHEMA_READY, "data" : {"collection_list" : input_parameters.collection_list, "schema_characters" : len(collection_explanation), "pruned" : False}}
+
+        initial_state = await self.prepare_initial_state(collection_explanation, input_parameters, collection_schema, collection_indexes)
+        async with contextlib.aclosing(self.stream_loop(initial_state, input_parameters, stream_tokens)) as events:
+            async for event in events:
+                if(event["event"] == STREAM_EVENT_FINAL_ANSWER):
+                    await asyncio.to_thread(self.store_cached_answer, cache_keys, initial_state, event["data"]["output"])
+                    event["data"]["usage"] = self.get_request_usage()
+                yield event
+
+    async def execute_agent(self, input_parameters : QueryInput, collection_data : tuple[dict[str, dict], dict[str, list[list[str]]]] | None = None) -> str:
+        async with contextlib.aclosing(self.stream_agent(input_parameters, stream_tokens=False, collection_data=collection_data)) as events:
+            async for event in events:
+                if(event["event"] == STREAM_EVENT_FINAL_ANSWER):
+                    return event["data"]["output"]
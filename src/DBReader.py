@@ -1,6 +1,14 @@
+import asyncio
 import pymongo
 import pymongo.collection
+from bson import json_util
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorCommandCursor
 from textwrap import dedent
+from concurrent.futures import ThreadPoolExecutor
+from src.MongoClientRegistry import MongoClientRegistry
+from src.SchemaCache import SchemaCache
+from src.Constant import SCHEMA_INFERENCE_AUTO, SCHEMA_INFERENCE_FULL, SCHEMA_INFERENCE_SAMPLE, SCHEMA_INFERENCE_FIRST_LAST, SCHEMA_SAMPLE_SIZE, SCHEMA_FULL_SCAN_MAX_DOCUMENTS, SCHEMA_INTROSPECTION_CONCURRENCY, MONGO_EXECUTION_MAX_TIME_MS, MONGO_EXECUTION_ALLOW_DISK_USE
+from src.utils import get_inclusion_confidence
 
 class BaseDBReader:
     def __init__(self) -> None:
@@ -12,20 +20,53 @@ class BaseDBReader:
     def run_pipeline_query(self):
         pass
     
+    def fetch_pipeline_results(self):
+        pass
+
     def get_distinct_keys(self):
         pass
 
     def prepare_collection_schema_json(self):
         pass
 
+    def prepare_collection_index_json(self):
+        pass
+
+    def estimate_documents_examined(self):
+        pass
+
+    def render_schema_prompt(self):
+        pass
+
     def prepare_schema_prompt(self):
         pass
 
 
 class MongoReader(BaseDBReader):
-    def __init__(self, connection_url : str, database_name : str) -> None:
-        self.client = pymongo.MongoClient(connection_url)
+    def __init__(
+        self,
+        connection_url : str,
+        database_name : str,
+        client_registry : MongoClientRegistry,
+        schema_cache : SchemaCache | None = None,
+        inference_mode : str = SCHEMA_INFERENCE_AUTO,
+        sample_size : int = SCHEMA_SAMPLE_SIZE,
+        full_scan_max_documents : int = SCHEMA_FULL_SCAN_MAX_DOCUMENTS,
+        introspection_concurrency : int = SCHEMA_INTROSPECTION_CONCURRENCY,
+        execution_max_time_ms : int = MONGO_EXECUTION_MAX_TIME_MS,
+        allow_disk_use : bool = MONGO_EXECUTION_ALLOW_DISK_USE,
+    ) -> None:
+        self.connection_url = connection_url
+        self.database_name = database_name
+        self.client = client_registry.get_client(connection_url)
         self.database = self.client[database_name]
+        self.schema_cache = schema_cache
+        self.inference_mode = inference_mode
+        self.sample_size = sample_size
+        self.full_scan_max_documents = full_scan_max_documents
+        self.introspection_concurrency = introspection_concurrency
+        self.execution_max_time_ms = execution_max_time_ms
+        self.allow_disk_use = allow_disk_use
 
     def get_collection(self, collection_name : str) -> pymongo.collection.Collection:
         return self.database[collection_name]
@@ -42,6 +83,43 @@ class MongoReader(BaseDBReader):
 
         return result
     
+    def prepare_execution_pipeline(self, pipeline_query : list[dict], max_output_count : int) -> list[dict]:
+        # One extra document is enough to tell that the result was truncated.
+        fetch_count = max_output_count + 1
+        last_stage = pipeline_query[-1] if len(pipeline_query) > 0 and isinstance(pipeline_query[-1], dict) else {}
+        if("$out" in last_stage or "$merge" in last_stage or "$count" in last_stage):
+            return pipeline_query
+        if(isinstance(last_stage.get("$limit"), int) and last_stage["$limit"] <= fetch_count):
+            return pipeline_query
+        return pipeline_query + [{"$limit": fetch_count}]
+
+    def get_execution_options(self, max_output_count : int, max_time_ms : int | None = None) -> dict:
+        # A request budget can only shorten the server-side limit.
+        execution_max_time_ms = self.execution_max_time_ms
+        if(max_time_ms is not None):
+            execution_max_time_ms = max(min(max_time_ms, execution_max_time_ms) if execution_max_time_ms > 0 else max_time_ms, 1)
+        return {
+            "batchSize" : max_output_count + 1,
+            "maxTimeMS" : execution_max_time_ms,
+            "allowDiskUse" : self.allow_disk_use,
+        }
+
+    def serialize_documents(self, documents : list[dict]) -> list[str]:
+        return [json_util.dumps(document, json_options=json_util.RELAXED_JSON_OPTIONS, separators=(",", ":")) for document in documents]
+
+    def fetch_pipeline_results(self, collection_name : str, pipeline_query : list[dict], max_output_count : int, max_time_ms : int | None = None) -> tuple[list[str], bool]:
+        collection = self.get_collection(collection_name)
+        pipeline = self.prepare_execution_pipeline(pipeline_query, max_output_count)
+
+        documents = []
+        with collection.aggregate(pipeline, **self.get_execution_options(max_output_count, max_time_ms)) as cursor:
+            for document in cursor:
+                documents.append(document)
+                if(len(documents) > max_output_count):
+                    break
+
+        return self.serialize_documents(documents[:max_output_count]), len(documents) > max_output_count
+
     def get_distinct_keys(self, collection_name : str, key : str, key_count : int) -> list[str]:
         collection = self.get_collection(collection_name)
         pipeline = [
@@ -50,51 +128,256 @@ class MongoReader(BaseDBReader):
         ]
         return collection.aggregate(pipeline)
 
-    def prepare_collection_schema_json(self, collection_list : list[str], max_key_example_count : int) -> dict[str, dict]:
+    def get_collection_fingerprint(self, collection_name : str) -> dict | None:
+        try:
+            stats = self.database.command("collStats", collection_name)
+        except Exception:
+            return None
+        return {"count" : stats.get("count"), "avgObjSize" : stats.get("avgObjSize"), "nindexes" : stats.get("nindexes")}
 
-        pipeline = [
+    def fold_index_information(self, index_information : dict) -> list[list[str]]:
+        return [[field for field, _ in index["key"]] for index in index_information.values()]
+
+    def get_collection_indexes(self, collection_name : str) -> list[list[str]]:
+        try:
+            return self.fold_index_information(self.get_collection(collection_name).index_information())
+        except Exception:
+            return []
+
+    def explain_pipeline(self, collection_name : str, pipeline_query : list[dict]) -> dict | None:
+        try:
+            return self.database.command("explain", {"aggregate" : collection_name, "pipeline" : pipeline_query, "cursor" : {}}, verbosity="queryPlanner")
+        except Exception:
+            return None
+
+    def collect_plan_stages(self, plan : object, stages : list[dict]) -> None:
+        if(isinstance(plan, dict)):
+            if(isinstance(plan.get("stage"), str)):
+                stages.append(plan)
+            for key, value in plan.items():
+                if(key != "rejectedPlans"):
+                    self.collect_plan_stages(value, stages)
+        elif(isinstance(plan, list)):
+            for item in plan:
+                self.collect_plan_stages(item, stages)
+
+    def is_collection_scan(self, explain : dict) -> tuple[bool, int | None]:
+        stages : list[dict] = []
+        self.collect_plan_stages(explain, stages)
+        collection_scans = [stage for stage in stages if stage["stage"] == "COLLSCAN"]
+        if(len(collection_scans) == 0):
+            return False, None
+
+        # An unfiltered scan under a LIMIT stops early, so the limit bounds the documents examined.
+        limits = [stage["limitAmount"] for stage in stages if stage["stage"] == "LIMIT" and isinstance(stage.get("limitAmount"), int)]
+        if(len(limits) > 0 and all("filter" not in stage for stage in collection_scans)):
+            return True, min(limits)
+        return True, None
+
+    def estimate_documents_examined(self, collection_name : str, pipeline_query : list[dict]) -> int | None:
+        explain = self.explain_pipeline(collection_name, pipeline_query)
+        if(explain is None):
+            return None
+
+        collection_scan, limit = self.is_collection_scan(explain)
+        if(collection_scan == False):
+            return 0
+
+        document_count = self.get_collection(collection_name).estimated_document_count()
+        return document_count if limit is None else min(document_count, limit)
+
+    def select_source_stages(self, document_count : int | None) -> tuple[list[list[dict]], bool]:
+        inference_mode = self.inference_mode
+        if(inference_mode != SCHEMA_INFERENCE_FULL):
+            if(inference_mode == SCHEMA_INFERENCE_AUTO):
+                inference_mode = SCHEMA_INFERENCE_FULL if document_count <= self.full_scan_max_documents else SCHEMA_INFERENCE_SAMPLE
+            if(document_count <= self.sample_size):
+                inference_mode = SCHEMA_INFERENCE_FULL
+
+        if(inference_mode == SCHEMA_INFERENCE_FULL):
+            return [[]], False
+        elif(inference_mode == SCHEMA_INFERENCE_SAMPLE):
+            return [[{"$sample": {"size": self.sample_size}}]], True
+        elif(inference_mode == SCHEMA_INFERENCE_FIRST_LAST):
+            first_count = self.sample_size // 2
+            last_count = self.sample_size - first_count
+            return [
+                [{"$sort": {"_id": 1}}, {"$limit": first_count}],
+                [{"$sort": {"_id": -1}}, {"$limit": last_count}],
+            ], True
+        else:
+            raise Exception("Not Implemented")
+
+    def get_source_stages(self, collection_name : str) -> tuple[list[list[dict]], bool]:
+        document_count = None
+        if(self.inference_mode != SCHEMA_INFERENCE_FULL):
+            document_count = self.get_collection(collection_name).estimated_document_count()
+        return self.select_source_stages(document_count)
+
+    def get_key_stages(self) -> list[dict]:
+        return [
             {"$project": {"arrayofkeyvalue": {"$objectToArray": "$$ROOT"}}},
             {"$unwind": "$arrayofkeyvalue"},
             {"$group": {"_id": "$arrayofkeyvalue.k", "count": {"$sum": 1}, "types": {"$addToSet": {"$type": "$arrayofkeyvalue.v"}}}}
         ]
 
+    def fold_collection_keys(self, key_docs : list[dict], sampled : bool) -> dict[str, dict]:
+        key_counts : dict[str, int] = {}
+        key_types : dict[str, list[str]] = {}
+        for doc in key_docs:
+            key_counts[doc["_id"]] = key_counts.get(doc["_id"], 0) + doc["count"]
+            types = key_types.setdefault(doc["_id"], [])
+            types.extend([data_type for data_type in doc["types"] if data_type not in types])
+
+        # Every document carries "_id", so the most frequent key count is the number of documents read.
+        document_count = max(key_counts.values(), default=0)
+        if(document_count == 0):
+            return {}
+
+        max_coverage = max(key_counts.values()) / document_count
+        threshold = max_coverage / 2
+
+        keys = {}
+        for key, count in key_counts.items():
+            coverage = count / document_count
+            if(coverage > threshold):
+                keys[key] = {
+                    "types" : key_types[key],
+                    "coverage" : round(coverage, 4),
+                    "confidence" : round(get_inclusion_confidence(coverage, threshold, document_count), 4) if sampled else 1.0,
+                }
+
+        return keys
+
+    def infer_collection_keys(self, collection_name : str, source_stages : list[list[dict]], sampled : bool) -> dict[str, dict]:
+        key_docs = []
+        for stages in source_stages:
+            key_docs.extend(self.run_pipeline_query(collection_name, stages + self.get_key_stages(), fetch_result=True))
+        return self.fold_collection_keys(key_docs, sampled)
+
+    def get_example_key_counts(self, collection_keys : dict[str, dict], max_key_example_count : int) -> dict[str, int]:
+        key_counts = {}
+        for key, key_data in collection_keys.items():
+            key_count = max_key_example_count
+            if(key_data["types"][0] in ["date", "objectId"]):
+                key_count = 1
+            key_counts[key] = key_count
+        return key_counts
+
+    def get_example_stages(self, collection_name : str, source_stages : list[list[dict]]) -> list[dict]:
+        # Example values are read in one pass over the same documents the keys came from; several sources are chained with $unionWith.
+        example_stages = list(source_stages[0])
+        for stages in source_stages[1 : ]:
+            example_stages.append({"$unionWith": {"coll": collection_name, "pipeline": stages}})
+        return example_stages
+
+    def get_example_pipeline(self, key_counts : dict[str, int], example_stages : list[dict]) -> list[dict]:
+        # Facet output names cannot contain "." or start with "$", so keys are referenced by position.
+        facets = {
+            f"k{index}" : [{"$group": {"_id": f"${key}"}}, {"$limit": key_count}]
+            for index, (key, key_count) in enumerate(key_counts.items())
+        }
+        return example_stages + [{"$facet": facets}]
+
+    def fold_example_values(self, key_counts : dict[str, int], facet_docs : list[dict]) -> dict[str, list]:
+        if(len(facet_docs) == 0):
+            return {key : [] for key in key_counts}
+        return {key : [doc["_id"] for doc in facet_docs[0][f"k{index}"]] for index, key in enumerate(key_counts)}
+
+    def get_example_values(self, collection_name : str, key_counts : dict[str, int], example_stages : list[dict]) -> dict[str, list]:
+        if(len(key_counts) == 0):
+            return {}
+        facet_docs = self.run_pipeline_query(collection_name, self.get_example_pipeline(key_counts, example_stages), fetch_result=True)
+        return self.fold_example_values(key_counts, facet_docs)
+
+    def build_collection_schema_json(self, collection_keys : dict[str, dict], example_values : dict[str, list]) -> dict[str, dict]:
+        # Keys and example values come back from $group in no fixed order; sorting them keeps the rendered prompt byte-identical between refreshes.
+        schema = {}
+        for key in sorted(collection_keys):
+            key_data = collection_keys[key]
+            schema[key] = {
+                "data_type" : key_data["types"],
+                "Example_values" : sorted(str(value)[0 : 100] for value in example_values.get(key, [])),
+                "coverage" : key_data["coverage"],
+                "confidence" : key_data["confidence"],
+            }
+        return schema
+
+    def infer_collection_schema_json(self, collection_name : str, max_key_example_count : int) -> dict[str, dict]:
+        source_stages, sampled = self.get_source_stages(collection_name)
+        collection_keys = self.infer_collection_keys(collection_name, source_stages, sampled)
+        key_counts = self.get_example_key_counts(collection_keys, max_key_example_count)
+        example_values = self.get_example_values(collection_name, key_counts, self.get_example_stages(collection_name, source_stages))
+        return self.build_collection_schema_json(collection_keys, example_values)
+
+    def get_schema_cache_key(self, collection_name : str, max_key_example_count : int) -> str:
+        return self.schema_cache.make_key(self.connection_url, self.database_name, collection_name, max_key_example_count, self.inference_mode, self.sample_size)
+
+    def prepare_collection_schema_json(self, collection_list : list[str], max_key_example_count : int) -> dict[str, dict]:
+
         collection_key_list : dict[str, dict] = {}
+        missing_collections : dict[str, tuple[str | None, dict | None]] = {}
 
         for collection_name in collection_list:
-            result = self.run_pipeline_query(collection_name, pipeline) 
-            output = []
-            max_key_count = 0
-            for doc in result:
-                output.append(doc)
-                if(doc["count"] > max_key_count):
-                    max_key_count = doc["count"]
+            if(self.schema_cache is None):
+                missing_collections[collection_name] = (None, None)
+                continue
 
-            key_types = {}
-            for doc in output:
-                if(doc["count"] > max_key_count/2):
-                    key_types[doc['_id']] =  doc['types']
+            cache_key = self.get_schema_cache_key(collection_name, max_key_example_count)
+            fingerprint = None
+            if(self.schema_cache.validate_with_stats):
+                fingerprint = self.get_collection_fingerprint(collection_name)
 
-            collection_key_list[collection_name] = key_types
+            schema = self.schema_cache.get(cache_key, fingerprint)
+            if(schema is None):
+                missing_collections[collection_name] = (cache_key, fingerprint)
+            else:
+                collection_key_list[collection_name] = schema
 
+        if(len(missing_collections) > 0):
+            with ThreadPoolExecutor(max_workers=min(self.introspection_concurrency, len(missing_collections))) as executor:
+                schemas = executor.map(lambda collection_name : self.infer_collection_schema_json(collection_name, max_key_example_count), missing_collections.keys())
+                for collection_name, schema in zip(missing_collections.keys(), schemas):
+                    cache_key, fingerprint = missing_collections[collection_name]
+                    if(self.schema_cache is not None):
+                        self.schema_cache.set(cache_key, schema, fingerprint)
+                    collection_key_list[collection_name] = schema
 
-        for collection_name, key_data in collection_key_list.items():
-            for key, types in key_data.items():
+        return {collection_name : collection_key_list[collection_name] for collection_name in collection_list}
 
-                key_count = max_key_example_count
-                if(types[0] in ["date", "objectId"]):
-                    key_count = 1
-                result = list(self.get_distinct_keys(collection_name, key, key_count))
-                
+    def get_index_cache_key(self, collection_name : str) -> str:
+        return self.schema_cache.make_key(self.connection_url, self.database_name, collection_name, 0, "indexes")
 
-                collection_key_list[collection_name][key] = {
-                    "data_type" : types,
-                    "Example_values" : [str(result[i]["_id"])[0 : 100] for i in range(0, len(result))]
-                }
+    def prepare_collection_index_json(self, collection_list : list[str]) -> dict[str, list[list[str]]]:
+        collection_indexes : dict[str, list[list[str]]] = {}
 
-        return collection_key_list
-    
-    def prepare_schema_prompt(self, collection_list : list[str], max_key_example_count : int) -> str:
-        collection_data = self.prepare_collection_schema_json(collection_list, max_key_example_count)
+        for collection_name in collection_list:
+            cache_key, fingerprint = None, None
+            if(self.schema_cache is not None):
+                cache_key = self.get_index_cache_key(collection_name)
+                if(self.schema_cache.validate_with_stats):
+                    fingerprint = self.get_collection_fingerprint(collection_name)
+                indexes = self.schema_cache.get(cache_key, fingerprint)
+                if(indexes is not None):
+                    collection_indexes[collection_name] = indexes
+                    continue
+
+            indexes = self.get_collection_indexes(collection_name)
+            if(cache_key is not None):
+                self.schema_cache.set(cache_key, indexes, fingerprint)
+            collection_indexes[collection_name] = indexes
+
+        return collection_indexes
+
+    def get_indexed_fields(self, indexes : list[list[str]]) -> list[str]:
+        # Only the leading field of an index can serve a filter on its own.
+        indexed_fields = []
+        for index in indexes:
+            if(len(index) > 0 and index[0] not in indexed_fields):
+                indexed_fields.append(index[0])
+        return indexed_fields
+
+    def render_schema_prompt(self, collection_data : dict[str, dict], collection_indexes : dict[str, list[list[str]]] | None = None) -> str:
         output_string = []
         for collection, schema in collection_data.items():
             output_string.append(dedent(
@@ -105,6 +388,10 @@ class MongoReader(BaseDBReader):
                 Output Schema Associated with {collection}:"""
             ))
 
+            indexes = (collection_indexes or {}).get(collection) or []
+            if(len(indexes) > 0):
+                output_string.append(f"Indexed fields of {collection} (prefer filtering on these) : {' || '.join(', '.join(index) for index in indexes)}")
+
             for key, data_dict in schema.items():
 
                 output_string.append(dedent(
@@ -114,3 +401,140 @@ class MongoReader(BaseDBReader):
                     """))
                 
         return "\n".join(output_string)
+    
+    def prepare_schema_prompt(self, collection_list : list[str], max_key_example_count : int) -> str:
+        collection_data = self.prepare_collection_schema_json(collection_list, max_key_example_count)
+        return self.render_schema_prompt(collection_data, self.prepare_collection_index_json(collection_list))
+
+
+class AsyncMongoReader(MongoReader):
+    def get_collection(self, collection_name : str) -> AsyncIOMotorCollection:
+        return self.database[collection_name]
+
+    async def run_pipeline_query(self, collection_name : str, pipeline_query : list[dict], fetch_result : bool = False) -> list[dict] | AsyncIOMotorCommandCursor:
+        collection = self.get_collection(collection_name)
+        result = collection.aggregate(pipeline_query)
+
+        if fetch_result:
+            return await result.to_list(length=None)
+
+        return result
+
+    async def fetch_pipeline_results(self, collection_name : str, pipeline_query : list[dict], max_output_count : int, max_time_ms : int | None = None) -> tuple[list[str], bool]:
+        collection = self.get_collection(collection_name)
+        pipeline = self.prepare_execution_pipeline(pipeline_query, max_output_count)
+
+        cursor = collection.aggregate(pipeline, **self.get_execution_options(max_output_count, max_time_ms))
+        try:
+            documents = await cursor.to_list(length=max_output_count + 1)
+        finally:
+            await cursor.close()
+
+        return self.serialize_documents(documents[:max_output_count]), len(documents) > max_output_count
+
+    async def get_distinct_keys(self, collection_name : str, key : str, key_count : int) -> list[dict]:
+        pipeline = [
+            {'$group': {'_id': f'${key}'}},
+            {'$limit': key_count}
+        ]
+        return await self.run_pipeline_query(collection_name, pipeline, fetch_result=True)
+
+    async def get_collection_fingerprint(self, collection_name : str) -> dict | None:
+        try:
+            stats = await self.database.command("collStats", collection_name)
+        except Exception:
+            return None
+        return {"count" : stats.get("count"), "avgObjSize" : stats.get("avgObjSize"), "nindexes" : stats.get("nindexes")}
+
+    async def get_collection_indexes(self, collection_name : str) -> list[list[str]]:
+        try:
+            return self.fold_index_information(await self.get_collection(collection_name).index_information())
+        except Exception:
+            return []
+
+    async def explain_pipeline(self, collection_name : str, pipeline_query : list[dict]) -> dict | None:
+        try:
+            return await self.database.command("explain", {"aggregate" : collection_name, "pipeline" : pipeline_query, "cursor" : {}}, verbosity="queryPlanner")
+        except Exception:
+            return None
+
+    async def estimate_documents_examined(self, collection_name : str, pipeline_query : list[dict]) -> int | None:
+        explain = await self.explain_pipeline(collection_name, pipeline_query)
+        if(explain is None):
+            return None
+
+        collection_scan, limit = self.is_collection_scan(explain)
+        if(collection_scan == False):
+            return 0
+
+        document_count = await self.get_collection(collection_name).estimated_document_count()
+        return document_count if limit is None else min(document_count, limit)
+
+    async def get_source_stages(self, collection_name : str) -> tuple[list[list[dict]], bool]:
+        document_count = None
+        if(self.inference_mode != SCHEMA_INFERENCE_FULL):
+            document_count = await self.get_collection(collection_name).estimated_document_count()
+        return self.select_source_stages(document_count)
+
+    async def infer_collection_keys(self, collection_name : str, source_stages : list[list[dict]], sampled : bool) -> dict[str, dict]:
+        results = await asyncio.gather(*[self.run_pipeline_query(collection_name, stages + self.get_key_stages(), fetch_result=True) for stages in source_stages])
+        return self.fold_collection_keys([doc for result in results for doc in result], sampled)
+
+    async def get_example_values(self, collection_name : str, key_counts : dict[str, int], example_stages : list[dict]) -> dict[str, list]:
+        if(len(key_counts) == 0):
+            return {}
+        facet_docs = await self.run_pipeline_query(collection_name, self.get_example_pipeline(key_counts, example_stages), fetch_result=True)
+        return self.fold_example_values(key_counts, facet_docs)
+
+    async def infer_collection_schema_json(self, collection_name : str, max_key_example_count : int) -> dict[str, dict]:
+        source_stages, sampled = await self.get_source_stages(collection_name)
+        collection_keys = await self.infer_collection_keys(collection_name, source_stages, sampled)
+        key_counts = self.get_example_key_counts(collection_keys, max_key_example_count)
+        example_values = await self.get_example_values(collection_name, key_counts, self.get_example_stages(collection_name, source_stages))
+        return self.build_collection_schema_json(collection_keys, example_values)
+
+    async def prepare_collection_schema_json(self, collection_list : list[str], max_key_example_count : int) -> dict[str, dict]:
+        semaphore = asyncio.Semaphore(self.introspection_concurrency)
+
+        async def get_collection_schema(collection_name : str) -> dict[str, dict]:
+            async with semaphore:
+                if(self.schema_cache is None):
+                    return await self.infer_collection_schema_json(collection_name, max_key_example_count)
+
+                cache_key = self.get_schema_cache_key(collection_name, max_key_example_count)
+                fingerprint = None
+                if(self.schema_cache.validate_with_stats):
+                    fingerprint = await self.get_collection_fingerprint(collection_name)
+
+                # The cache may read and write a file or a shared SQLite database, so it is kept off the event loop.
+                schema = await asyncio.to_thread(self.schema_cache.get, cache_key, fingerprint)
+                if(schema is None):
+                    schema = await self.infer_collection_schema_json(collection_name, max_key_example_count)
+                    await asyncio.to_thread(self.schema_cache.set, cache_key, schema, fingerprint)
+                return schema
+
+        schemas = await asyncio.gather(*[get_collection_schema(collection_name) for collection_name in collection_list])
+        return dict(zip(collection_list, schemas))
+
+    async def prepare_collection_index_json(self, collection_list : list[str]) -> dict[str, list[list[str]]]:
+        async def get_indexes(collection_name : str) -> list[list[str]]:
+            if(self.schema_cache is None):
+                return await self.get_collection_indexes(collection_name)
+
+            cache_key = self.get_index_cache_key(collection_name)
+            fingerprint = None
+            if(self.schema_cache.validate_with_stats):
+                fingerprint = await self.get_collection_fingerprint(collection_name)
+
+            indexes = await asyncio.to_thread(self.schema_cache.get, cache_key, fingerprint)
+            if(indexes is None):
+                indexes = await self.get_collection_indexes(collection_name)
+                await asyncio.to_thread(self.schema_cache.set, cache_key, indexes, fingerprint)
+            return indexes
+
+        indexes = await asyncio.gather(*[get_indexes(collection_name) for collection_name in collection_list])
+        return dict(zip(collection_list, indexes))
+
+    async def prepare_schema_prompt(self, collection_list : list[str], max_key_example_count : int) -> str:
+        collection_data, collection_indexes = await asyncio.gather(self.prepare_collection_schema_json(collection_list, max_key_example_count), self.prepare_collection_index_json(collection_list))
+        return self.render_schema_prompt(collection_data, collection_indexes)
@@ -0,0 +1,111 @@
+import re
+from datetime import datetime
+
+DATE_PATTERN = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})")
+DATETIME_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?(?:Z|[+-]\d{2}(?::?\d{2})?)?")
+EXPRESSION_OPERATORS = {"$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$cmp", "$max", "$min"}
+RESHAPING_STAGES = {"$group", "$project", "$replaceRoot", "$replaceWith", "$bucket", "$bucketAuto", "$sortByCount", "$count", "$facet", "$unionWith"}
+ADDED_FIELD_STAGES = {"$addFields", "$set"}
+
+
+def parse_date(value : str) -> datetime | None:
+    # The regular expressions reject most strings before any parsing is attempted.
+    try:
+        match = DATE_PATTERN.fullmatch(value)
+        if(match is not None):
+            return datetime.fromisoformat(value) if len(value) == 10 else datetime(int(match[1]), int(match[2]), int(match[3]))
+        if(DATETIME_PATTERN.fullmatch(value) is not None):
+            return datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+    except ValueError:
+        pass
+    return None
+
+
+class DateCoercer:
+    def __init__(self, collection_schema : dict[str, dict] | None = None) -> None:
+        self.collection_schema = collection_schema
+        self.non_date_fields : dict[str, set[str]] = {}
+
+    def get_non_date_fields(self, collection_name : str | None) -> set[str] | None:
+        # Without a schema for the collection every date-looking string is converted, as before the schema was known.
+        if(self.collection_schema is None or collection_name not in self.collection_schema):
+            return None
+        if(collection_name not in self.non_date_fields):
+            schema = self.collection_schema[collection_name] or {}
+            self.non_date_fields[collection_name] = {field for field, data in schema.items() if "date" not in data.get("data_type", [])}
+        return self.non_date_fields[collection_name]
+
+    def get_output_fields(self, operator : str, body : object, non_date_fields : set[str] | None) -> set[str] | None:
+        # Fields a stage derives are not described by the schema, so they fall back to converting date-looking strings.
+        if(non_date_fields is None or operator in RESHAPING_STAGES):
+            return None
+        derived = set()
+        if(operator in ADDED_FIELD_STAGES and isinstance(body, dict)):
+            derived = set(body.keys())
+        elif(operator in ["$lookup", "$graphLookup"] and isinstance(body, dict) and isinstance(body.get("as"), str)):
+            derived = {body["as"]}
+        if(len(derived) == 0):
+            return non_date_fields
+        derived = derived.union(field.split(".")[0] for field in derived)
+        return non_date_fields.difference(derived)
+
+    def is_date_field(self, field : str | None, non_date_fields : set[str] | None) -> bool:
+        # Only fields the schema types as something other than a date are skipped; nested paths are not in the schema.
+        return non_date_fields is None or field is None or field not in non_date_fields
+
+    def get_expression_field(self, arguments : list) -> str | None:
+        for argument in arguments:
+            if(isinstance(argument, str) and argument.startswith("$") and not argument.startswith("$$")):
+                return argument[1:]
+        return None
+
+    def coerce_string(self, value : str) -> str | datetime:
+        if(value.startswith("$")):
+            return value
+        date = parse_date(value)
+        return date if date is not None else value
+
+    def coerce_value(self, value : object, field : str | None, non_date_fields : set[str] | None) -> object:
+        # Whether a field holds dates is resolved once per container, so long $in lists only pay for the parse.
+        if(isinstance(value, str)):
+            return self.coerce_string(value) if self.is_date_field(field, non_date_fields) else value
+        if(isinstance(value, list)):
+            convert = self.is_date_field(field, non_date_fields)
+            return [
+                (self.coerce_string(item) if convert else item) if isinstance(item, str) else
+                self.coerce_value(item, field, non_date_fields) if isinstance(item, (dict, list)) else item
+                for item in value
+            ]
+        if(isinstance(value, dict)):
+            coerced = {}
+            for key, item in value.items():
+                if(not key.startswith("$")):
+                    coerced[key] = self.coerce_value(item, f"{field}.{key}" if field is not None else key, non_date_fields)
+                elif(key in EXPRESSION_OPERATORS and isinstance(item, list) and self.get_expression_field(item) is not None):
+                    coerced[key] = self.coerce_value(item, self.get_expression_field(item), non_date_fields)
+                else:
+                    coerced[key] = self.coerce_value(item, field, non_date_fields)
+            return coerced
+        return value
+
+    def coerce_stage(self, operator : str, body : object, collection_name : str | None, non_date_fields : set[str] | None) -> object:
+        if(operator == "$lookup" and isinstance(body, dict) and isinstance(body.get("pipeline"), list)):
+            return {**body, "pipeline" : self.coerce(body["pipeline"], body.get("from"))}
+        if(operator == "$unionWith" and isinstance(body, dict) and isinstance(body.get("pipeline"), list)):
+            return {**body, "pipeline" : self.coerce(body["pipeline"], body.get("coll"))}
+        if(operator == "$facet" and isinstance(body, dict)):
+            return {name : self.coerce(sub_pipeline, collection_name) if isinstance(sub_pipeline, list) else sub_pipeline for name, sub_pipeline in body.items()}
+        return self.coerce_value(body, None, non_date_fields)
+
+    def coerce(self, pipeline : list[dict], collection_name : str | None = None) -> list[dict]:
+        # The pipeline is copied while it is walked, so the generated pipeline is never modified in place.
+        coerced = []
+        non_date_fields = self.get_non_date_fields(collection_name)
+        for stage in pipeline:
+            if(isinstance(stage, dict) and len(stage) == 1):
+                operator, body = next(iter(stage.items()))
+                coerced.append({operator : self.coerce_stage(operator, body, collection_name, non_date_fields)})
+                non_date_fields = self.get_output_fields(operator, body, non_date_fields)
+            else:
+                coerced.append(self.coerce_value(stage, None, non_date_fields))
+        return coerced
@@ -5,41 +5,62 @@ from src.Schemas import TaskResponse
 from typing import Callable, Any
 from functools import wraps
 import traceback
+import inspect
+
+
+def get_error_details(exc: Exception) -> tuple[str, str | dict]:
+    if isinstance(exc, HTTPException):
+        return "HTTP Exception", exc.detail
+    try:
+        error, error_data = exc.args
+    except:
+        error_data = str(exc.args)
+        error = "Internal Error"
+    return error, error_data
+
+
+def exception_response(exc: Exception) -> JSONResponse:
+    if isinstance(exc, HTTPException):
+        traceback_str = "".join(
+            traceback.format_exception(None, exc, exc.__traceback__)
+        )
+        task_response = TaskResponse()
+        task_response.error = "HTTP Exception"
+        task_response.error_data = exc.detail
+
+        warnings.warn(traceback_str)
+        return JSONResponse(
+            content=task_response.model_dump(), status_code=exc.status_code
+        )
+
+    traceback_str = "".join(
+        traceback.format_exception(None, exc, exc.__traceback__)
+    )
+    error, error_data = get_error_details(exc)
+    task_response = TaskResponse()
+    task_response.error = error
+    task_response.error_data = error_data
+
+    warnings.warn(str(traceback_str))
+    return JSONResponse(content=task_response.model_dump(), status_code=500)
 
 
 def handle_exceptions(func: Callable) -> Callable:
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> JSONResponse:
+            try:
+                return await func(*args, **kwargs)
+            except Exception as exc:
+                return exception_response(exc)
+
+        return async_wrapper
+
     @wraps(func)
     def wrapper(*args: Any, **kwargs: Any) -> JSONResponse:
         try:
             return func(*args, **kwargs)
-
-        except HTTPException as http_exc:
-            traceback_str = "".join(
-                traceback.format_exception(None, http_exc, http_exc.__traceback__)
-            )
-            task_response = TaskResponse()
-            task_response.error = "HTTP Exception"
-            task_response.error_data = http_exc.detail
-
-            warnings.warn(traceback_str)
-            return JSONResponse(
-                content=task_response.model_dump(), status_code=http_exc.status_code
-            )
-
         except Exception as exc:
-            traceback_str = "".join(
-                traceback.format_exception(None, exc, exc.__traceback__)
-            )
-            try:
-                error, error_data = exc.args
-            except:
-                error_data = str(exc.args)
-                error = "Internal Error"
-            task_response = TaskResponse()
-            task_response.error = error
-            task_response.error_data = error_data
-
-            warnings.warn(str(traceback_str))
-            return JSONResponse(content=task_response.model_dump(), status_code=500)
+            return exception_response(exc)
 
     return wrapper
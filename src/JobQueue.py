@@ -0,0 +1,440 @@
+import asyncio
+import hashlib
+import heapq
+import hmac
+import ipaddress
+import itertools
+import json
+import logging
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import httpx
+from urllib.parse import urlsplit
+from typing import Awaitable, Callable
+from fastapi import HTTPException
+from src.Schemas import QueryInput, JobInput, JobResponse
+from src.Exception import get_error_details
+from src.Telemetry import Telemetry
+from src.Constant import JOB_STATUS_QUEUED, JOB_STATUS_RUNNING, JOB_STATUS_SUCCEEDED, JOB_STATUS_FAILED, JOB_STATUS_CANCELLED, JOB_PRIORITIES, JOB_WORKER_COUNT, JOB_MAX_QUEUED, JOB_RESULT_TTL, JOB_POLL_INTERVAL, JOB_WEBHOOK_TIMEOUT, JOB_WEBHOOK_RETRIES, JOB_LEASE_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = [JOB_STATUS_SUCCEEDED, JOB_STATUS_FAILED, JOB_STATUS_CANCELLED]
+
+
+class MemoryJobStore:
+    def __init__(self) -> None:
+        self.jobs : dict[str, dict] = {}
+        self.queue : list[tuple[int, int, str]] = []
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+
+    def add(self, job : dict) -> None:
+        with self.lock:
+            self.jobs[job["id"]] = dict(job)
+            heapq.heappush(self.queue, (job["priority"], next(self.sequence), job["id"]))
+
+    def get(self, job_id : str) -> dict | None:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def update(self, job_id : str, **fields : object) -> None:
+        with self.lock:
+            if(job_id in self.jobs):
+                self.jobs[job_id].update(fields)
+
+    def cancel(self, job_id : str, status : str) -> bool:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if(job is None or job["status"] != status):
+                return False
+            job.update(status=JOB_STATUS_CANCELLED, finished_at=time.time())
+            return True
+
+    def pop_next(self) -> dict | None:
+        # Cancelled jobs stay in the heap and are skipped here.
+        with self.lock:
+            while(len(self.queue) > 0):
+                _, _, job_id = heapq.heappop(self.queue)
+                job = self.jobs.get(job_id)
+                if(job is not None and job["status"] == JOB_STATUS_QUEUED):
+                    job.update(status=JOB_STATUS_RUNNING, started_at=time.time())
+                    return dict(job)
+            return None
+
+    def count(self, status : str) -> int:
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if job["status"] == status)
+
+    def touch(self, job_ids : list[str]) -> None:
+        pass
+
+    def recover(self, expired_before : float) -> int:
+        return 0
+
+    def purge(self, finished_before : float) -> int:
+        with self.lock:
+            expired = [job_id for job_id, job in self.jobs.items() if job["status"] in FINISHED_STATUSES and job["finished_at"] < finished_before]
+            for job_id in expired:
+                del self.jobs[job_id]
+            return len(expired)
+
+
+class SQLiteJobStore:
+    def __init__(self, path : str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                sequence INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT UNIQUE NOT NULL,
+                status TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                input TEXT NOT NULL,
+                webhook_url TEXT,
+                output TEXT,
+                error TEXT,
+                error_data TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                heartbeat_at REAL
+            )"""
+        )
+        if("heartbeat_at" not in [column[1] for column in self.connection.execute("PRAGMA table_info(jobs)")]):
+            self.connection.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority, sequence)")
+
+    @staticmethod
+    def to_job(row : sqlite3.Row | None) -> dict | None:
+        if(row is None):
+            return None
+        job = {key : row[key] for key in row.keys() if key not in ["sequence", "heartbeat_at"]}
+        job["error_data"] = json.loads(job["error_data"]) if job["error_data"] is not None else None
+        return job
+
+    def add(self, job : dict) -> None:
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO jobs (id, status, priority, input, webhook_url, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job["id"], job["status"], job["priority"], job["input"], job["webhook_url"], job["created_at"]),
+            )
+
+    def get(self, job_id : str) -> dict | None:
+        with self.lock:
+            return self.to_job(self.connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def update(self, job_id : str, **fields : object) -> None:
+        if("error_data" in fields):
+            fields["error_data"] = json.dumps(fields["error_data"], default=str) if fields["error_data"] is not None else None
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self.lock:
+            self.connection.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def cancel(self, job_id : str, status : str) -> bool:
+        with self.lock:
+            return self.connection.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (JOB_STATUS_CANCELLED, time.time(), job_id, status),
+            ).rowcount == 1
+
+    def pop_next(self) -> dict | None:
+        # The claim is a single conditional update, so several processes can share the same database file.
+        with self.lock:
+            while True:
+                row = self.connection.execute("SELECT id FROM jobs WHERE status = ? ORDER BY priority, sequence LIMIT 1", (JOB_STATUS_QUEUED,)).fetchone()
+                if(row is None):
+                    return None
+                claimed = self.connection.execute(
+                    "UPDATE jobs SET status = ?, started_at = ?, heartbeat_at = ? WHERE id = ? AND status = ?",
+                    (JOB_STATUS_RUNNING, time.time(), time.time(), row["id"], JOB_STATUS_QUEUED),
+                ).rowcount
+                if(claimed == 1):
+                    return self.to_job(self.connection.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+    def count(self, status : str) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def touch(self, job_ids : list[str]) -> None:
+        if(len(job_ids) == 0):
+            return
+        placeholders = ", ".join("?" for _ in job_ids)
+        with self.lock:
+            self.connection.execute(f"UPDATE jobs SET heartbeat_at = ? WHERE id IN ({placeholders})", (time.time(), *job_ids))
+
+    def recover(self, expired_before : float) -> int:
+        # A running job whose worker stopped sending heartbeats, because the process stopped or crashed, is queued again.
+        with self.lock:
+            return self.connection.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL WHERE status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (JOB_STATUS_QUEUED, JOB_STATUS_RUNNING, expired_before),
+            ).rowcount
+
+    def purge(self, finished_before : float) -> int:
+        placeholders = ", ".join("?" for _ in FINISHED_STATUSES)
+        with self.lock:
+            return self.connection.execute(f"DELETE FROM jobs WHERE status IN ({placeholders}) AND finished_at < ?", (*FINISHED_STATUSES, finished_before)).rowcount
+
+
+class JobManager:
+    def __init__(
+        self,
+        store : MemoryJobStore | SQLiteJobStore | None = None,
+        worker_count : int = JOB_WORKER_COUNT,
+        max_queued : int = JOB_MAX_QUEUED,
+        result_ttl : float = JOB_RESULT_TTL,
+        poll_interval : float = JOB_POLL_INTERVAL,
+        webhook_timeout : float = JOB_WEBHOOK_TIMEOUT,
+        webhook_retries : int = JOB_WEBHOOK_RETRIES,
+        webhook_secret : str | None = None,
+        webhook_allowed_hosts : list[str] | None = None,
+        lease_timeout : float = JOB_LEASE_TIMEOUT,
+        telemetry : Telemetry | None = None,
+    ) -> None:
+        self.store = store if store is not None else MemoryJobStore()
+        self.worker_count = worker_count
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.webhook_timeout = webhook_timeout
+        self.webhook_retries = webhook_retries
+        self.webhook_secret = webhook_secret
+        self.webhook_allowed_hosts = [host.lower() for host in webhook_allowed_hosts or []]
+        self.lease_timeout = lease_timeout
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.runner : Callable[[QueryInput], Awaitable[str]] | None = None
+        self.workers : list[asyncio.Task] = []
+        self.maintenance : asyncio.Task | None = None
+        self.running : dict[str, asyncio.Task] = {}
+        self.notifications : set[asyncio.Task] = set()
+        self.cancel_requested : set[str] = set()
+        self.wakeup : asyncio.Event | None = None
+        self.loop : asyncio.AbstractEventLoop | None = None
+
+    async def start(self, runner : Callable[[QueryInput], Awaitable[str]]) -> None:
+        self.runner = runner
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.workers = [asyncio.create_task(self.work()) for _ in range(self.worker_count)]
+        self.maintenance = asyncio.create_task(self.maintain())
+
+    async def stop(self) -> None:
+        tasks = self.workers + [self.maintenance]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Webhooks already being sent get one timeout to finish before they are dropped.
+        if(len(self.notifications) > 0):
+            await asyncio.wait(list(self.notifications), timeout=self.webhook_timeout)
+            for task in list(self.notifications):
+                task.cancel()
+        self.workers = []
+        self.maintenance = None
+        self.loop = None
+
+    def call_in_loop(self, callback : Callable[[], object]) -> None:
+        # The HTTP handlers run in a thread pool, so anything touching the event loop is handed over to it.
+        if(self.loop is not None and not self.loop.is_closed()):
+            self.loop.call_soon_threadsafe(callback)
+
+    def to_response(self, job : dict) -> JobResponse:
+        priority = next((name for name, value in JOB_PRIORITIES.items() if value == job["priority"]), str(job["priority"]))
+        return JobResponse(
+            job_id = job["id"],
+            status = job["status"],
+            priority = priority,
+            created_at = job["created_at"],
+            started_at = job["started_at"],
+            finished_at = job["finished_at"],
+            output = job["output"],
+            error = job["error"],
+            error_data = job["error_data"],
+        )
+
+    def submit(self, job_input : JobInput) -> JobResponse:
+        if(job_input.priority not in JOB_PRIORITIES):
+            raise HTTPException(status_code=400, detail=f"Unknown priority {job_input.priority}, expected one of {list(JOB_PRIORITIES.keys())}")
+        if(job_input.webhook_url):
+            webhook_error = self.check_webhook_url(job_input.webhook_url)
+            if(webhook_error is not None):
+                raise HTTPException(status_code=400, detail=f"Invalid webhook_url: {webhook_error}")
+        if(self.store.count(JOB_STATUS_QUEUED) >= self.max_queued):
+            raise HTTPException(status_code=429, detail=f"The job queue is full ({self.max_queued} queued jobs), retry later")
+
+        job = {
+            "id" : uuid.uuid4().hex,
+            "status" : JOB_STATUS_QUEUED,
+            "priority" : JOB_PRIORITIES[job_input.priority],
+            "input" : QueryInput(**job_input.model_dump(exclude={"priority", "webhook_url"})).model_dump_json(),
+            "webhook_url" : job_input.webhook_url,
+            "output" : None,
+            "error" : None,
+            "error_data" : None,
+            "created_at" : time.time(),
+            "started_at" : None,
+            "finished_at" : None,
+        }
+        self.store.add(job)
+        if(self.wakeup is not None):
+            self.call_in_loop(self.wakeup.set)
+        return self.to_response(job)
+
+    def is_allowed_host(self, host : str) -> bool:
+        return any(host == allowed or host.endswith("." + allowed) for allowed in self.webhook_allowed_hosts)
+
+    def check_webhook_url(self, webhook_url : str) -> str | None:
+        # The service posts from inside the network, so a webhook may not point at loopback, private, link-local or metadata addresses.
+        try:
+            url = urlsplit(webhook_url)
+            host = (url.hostname or "").lower()
+            port = url.port
+        except ValueError:
+            return "the URL cannot be parsed."
+        if(len(host) == 0):
+            return "the URL has no host."
+        if(len(self.webhook_allowed_hosts) > 0):
+            if(url.scheme not in ["http", "https"] or not self.is_allowed_host(host)):
+                return f"the host {host} is not in JOB_WEBHOOK_ALLOWED_HOSTS."
+            return None
+        if(url.scheme != "https"):
+            return "only https webhooks are accepted."
+        try:
+            addresses = {info[4][0] for info in socket.getaddrinfo(host, port or 443, type=socket.SOCK_STREAM)}
+        except OSError:
+            return f"the host {host} cannot be resolved."
+        if(any(not ipaddress.ip_address(address.split("%")[0]).is_global for address in addresses)):
+            return f"the host {host} resolves to a non-public address."
+        return None
+
+    def get(self, job_id : str) -> JobResponse | None:
+        job = self.store.get(job_id)
+        return self.to_response(job) if job is not None else None
+
+    def cancel(self, job_id : str) -> JobResponse | None:
+        job = self.store.get(job_id)
+        if(job is None):
+            return None
+
+        # The store only cancels a job still in the status read here, so a job a worker claimed meanwhile is cancelled as a running one.
+        if(job["status"] == JOB_STATUS_QUEUED and not self.store.cancel(job_id, JOB_STATUS_QUEUED)):
+            job = self.store.get(job_id)
+        if(job["status"] == JOB_STATUS_RUNNING and job_id in self.running):
+            self.cancel_requested.add(job_id)
+            self.call_in_loop(self.running[job_id].cancel)
+        elif(job["status"] == JOB_STATUS_RUNNING):
+            # The job runs in another worker process, which stops it when it next checks its running jobs.
+            self.store.cancel(job_id, JOB_STATUS_RUNNING)
+        return self.get(job_id)
+
+    def get_stats(self) -> dict:
+        return {
+            "queued" : self.store.count(JOB_STATUS_QUEUED),
+            "running" : len(self.running),
+            "workers" : len(self.workers),
+            "max_queued" : self.max_queued,
+        }
+
+    async def wait_for_job(self) -> None:
+        self.wakeup.clear()
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout=self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+    def get_cancelled_job_ids(self, job_ids : list[str]) -> list[str]:
+        jobs = [self.store.get(job_id) for job_id in job_ids]
+        return [job["id"] for job in jobs if job is not None and job["status"] == JOB_STATUS_CANCELLED]
+
+    async def cancel_remotely_cancelled(self) -> None:
+        for job_id in await asyncio.to_thread(self.get_cancelled_job_ids, list(self.running.keys())):
+            if(job_id in self.running):
+                self.cancel_requested.add(job_id)
+                self.running[job_id].cancel()
+
+    async def maintain(self) -> None:
+        # Heartbeats hold the lease of the running jobs; jobs whose lease expired are queued again for any worker process.
+        # Store calls run in threads, because a SQLite store blocks on disk and on other processes' locks.
+        while True:
+            await asyncio.to_thread(self.store.touch, list(self.running.keys()))
+            await self.cancel_remotely_cancelled()
+            recovered = await asyncio.to_thread(self.store.recover, time.time() - self.lease_timeout)
+            if(recovered > 0):
+                logger.info("requeued %d jobs whose worker stopped", recovered)
+                self.wakeup.set()
+            await asyncio.to_thread(self.store.purge, time.time() - self.result_ttl)
+            await asyncio.sleep(self.lease_timeout / 3)
+
+    async def work(self) -> None:
+        while True:
+            job = await asyncio.to_thread(self.store.pop_next)
+            if(job is None):
+                await self.wait_for_job()
+                continue
+            await self.run_job(job)
+
+    async def run_job(self, job : dict) -> None:
+        task = asyncio.ensure_future(self.runner(QueryInput.model_validate_json(job["input"])))
+        self.running[job["id"]] = task
+        fields = {}
+        try:
+            fields = {"status" : JOB_STATUS_SUCCEEDED, "output" : await task}
+        except asyncio.CancelledError:
+            # A cancelled worker means the server is stopping; the job stays running so a durable store can requeue it.
+            if(job["id"] not in self.cancel_requested):
+                raise
+            fields = {"status" : JOB_STATUS_CANCELLED}
+        except Exception as e:
+            error, error_data = get_error_details(e)
+            fields = {"status" : JOB_STATUS_FAILED, "error" : error, "error_data" : error_data}
+        finally:
+            self.running.pop(job["id"], None)
+            self.cancel_requested.discard(job["id"])
+            stored_job = await asyncio.to_thread(self.store.get, job["id"])
+            if(stored_job is not None and stored_job["status"] == JOB_STATUS_CANCELLED):
+                fields = {}
+            if(len(fields) > 0):
+                await asyncio.to_thread(self.store.update, job["id"], finished_at=time.time(), **fields)
+                self.telemetry.record_request("jobs", fields["status"])
+
+        if(job["webhook_url"]):
+            # The webhook is sent in its own task, so a slow receiver never holds the worker back from the next job.
+            notification = asyncio.create_task(self.notify_job(job["webhook_url"], job["id"]))
+            self.notifications.add(notification)
+            notification.add_done_callback(self.notifications.discard)
+
+    def get_webhook_headers(self, body : bytes) -> dict:
+        headers = {"Content-Type" : "application/json"}
+        if(self.webhook_secret):
+            headers["X-QueryGen-Signature"] = "sha256=" + hmac.new(self.webhook_secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        return headers
+
+    async def notify_job(self, webhook_url : str, job_id : str) -> None:
+        # The host is checked again before sending, because its DNS records may have changed since the job was submitted.
+        webhook_error = await asyncio.to_thread(self.check_webhook_url, webhook_url)
+        if(webhook_error is not None):
+            logger.warning("not sending webhook %s for job %s: %s", webhook_url, job_id, webhook_error)
+            return
+        job = await asyncio.to_thread(self.get, job_id)
+        if(job is not None):
+            await self.notify(webhook_url, job)
+
+    async def notify(self, webhook_url : str, job : JobResponse) -> None:
+        body = job.model_dump_json().encode("utf-8")
+        async with httpx.AsyncClient(timeout=self.webhook_timeout) as client:
+            for attempt in range(self.webhook_retries + 1):
+                try:
+                    response = await client.post(webhook_url, content=body, headers=self.get_webhook_headers(body))
+                    if(response.status_code < 500):
+                        return
+                except httpx.HTTPError as e:
+                    logger.warning("webhook %s failed for job %s: %s", webhook_url, job.job_id, e)
+                await asyncio.sleep(2 ** attempt)
+        logger.warning("giving up on webhook %s for job %s", webhook_url, job.job_id)
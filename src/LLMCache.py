@@ -0,0 +1,254 @@
+import asyncio
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import AsyncIterator, Callable
+from src.llm import BaseLLM
+from src.SharedCache import SQLiteCacheTier
+from src.Telemetry import Telemetry
+from src.Constant import LLM_CACHE_SIZE, LLM_CACHE_TTL
+
+
+class LLMResponseCache:
+    def __init__(self, max_size : int = LLM_CACHE_SIZE, ttl : float = LLM_CACHE_TTL, disk_tier : SQLiteCacheTier | None = None, telemetry : Telemetry | None = None) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.disk_tier = disk_tier
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.entries : OrderedDict[str, dict] = OrderedDict()
+        self.in_flight : dict[str, Future] = {}
+        self.async_in_flight : dict[str, asyncio.Future] = {}
+        self.lock = threading.Lock()
+        self.counters = {"memory_hits" : 0, "disk_hits" : 0, "misses" : 0, "coalesced" : 0, "uncacheable" : 0, "stored" : 0}
+
+    @staticmethod
+    def make_key(model : str, messages : list[tuple[str, str]], tools : list | None, return_tool : bool) -> str:
+        # Sorted keys and fixed separators make the same request hash the same, whichever client built the dicts.
+        payload = json.dumps([model, messages, tools if return_tool == True else None, return_tool], sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def count(self, event : str) -> None:
+        with self.lock:
+            self.counters[event] += 1
+        self.telemetry.record_llm_cache_event(event)
+
+    def get_from_memory(self, key : str) -> object | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if(entry is not None and time.time() - entry["created_at"] <= self.ttl):
+                self.entries.move_to_end(key)
+                value = entry["value"]
+            else:
+                self.entries.pop(key, None)
+                value = None
+
+        if(value is not None):
+            self.count("memory_hits")
+            return copy.deepcopy(value)
+        return None
+
+    def get_from_disk(self, key : str) -> object | None:
+        entry = self.disk_tier.get(key) if self.disk_tier is not None else None
+        if(entry is not None):
+            self.store_in_memory(key, entry)
+            self.count("disk_hits")
+            return copy.deepcopy(entry["value"])
+        return None
+
+    def get(self, key : str, count_miss : bool = True) -> object | None:
+        value = self.get_from_memory(key)
+        if(value is None):
+            value = self.get_from_disk(key)
+        if(value is None and count_miss):
+            self.count("misses")
+        return value
+
+    async def get_async(self, key : str, count_miss : bool = True) -> object | None:
+        # The disk tier is read in a thread, so a SQLite lookup never blocks the event loop.
+        value = self.get_from_memory(key)
+        if(value is None and self.disk_tier is not None):
+            value = await asyncio.to_thread(self.get_from_disk, key)
+        if(value is None and count_miss):
+            self.count("misses")
+        return value
+
+    def store_in_memory(self, key : str, entry : dict) -> None:
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while(len(self.entries) > self.max_size):
+                self.entries.popitem(last=False)
+
+    def make_entry(self, value : object) -> dict | None:
+        if(value is None or value == ""):
+            return None
+        return {"value" : copy.deepcopy(value), "created_at" : time.time()}
+
+    def set(self, key : str, value : object) -> None:
+        entry = self.make_entry(value)
+        if(entry is None):
+            return
+        self.store_in_memory(key, entry)
+        if(self.disk_tier is not None):
+            self.disk_tier.set(key, entry)
+        self.count("stored")
+
+    async def set_async(self, key : str, value : object) -> None:
+        entry = self.make_entry(value)
+        if(entry is None):
+            return
+        self.store_in_memory(key, entry)
+        if(self.disk_tier is not None):
+            await asyncio.to_thread(self.disk_tier.set, key, entry)
+        self.count("stored")
+
+    def call(self, key : str, fetch : Callable[[], object]) -> object:
+        value = self.get(key, count_miss=False)
+        if(value is not None):
+            return value
+
+        # Only the first caller reaches the provider; identical calls arriving meanwhile wait for its result.
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if(leader):
+                future = Future()
+                self.in_flight[key] = future
+
+        if(not leader):
+            self.count("coalesced")
+            return copy.deepcopy(future.result())
+
+        self.count("misses")
+        try:
+            value = fetch()
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+
+    async def call_async(self, key : str, fetch : Callable[[], object]) -> object:
+        value = await self.get_async(key, count_miss=False)
+        if(value is not None):
+            return value
+
+        with self.lock:
+            future = self.async_in_flight.get(key)
+            leader = future is None or future.get_loop() is not asyncio.get_running_loop()
+            if(leader):
+                future = asyncio.get_running_loop().create_future()
+                self.async_in_flight[key] = future
+
+        if(not leader):
+            self.count("coalesced")
+            try:
+                return copy.deepcopy(await asyncio.shield(future))
+            except asyncio.CancelledError:
+                # A cancelled leader (a lost hedge or speculative round) leaves its followers to call the provider themselves.
+                if(not future.cancelled()):
+                    raise
+                return await self.call_async(key, fetch)
+
+        self.count("misses")
+        try:
+            value = await fetch()
+            # Followers are released before the disk write, which only the leader waits for.
+            future.set_result(value)
+            await self.set_async(key, value)
+            return value
+        except asyncio.CancelledError:
+            if(not future.done()):
+                future.cancel()
+            raise
+        except Exception as e:
+            if(not future.done()):
+                future.set_exception(e)
+                future.exception()
+            raise
+        finally:
+            with self.lock:
+                if(self.async_in_flight.get(key) is future):
+                    self.async_in_flight.pop(key)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+        if(self.disk_tier is not None):
+            self.disk_tier.clear()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            # A coalesced call is neither a hit nor a miss: it waited on a provider call that another request made.
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            lookups = hits + self.counters["coalesced"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hits" : hits,
+                "hit_rate" : hits / lookups if lookups else 0.0,
+                "saved_rate" : (hits + self.counters["coalesced"]) / lookups if lookups else 0.0,
+                "size" : len(self.entries),
+                "in_flight" : len(self.in_flight) + len(self.async_in_flight),
+            }
+
+
+class CachedLLM(BaseLLM):
+    def __init__(self, llm : BaseLLM, cache : LLMResponseCache) -> None:
+        self.llm = llm
+        self.cache = cache
+
+    def get_chat_message(self, content : str, role : str) -> object:
+        return self.llm.get_chat_message(content=content, role=role)
+
+    def get_chat_content(self, message : object) -> str:
+        return self.llm.get_chat_content(message)
+
+    def get_chat_role(self, message : object) -> str:
+        return self.llm.get_chat_role(message)
+
+    def convert_messages(self, messages : list, source_llm : BaseLLM) -> list:
+        return self.llm.convert_messages(messages, self.llm if source_llm is self else source_llm)
+
+    def get_cache_key(self, model : str, messages : list, temperature : float, tools : list | None, return_tool : bool) -> str | None:
+        # Only deterministic calls are served from the cache; sampled calls are expected to differ.
+        if(temperature != 0):
+            self.cache.count("uncacheable")
+            return None
+        return self.cache.make_key(model, [(self.get_chat_role(message), self.get_chat_content(message)) for message in messages], tools, return_tool)
+
+    def invoke(self, model : str, messages : list, temperature : float, tools : dict = None, return_tool : bool = True, usage_callback : Callable[[int | None, int | None, int | None], None] | None = None) -> str | dict:
+        key = self.get_cache_key(model, messages, temperature, tools, return_tool)
+        fetch = lambda : self.llm.invoke(model=model, messages=messages, temperature=temperature, tools=tools, return_tool=return_tool, usage_callback=usage_callback)
+        if(key is None):
+            return fetch()
+        return self.cache.call(key, fetch)
+
+    async def invoke_async(self, model : str, messages : list, temperature : float, tools : dict = None, return_tool : bool = True, usage_callback : Callable[[int | None, int | None, int | None], None] | None = None) -> str | dict:
+        key = self.get_cache_key(model, messages, temperature, tools, return_tool)
+        fetch = lambda : self.llm.invoke_async(model=model, messages=messages, temperature=temperature, tools=tools, return_tool=return_tool, usage_callback=usage_callback)
+        if(key is None):
+            return await fetch()
+        return await self.cache.call_async(key, fetch)
+
+    async def stream_async(self, model : str, messages : list, temperature : float, usage_callback : Callable[[int | None, int | None, int | None], None] | None = None) -> AsyncIterator[str]:
+        # A stream shares its key with the plain completion, so either one can answer the other; a hit is sent as one token.
+        key = self.get_cache_key(model, messages, temperature, None, False)
+        cached = await self.cache.get_async(key) if key is not None else None
+        if(cached is not None):
+            yield cached
+            return
+
+        output = []
+        async for token in self.llm.stream_async(model=model, messages=messages, temperature=temperature, usage_callback=usage_callback):
+            output.append(token)
+            yield token
+        if(key is not None):
+            await self.cache.set_async(key, "".join(output))
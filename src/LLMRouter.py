@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import httpx
+import openai
+from typing import AsyncIterator, Callable
+from mistralai.exceptions import MistralException, MistralConnectionException
+from src.llm import BaseLLM
+from src.Telemetry import Telemetry
+from src.Constant import LLM_REQUEST_TIMEOUT, LLM_MAX_RETRIES, LLM_RETRY_BACKOFF, LLM_RETRY_MAX_BACKOFF, LLM_RETRYABLE_STATUS, LLM_MAX_CONCURRENCY, LLM_REQUESTS_PER_MINUTE, LLM_HEDGE_DELAY, LLM_FAILURE_THRESHOLD, LLM_FAILURE_COOLDOWN
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate : float, capacity : float) -> None:
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        # The token is taken immediately, so concurrent callers queue up behind each other instead of racing for the refill.
+        if(self.rate <= 0):
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self) -> None:
+        delay = self.reserve()
+        if(delay > 0):
+            time.sleep(delay)
+
+    async def acquire_async(self) -> None:
+        delay = self.reserve()
+        if(delay > 0):
+            await asyncio.sleep(delay)
+
+
+class LLMBackend:
+    def __init__(self, model : str, llm : BaseLLM, max_concurrency : int, requests_per_minute : float, failure_threshold : int, failure_cooldown : float) -> None:
+        self.model = model
+        self.llm = llm
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.async_semaphore = asyncio.Semaphore(max_concurrency)
+        self.bucket = TokenBucket(requests_per_minute / 60, max_concurrency)
+        self.failure_threshold = failure_threshold
+        self.failure_cooldown = failure_cooldown
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.lock = threading.Lock()
+
+    def is_healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.consecutive_failures += 1
+            if(self.consecutive_failures >= self.failure_threshold):
+                self.unhealthy_until = time.monotonic() + self.failure_cooldown
+                self.consecutive_failures = 0
+                logger.warning("llm backend %s marked unhealthy for %.0f seconds", self.model, self.failure_cooldown)
+
+
+class LLMRouter(BaseLLM):
+    def __init__(
+        self,
+        backends : dict[str, BaseLLM],
+        telemetry : Telemetry | None = None,
+        timeout : float = LLM_REQUEST_TIMEOUT,
+        max_retries : int = LLM_MAX_RETRIES,
+        retry_backoff : float = LLM_RETRY_BACKOFF,
+        retry_max_backoff : float = LLM_RETRY_MAX_BACKOFF,
+        max_concurrency : dict[str, int] | None = None,
+        requests_per_minute : dict[str, float] | None = None,
+        hedge_delay : float = LLM_HEDGE_DELAY,
+        failover : bool = True,
+        failure_threshold : int = LLM_FAILURE_THRESHOLD,
+        failure_cooldown : float = LLM_FAILURE_COOLDOWN,
+    ) -> None:
+        max_concurrency = max_concurrency if max_concurrency is not None else LLM_MAX_CONCURRENCY
+        requests_per_minute = requests_per_minute if requests_per_minute is not None else LLM_REQUESTS_PER_MINUTE
+        self.backends = {
+            model : LLMBackend(model, llm, max_concurrency.get(model, 8), requests_per_minute.get(model, 0.0), failure_threshold, failure_cooldown)
+            for model, llm in backends.items()
+        }
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retry_max_backoff = retry_max_backoff
+        self.hedge_delay = hedge_delay
+        self.failover = failover
+
+    def get_chat_message(self, content : str, role : str) -> dict:
+        return {"role": role, "content": content}
+
+    def get_chat_content(self, message : dict) -> str:
+        return message["content"]
+
+    def get_chat_role(self, message : dict) -> str:
+        return message["role"]
+
+    def get_route(self, model : str) -> list[LLMBackend]:
+        if(model not in self.backends):
+            raise Exception("Not Implemented", f"No LLM backend is configured for {model}")
+
+        primary = self.backends[model]
+        if(self.failover == False):
+            return [primary]
+
+        # Unhealthy backends are kept as a last resort rather than dropped, so a request never fails only because every backend is cooling down.
+        backends = [primary] + [backend for backend in self.backends.values() if backend is not primary]
+        return [backend for backend in backends if backend.is_healthy()] + [backend for backend in backends if not backend.is_healthy()]
+
+    def is_retryable(self, error : Exception) -> bool:
+        if(isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError, openai.APIConnectionError, MistralConnectionException))):
+            return True
+        if(isinstance(error, MistralException) and isinstance(error.__cause__, httpx.TransportError)):
+            return True
+        status = getattr(error, "status_code", None) or getattr(error, "http_status", None)
+        return isinstance(status, int) and (status in LLM_RETRYABLE_STATUS or status >= 500)
+
+    def get_retry_delay(self, error : Exception, attempt : int) -> float:
+        headers = getattr(error, "headers", None) or getattr(getattr(error, "response", None), "headers", None) or {}
+        try:
+            return min(float(headers.get("retry-after")), self.retry_max_backoff)
+        except (TypeError, ValueError):
+            return random.uniform(0, min(self.retry_max_backoff, self.retry_backoff * 2 ** attempt))
+
+    def call_backend(self, backend : LLMBackend, messages : list[dict], temperature : float, tools : dict, return_tool : bool, usage_callback : Callable | None) -> str | dict:
+        backend_messages = backend.llm.convert_messages(messages, self)
+        attempt = 0
+        while True:
+            backend.bucket.acquire()
+            try:
+                with backend.semaphore:
+                    output = backend.llm.invoke(model=backend.model, messages=backend_messages, temperature=temperature, tools=tools, return_tool=return_tool, usage_callback=usage_callback)
+                backend.record_success()
+                return output
+            except Exception as e:
+                if(not self.is_retryable(e)):
+                    raise
+                backend.record_failure()
+                if(attempt >= self.max_retries):
+                    raise
+                delay = self.get_retry_delay(e, attempt)
+
+            attempt += 1
+            self.telemetry.record_llm_router_event("retry", backend.model)
+            logger.warning("retrying llm call on %s in %.2f seconds (attempt %d)", backend.model, delay, attempt)
+            time.sleep(delay)
+
+    async def call_backend_async(self, backend : LLMBackend, messages : list[dict], temperature : float, tools : dict, return_tool : bool, usage_callback : Callable | None) -> str | dict:
+        backend_messages = backend.llm.convert_messages(messages, self)
+        attempt = 0
+        while True:
+            await backend.bucket.acquire_async()
+            try:
+                async with backend.async_semaphore:
+                    output = await asyncio.wait_for(backend.llm.invoke_async(model=backend.model, messages=backend_messages, temperature=temperature, tools=tools, return_tool=return_tool, usage_callback=usage_callback), self.timeout)
+                backend.record_success()
+                return output
+            except Exception as e:
+                if(not self.is_retryable(e)):
+                    raise
+                backend.record_failure()
+                if(attempt >= self.max_retries):
+                    raise
+                delay = self.get_retry_delay(e, attempt)
+
+            attempt += 1
+            self.telemetry.record_llm_router_event("retry", backend.model)
+            logger.warning("retrying llm call on %s in %.2f seconds (attempt %d)", backend.model, delay, attempt)
+            await asyncio.sleep(delay)
+
+    def invoke(self, model : str, messages : list[dict], temperature : float, tools : dict = None, return_tool : bool = True, usage_callback : Callable[[int | None, int | None, int | None], None] | None = None) -> str | dict:
+        route = self.get_route(model)
+        for index, backend in enumerate(route):
+            try:
+                return self.call_backend(backend, messages, temperature, tools, return_tool, usage_callback)
+            except Exception as e:
+                if(index == len(route) - 1 or not self.is_retryable(e)):
+                    raise
+                self.telemetry.record_llm_router_event("failover", backend.model)
+                logger.warning("llm backend %s failed, failing over to %s: %s", backend.model, route[index + 1].model, e)
+
+    async def invoke_route_async(self, route : list[LLMBackend], messages : list[dict], temperature : float, tools : dict, return_tool : bool, usage_callback : Callable | None) -> str | dict:
+        for index, backend in enumerate(route):
+            try:
+                return await self.call_backend_async(backend, messages, temperature, tools, return_tool, usage_callback)
+            except Exception as e:
+                if(index == len(route) - 1 or not self.is_retryable(e)):
+                    raise
+                self.telemetry.record_llm_router_event("failover", backend.model)
+                logger.warning("llm backend %s failed, failing over to %s: %s", backend.model, route[index + 1].model, e)
+
+    async def invoke_hedged_async(self, route : list[LLMBackend], messages : list[dict], temperature : float, tools : dict, return_tool : bool, usage_callback : Callable | None) -> str | dict:
+        primary = asyncio.ensure_future(self.call_backend_async(route[0], messages, temperature, tools, return_tool, usage_callback))
+        done, _ = await asyncio.wait([primary], timeout=self.hedge_delay)
+        if(primary in done):
+            if(primary.exception() is None):
+                return primary.result()
+            if(not self.is_retryable(primary.exception())):
+                raise primary.exception()
+            self.telemetry.record_llm_router_event("failover", route[0].model)
+            return await self.invoke_route_async(route[1:], messages, temperature, tools, return_tool, usage_callback)
+
+        # The primary is slower than the hedge delay, so the next backend races it and the first success wins.
+        self.telemetry.record_llm_router_event("hedge", route[1].model)
+        hedge = asyncio.ensure_future(self.invoke_route_async(route[1:], messages, temperature, tools, return_tool, usage_callback))
+        pending = {primary, hedge}
+        try:
+            while(len(pending) > 0):
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if(task.exception() is None):
+                        if(task is hedge):
+                            self.telemetry.record_llm_router_event("hedge_won", route[1].model)
+                        return task.result()
+            raise primary.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def invoke_async(self, model : str, messages : list[dict], temperature : float, tools : dict = None, return_tool : bool = True, usage_callback : Callable[[int | None, int | None, int | None], None] | None = None) -> str | dict:
+        route = self.get_route(model)
+        if(self.hedge_delay > 0 and len(route) > 1):
+            return await self.invoke_hedged_async(route, messages, temperature, tools, return_tool, usage_callback)
+        return await self.invoke_route_async(route, messages, temperature, tools, return_tool, usage_callback)
+
+    async def stream_async(self, model : str, messages : list[dict], temperature : float, usage_callback : Callable[[int | None, int | None, int | None], None] | None = None) -> AsyncIterator[str]:
+        # A stream can only fail over before its first token; once tokens were sent, an error is raised to the caller.
+        route = self.get_route(model)
+        for index, backend in enumerate(route):
+            started = False
+            try:
+                await backend.bucket.acquire_async()
+                async with backend.async_semaphore:
+                    async for token in backend.llm.stream_async(model=backend.model, messages=backend.llm.convert_messages(messages, self), temperature=temperature, usage_callback=usage_callback):
+                        started = True
+                        yield token
+                backend.record_success()
+                return
+            except Exception as e:
+                if(not self.is_retryable(e)):
+                    raise
+                backend.record_failure()
+                if(started or index == len(route) - 1):
+                    raise
+                self.telemetry.record_llm_router_event("failover", backend.model)
+                logger.warning("llm backend %s failed, failing over to %s: %s", backend.model, route[index + 1].model, e)
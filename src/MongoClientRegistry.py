@@ -0,0 +1,119 @@
+import pymongo
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+from src.Constant import MONGO_CLIENT_REGISTRY_SIZE, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_HEALTH_CHECK_INTERVAL, MONGO_CLIENT_CLOSE_GRACE_PERIOD
+
+
+class MongoClientRegistry:
+    def __init__(
+        self,
+        max_size : int = MONGO_CLIENT_REGISTRY_SIZE,
+        max_pool_size : int = MONGO_MAX_POOL_SIZE,
+        min_pool_size : int = MONGO_MIN_POOL_SIZE,
+        max_idle_time_ms : int = MONGO_MAX_IDLE_TIME_MS,
+        server_selection_timeout_ms : int = MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        health_check_interval : float = MONGO_HEALTH_CHECK_INTERVAL,
+        close_grace_period : float = MONGO_CLIENT_CLOSE_GRACE_PERIOD,
+        client_factory : Callable[..., Any] = pymongo.MongoClient,
+    ) -> None:
+        self.max_size = max_size
+        self.client_options = {
+            "maxPoolSize" : max_pool_size,
+            "minPoolSize" : min_pool_size,
+            "maxIdleTimeMS" : max_idle_time_ms,
+            "serverSelectionTimeoutMS" : server_selection_timeout_ms,
+        }
+        self.health_check_interval = health_check_interval
+        self.close_grace_period = close_grace_period
+        self.client_factory = client_factory
+        self.clients : OrderedDict[str, Any] = OrderedDict()
+        self.last_health_check : dict[str, float] = {}
+        self.retired : list[tuple[float, Any]] = []
+        self.lock = threading.RLock()
+
+    def create_client(self, connection_url : str) -> Any:
+        return self.client_factory(connection_url, **self.client_options)
+
+    def is_healthy(self, client : Any) -> bool:
+        try:
+            client.admin.command("ping")
+            return True
+        except Exception:
+            return False
+
+    def health_check_due(self, connection_url : str) -> bool:
+        if(self.health_check_interval <= 0):
+            return False
+        last_check = self.last_health_check.get(connection_url, 0.0)
+        return time.monotonic() - last_check >= self.health_check_interval
+
+    def get_client(self, connection_url : str) -> Any:
+        self.close_retired()
+        check_health = False
+        with self.lock:
+            client = self.clients.get(connection_url)
+            if(client is not None):
+                self.clients.move_to_end(connection_url)
+                check_health = self.health_check_due(connection_url)
+                if(check_health):
+                    self.last_health_check[connection_url] = time.monotonic()
+
+        # The ping is a network round trip, so it must not hold the registry lock.
+        if(client is not None and check_health and not self.is_healthy(client)):
+            self.remove(connection_url, client)
+            client = None
+
+        if(client is not None):
+            return client
+
+        with self.lock:
+            client = self.clients.get(connection_url)
+            if(client is None):
+                client = self.create_client(connection_url)
+                self.clients[connection_url] = client
+                self.last_health_check[connection_url] = time.monotonic()
+                self.evict()
+            return client
+
+    def retire(self, client : Any) -> None:
+        # Readers built on this client may still be running queries, so it is only closed once the grace period has passed.
+        self.retired.append((time.monotonic() + self.close_grace_period, client))
+
+    def close_retired(self) -> None:
+        now = time.monotonic()
+        with self.lock:
+            clients = [client for close_at, client in self.retired if close_at <= now]
+            self.retired = [(close_at, client) for close_at, client in self.retired if close_at > now]
+        # Closing a client waits on its connections, so it must not hold the registry lock.
+        for client in clients:
+            client.close()
+
+    def evict(self) -> None:
+        while(len(self.clients) > self.max_size):
+            connection_url, client = self.clients.popitem(last=False)
+            self.last_health_check.pop(connection_url, None)
+            self.retire(client)
+
+    def remove(self, connection_url : str, client : Any = None) -> None:
+        with self.lock:
+            current = self.clients.get(connection_url)
+            if(current is None or (client is not None and current is not client)):
+                return
+            del self.clients[connection_url]
+            self.last_health_check.pop(connection_url, None)
+            self.retire(current)
+        self.close_retired()
+
+    def close_all(self) -> None:
+        with self.lock:
+            clients = list(self.clients.values()) + [client for _, client in self.retired]
+            self.clients.clear()
+            self.last_health_check.clear()
+            self.retired = []
+        for client in clients:
+            client.close()
+
+    def __len__(self) -> int:
+        return len(self.clients)
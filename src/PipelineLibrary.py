@@ -0,0 +1,178 @@
+import fcntl
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from bson import json_util
+from src.TextIndex import TfidfIndex
+from src.Constant import PIPELINE_LIBRARY_MAX_ENTRIES, PIPELINE_LIBRARY_TOP_K, PIPELINE_LIBRARY_MIN_SIMILARITY, PIPELINE_LIBRARY_COMPACT_RATIO
+
+
+class PipelineLibrary:
+    def __init__(
+        self,
+        index_path : str | None = None,
+        max_entries : int = PIPELINE_LIBRARY_MAX_ENTRIES,
+        top_k : int = PIPELINE_LIBRARY_TOP_K,
+        min_similarity : float = PIPELINE_LIBRARY_MIN_SIMILARITY,
+        compact_ratio : int = PIPELINE_LIBRARY_COMPACT_RATIO,
+    ) -> None:
+        self.index_path = index_path
+        self.max_entries = max_entries
+        self.top_k = top_k
+        self.min_similarity = min_similarity
+        self.compact_ratio = compact_ratio
+        self.file_lines = 0
+        self.file_offset = 0
+        self.file_inode : int | None = None
+        self.entries : dict[str, dict] = {}
+        self.index = TfidfIndex()
+        self.lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def get_database_id(connection_url : str, database_name : str) -> str:
+        # Databases sharing a name on different clusters are kept apart; only a hash of the URL is stored, never its credentials.
+        return hashlib.sha256("\x00".join([connection_url, database_name]).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def get_entry_id(database_id : str, collection_name : str, question : str) -> str:
+        payload = "\x00".join([database_id, collection_name, " ".join(question.lower().split())])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @contextmanager
+    def lock_file(self, exclusive : bool) -> Iterator[None]:
+        # Worker processes share the file; an exclusive lock covers every append and rewrite, a shared one every read.
+        if(self.index_path is None):
+            yield
+            return
+        with open(f"{self.index_path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def sync(self) -> None:
+        # Lines appended by other workers are read incrementally; a file another worker rewrote is read again in full.
+        if(self.index_path is None):
+            return
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return
+        if(stat.st_ino != self.file_inode or stat.st_size < self.file_offset):
+            self.entries = {}
+            self.index = TfidfIndex()
+            self.file_lines = 0
+            self.file_offset = 0
+            self.file_inode = stat.st_ino
+        if(stat.st_size == self.file_offset):
+            return
+
+        with open(self.index_path, "rb") as file:
+            file.seek(self.file_offset)
+            for line in file:
+                if(not line.endswith(b"\n")):
+                    break
+                self.file_offset += len(line)
+                line = line.strip()
+                if(len(line) == 0):
+                    continue
+                try:
+                    entry = json_util.loads(line.decode("utf-8"))
+                except ValueError:
+                    continue
+                self.store_entry(entry)
+                self.file_lines += 1
+        self.evict()
+
+    def load(self) -> None:
+        if(self.index_path is None or not os.path.exists(self.index_path)):
+            return
+
+        with self.lock, self.lock_file(True):
+            self.sync()
+            self.compact()
+
+    def store_entry(self, entry : dict) -> None:
+        self.entries.pop(entry["id"], None)
+        self.entries[entry["id"]] = entry
+        self.index.add(entry["id"], entry["question"])
+
+    def evict(self) -> None:
+        while(len(self.entries) > self.max_entries):
+            entry_id = next(iter(self.entries))
+            del self.entries[entry_id]
+            self.index.remove(entry_id)
+
+    def compact(self) -> None:
+        if(self.index_path is None):
+            return
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as file:
+            for entry in self.entries.values():
+                file.write(json_util.dumps(entry) + "\n")
+        os.replace(temp_path, self.index_path)
+        stat = os.stat(self.index_path)
+        self.file_lines = len(self.entries)
+        self.file_offset = stat.st_size
+        self.file_inode = stat.st_ino
+
+    def needs_compaction(self) -> bool:
+        # Replaced entries stay in the file until it is rewritten, so it is compacted once it holds several lines per live entry.
+        return len(self.entries) > self.max_entries or self.file_lines > self.compact_ratio * max(len(self.entries), 1)
+
+    def is_known(self, entry_id : str, mongodb_pipeline : list[dict]) -> bool:
+        current = self.entries.get(entry_id)
+        return current is not None and json_util.dumps(current["mongodb_pipeline"]) == json_util.dumps(mongodb_pipeline)
+
+    def add(self, connection_url : str, database_name : str, question : str, collection_name : str, mongodb_pipeline : list[dict], execution_ms : float) -> None:
+        database_id = self.get_database_id(connection_url, database_name)
+        entry = {
+            "id" : self.get_entry_id(database_id, collection_name, question),
+            "database_id" : database_id,
+            "database_name" : database_name,
+            "question" : question,
+            "collection_name" : collection_name,
+            "mongodb_pipeline" : mongodb_pipeline,
+            "execution_ms" : round(execution_ms, 2),
+            "created_at" : time.time(),
+        }
+
+        # The file is read up to its end before writing, so a compaction never drops lines other workers appended.
+        with self.lock, self.lock_file(True):
+            self.sync()
+            # A question answered again with the same pipeline adds nothing, so neither the index nor the file is touched.
+            if(self.is_known(entry["id"], mongodb_pipeline)):
+                return
+            self.store_entry(entry)
+            if(self.index_path is not None):
+                with open(self.index_path, "a") as file:
+                    file.write(json_util.dumps(entry) + "\n")
+                self.file_lines += 1
+                self.file_offset = os.stat(self.index_path).st_size
+            if(self.needs_compaction()):
+                self.evict()
+                self.compact()
+
+    def search(self, connection_url : str, database_name : str, question : str, collection_list : list[str], top_k : int | None = None) -> list[dict]:
+        database_id = self.get_database_id(connection_url, database_name)
+        with self.lock:
+            with self.lock_file(False):
+                self.sync()
+            # Entries recorded before the connection URL was part of the key have no database_id and are never returned.
+            candidate_ids = {
+                entry_id for entry_id, entry in self.entries.items()
+                if entry.get("database_id") == database_id and entry["collection_name"] in collection_list
+            }
+            if(len(candidate_ids) == 0):
+                return []
+
+            matches = self.index.search(question, top_k or self.top_k, candidate_ids)
+            return [self.entries[entry_id] for entry_id, score in matches if score >= self.min_similarity]
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -0,0 +1,154 @@
+from src.Schemas import AnalyzeConditions
+
+KNOWN_STAGES = {
+    "$addFields", "$bucket", "$bucketAuto", "$collStats", "$count", "$densify", "$documents", "$facet", "$fill", "$geoNear",
+    "$graphLookup", "$group", "$indexStats", "$limit", "$lookup", "$match", "$merge", "$out", "$project", "$redact",
+    "$replaceRoot", "$replaceWith", "$sample", "$search", "$searchMeta", "$set", "$setWindowFields", "$skip", "$sort",
+    "$sortByCount", "$unionWith", "$unset", "$unwind", "$vectorSearch",
+}
+WRITE_STAGES = {"$out", "$merge"}
+AGGREGATING_STAGES = {"$group", "$count", "$sortByCount", "$bucket", "$bucketAuto"}
+FILTER_STAGES = {"$match", "$sort", "$limit", "$skip", "$sample"}
+SUB_PIPELINE_STAGES = {"$lookup", "$unionWith", "$facet"}
+
+
+class PipelineValidator:
+    def __init__(self, collection_list : list[str], collection_schema : dict[str, dict] | None = None) -> None:
+        self.collection_list = collection_list
+        self.collection_schema = collection_schema or {}
+
+    def iter_stages(self, pipeline : list[dict]):
+        for stage in pipeline:
+            if(not isinstance(stage, dict) or len(stage) != 1):
+                continue
+            operator, body = next(iter(stage.items()))
+            yield operator, body
+            if(operator == "$lookup" and isinstance(body, dict) and isinstance(body.get("pipeline"), list)):
+                yield from self.iter_stages(body["pipeline"])
+            elif(operator == "$unionWith" and isinstance(body, dict) and isinstance(body.get("pipeline"), list)):
+                yield from self.iter_stages(body["pipeline"])
+            elif(operator == "$facet" and isinstance(body, dict)):
+                for sub_pipeline in body.values():
+                    if(isinstance(sub_pipeline, list)):
+                        yield from self.iter_stages(sub_pipeline)
+
+    def get_foreign_collections(self, pipeline : list[dict]) -> list[str]:
+        collections = []
+        for operator, body in self.iter_stages(pipeline):
+            if(operator in ["$lookup", "$graphLookup"] and isinstance(body, dict) and isinstance(body.get("from"), str)):
+                collections.append(body["from"])
+            elif(operator == "$unionWith"):
+                collection = body.get("coll") if isinstance(body, dict) else body
+                if(isinstance(collection, str)):
+                    collections.append(collection)
+        return collections
+
+    def collect_field_references(self, value : object, fields : set[str], match_keys : bool, expression : bool = True) -> None:
+        # Query values are literals, so "$100" in a $match is only a field path inside $expr.
+        if(isinstance(value, str)):
+            if(expression and value.startswith("$") and not value.startswith("$$")):
+                fields.add(value[1:])
+        elif(isinstance(value, list)):
+            for item in value:
+                self.collect_field_references(item, fields, match_keys, expression)
+        elif(isinstance(value, dict)):
+            for key, item in value.items():
+                if(match_keys and not key.startswith("$")):
+                    fields.add(key)
+                    self.collect_field_references(item, fields, False, False)
+                elif(key == "$expr"):
+                    self.collect_field_references(item, fields, False, True)
+                else:
+                    self.collect_field_references(item, fields, match_keys and key in ["$and", "$or", "$nor"], expression)
+
+    def get_input_fields(self, pipeline : list[dict]) -> set[str]:
+        # Only stages reading the collection documents are checked, because later stages see reshaped documents.
+        fields : set[str] = set()
+        for stage in pipeline:
+            operator, body = next(iter(stage.items()))
+            if(operator in ["$match", "$sort"]):
+                self.collect_field_references(body, fields, True, False)
+            elif(operator in FILTER_STAGES):
+                continue
+            else:
+                if(operator == "$unwind"):
+                    self.collect_field_references(body, fields, False)
+                elif(operator == "$lookup" and isinstance(body, dict) and isinstance(body.get("localField"), str)):
+                    fields.add(body["localField"])
+                elif(operator in ["$group", "$project", "$addFields", "$set", "$sortByCount", "$bucket", "$bucketAuto"]):
+                    self.collect_field_references(body, fields, False)
+                break
+        return {field for field in fields if len(field) > 0}
+
+    def get_group_key_types(self, pipeline : list[dict], schema : dict[str, dict]) -> list[str]:
+        types = []
+        for stage in pipeline:
+            operator, body = next(iter(stage.items()))
+            if(operator == "$group" and isinstance(body, dict)):
+                fields : set[str] = set()
+                self.collect_field_references(body.get("_id"), fields, False)
+                for field in fields:
+                    types.extend(schema.get(field.split(".")[0], {}).get("data_type", []))
+                break
+        return types
+
+    def build_verdict(self, issues : dict[str, list[str]]) -> AnalyzeConditions:
+        def reason(name : str) -> str:
+            return " ".join(issues[name]) if len(issues[name]) > 0 else "Checked by local pipeline rules; no issue found."
+
+        return AnalyzeConditions(
+            intermediate_query = len(issues["intermediate_query"]) > 0,
+            reason_for_intermediate_query = reason("intermediate_query"),
+            contains_DML_operation = len(issues["contains_DML_operation"]) > 0,
+            reason_for_contains_DML_operation = reason("contains_DML_operation"),
+            contains_raw_output = len(issues["contains_raw_output"]) > 0,
+            reason_for_contains_raw_output = reason("contains_raw_output"),
+            incorrect_query = len(issues["incorrect_query"]) > 0,
+            reason_for_incorrect_query = reason("incorrect_query"),
+        )
+
+    def validate(self, collection_name : str, pipeline : object) -> AnalyzeConditions | None:
+        issues : dict[str, list[str]] = {"intermediate_query" : [], "contains_DML_operation" : [], "contains_raw_output" : [], "incorrect_query" : []}
+
+        if(not isinstance(pipeline, list) or len(pipeline) == 0):
+            issues["intermediate_query"].append("the mongodb_pipeline is empty or is not a list of stages.")
+            return self.build_verdict(issues)
+
+        for index, stage in enumerate(pipeline):
+            if(not isinstance(stage, dict) or len(stage) != 1):
+                issues["incorrect_query"].append(f"stage {index} must be a document with exactly one stage operator.")
+        if(len(issues["incorrect_query"]) > 0):
+            return self.build_verdict(issues)
+
+        for operator, body in self.iter_stages(pipeline):
+            if(operator in WRITE_STAGES):
+                issues["contains_DML_operation"].append(f"the pipeline uses the {operator} stage, which writes data.")
+            elif(operator not in KNOWN_STAGES):
+                issues["incorrect_query"].append(f"{operator} is not a valid aggregation stage.")
+
+        if(collection_name not in self.collection_list):
+            issues["incorrect_query"].append(f"the collection \"{collection_name}\" is not in the accessible collections {self.collection_list}.")
+
+        for foreign_collection in self.get_foreign_collections(pipeline):
+            if(foreign_collection not in self.collection_list):
+                issues["incorrect_query"].append(f"the pipeline reads the collection \"{foreign_collection}\", which is not in the accessible collections {self.collection_list}.")
+
+        # The schema leaves out sparse fields, so a field missing from it is left to the LLM analyzer rather than rejected.
+        schema = self.collection_schema.get(collection_name) or {}
+        unknown_fields = [field for field in self.get_input_fields(pipeline) if field.split(".")[0] not in schema]
+
+        operators = [next(iter(stage.keys())) for stage in pipeline]
+        aggregated = len(AGGREGATING_STAGES.intersection(operators)) > 0
+        if(not aggregated and "$limit" not in operators):
+            issues["contains_raw_output"].append("the pipeline returns raw documents without a $limit stage. Aggregate the documents or add a $limit.")
+
+        if(sum(len(reasons) for reasons in issues.values()) > 0):
+            return self.build_verdict(issues)
+
+        # Only self-contained aggregations over known fields are approved locally; the rest is left to the LLM analyzer.
+        if(not aggregated or len(SUB_PIPELINE_STAGES.intersection(operators)) > 0 or len(schema) == 0 or len(unknown_fields) > 0):
+            return None
+        if("objectId" in self.get_group_key_types(pipeline, schema)):
+            return None
+
+        return self.build_verdict(issues)
@@ -0,0 +1,90 @@
+import threading
+import time
+from src.Schemas import QueryInput
+from src.Constant import BUDGET_LIMIT_ITERATIONS, BUDGET_LIMIT_WALL_CLOCK, BUDGET_LIMIT_TOKENS, BUDGET_LIMIT_MONGO_TIME, BUDGET_MAX_ITERATIONS, BUDGET_MAX_SECONDS, BUDGET_MAX_TOKENS, BUDGET_MAX_MONGO_MS
+
+
+class RequestBudget:
+    def __init__(self, max_iterations : int | None, max_seconds : float | None, max_tokens : int | None, max_mongo_ms : int | None) -> None:
+        self.max_iterations = max_iterations
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.max_mongo_ms = max_mongo_ms
+        self.start_time = time.monotonic()
+        self.tokens = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.mongo_ms = 0.0
+        self.lock = threading.Lock()
+
+    def add_tokens(self, prompt_tokens : int | None, completion_tokens : int | None, cached_tokens : int | None = None) -> None:
+        with self.lock:
+            self.tokens += (prompt_tokens or 0) + (completion_tokens or 0)
+            self.prompt_tokens += prompt_tokens or 0
+            self.cached_tokens += cached_tokens or 0
+
+    def add_mongo_ms(self, mongo_ms : float) -> None:
+        with self.lock:
+            self.mongo_ms += mongo_ms
+
+    def get_elapsed_seconds(self) -> float:
+        return time.monotonic() - self.start_time
+
+    def get_remaining_mongo_ms(self) -> int | None:
+        if(self.max_mongo_ms is None):
+            return None
+        return max(int(self.max_mongo_ms - self.mongo_ms), 0)
+
+    def get_exhausted_limit(self, attempt_count : int) -> str | None:
+        if(self.max_iterations is not None and attempt_count >= self.max_iterations):
+            return BUDGET_LIMIT_ITERATIONS
+        if(self.max_seconds is not None and self.get_elapsed_seconds() >= self.max_seconds):
+            return BUDGET_LIMIT_WALL_CLOCK
+        if(self.max_tokens is not None and self.tokens >= self.max_tokens):
+            return BUDGET_LIMIT_TOKENS
+        if(self.max_mongo_ms is not None and self.mongo_ms >= self.max_mongo_ms):
+            return BUDGET_LIMIT_MONGO_TIME
+        return None
+
+    def get_usage(self) -> dict:
+        with self.lock:
+            return {
+                "seconds" : round(self.get_elapsed_seconds(), 3),
+                "tokens" : self.tokens,
+                "prompt_tokens" : self.prompt_tokens,
+                "cached_tokens" : self.cached_tokens,
+                "cached_token_ratio" : round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0,
+                "mongo_ms" : round(self.mongo_ms, 1),
+            }
+
+
+class BudgetController:
+    def __init__(
+        self,
+        max_iterations : int = BUDGET_MAX_ITERATIONS,
+        max_seconds : float = BUDGET_MAX_SECONDS,
+        max_tokens : int = BUDGET_MAX_TOKENS,
+        max_mongo_ms : int = BUDGET_MAX_MONGO_MS,
+    ) -> None:
+        self.max_iterations = max_iterations
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.max_mongo_ms = max_mongo_ms
+
+    @staticmethod
+    def cap(requested : int | float | None, server_limit : int | float) -> int | float | None:
+        # A server limit of 0 or less leaves the limit to the request.
+        if(server_limit <= 0):
+            return requested
+        if(requested is None):
+            return server_limit
+        return min(requested, server_limit)
+
+    def create(self, input_parameters : QueryInput) -> RequestBudget:
+        max_iterations = self.cap(input_parameters.max_iterations, self.max_iterations)
+        return RequestBudget(
+            max_iterations = max(max_iterations, 1) if max_iterations is not None else None,
+            max_seconds = self.cap(input_parameters.max_seconds, self.max_seconds),
+            max_tokens = self.cap(input_parameters.max_tokens, self.max_tokens),
+            max_mongo_ms = self.cap(input_parameters.max_mongo_ms, self.max_mongo_ms),
+        )
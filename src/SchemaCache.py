@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from src.SharedCache import SQLiteCacheTier
+from src.Constant import SCHEMA_CACHE_SIZE, SCHEMA_CACHE_TTL, SCHEMA_CACHE_STATS_TOLERANCE
+
+
+class SchemaCache:
+    def __init__(
+        self,
+        max_size : int = SCHEMA_CACHE_SIZE,
+        ttl : float = SCHEMA_CACHE_TTL,
+        cache_dir : str | None = None,
+        validate_with_stats : bool = False,
+        stats_tolerance : float = SCHEMA_CACHE_STATS_TOLERANCE,
+        shared_tier : SQLiteCacheTier | None = None,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.validate_with_stats = validate_with_stats
+        self.stats_tolerance = stats_tolerance
+        self.shared_tier = shared_tier
+        self.entries : OrderedDict[str, dict] = OrderedDict()
+        self.lock = threading.RLock()
+        self.counters = {"memory_hits" : 0, "disk_hits" : 0, "misses" : 0, "expired" : 0, "invalidated" : 0}
+
+        if(self.cache_dir is not None):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(connection_url : str, database_name : str, collection_name : str, example_count : int, *extra : object) -> str:
+        payload = json.dumps([connection_url, database_name, collection_name, example_count, *extra], default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_disk_path(self, key : str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def fingerprint_changed(self, cached_fingerprint : dict | None, fingerprint : dict | None) -> bool:
+        if(fingerprint is None or cached_fingerprint is None):
+            return False
+
+        if(cached_fingerprint.get("nindexes") != fingerprint.get("nindexes")):
+            return True
+
+        for field in ["count", "avgObjSize"]:
+            old_value = cached_fingerprint.get(field) or 0
+            new_value = fingerprint.get(field) or 0
+            if(abs(new_value - old_value) > self.stats_tolerance * max(old_value, 1)):
+                return True
+
+        return False
+
+    def is_valid(self, entry : dict, fingerprint : dict | None) -> bool:
+        if(time.time() - entry["created_at"] > self.ttl):
+            self.counters["expired"] += 1
+            return False
+        if(self.fingerprint_changed(entry.get("fingerprint"), fingerprint)):
+            self.counters["invalidated"] += 1
+            return False
+        return True
+
+    def read_disk_entry(self, key : str) -> dict | None:
+        # The shared tier takes the place of the disk tier, so every worker process reads the same entries.
+        if(self.shared_tier is not None):
+            return self.shared_tier.get(key)
+        if(self.cache_dir is None):
+            return None
+        try:
+            with open(self.get_disk_path(key), "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def write_disk_entry(self, key : str, entry : dict) -> None:
+        if(self.shared_tier is not None):
+            self.shared_tier.set(key, entry)
+            return
+        if(self.cache_dir is None):
+            return
+        path = self.get_disk_path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w") as file:
+                json.dump(entry, file)
+            os.replace(temp_path, path)
+        except OSError:
+            if(os.path.exists(temp_path)):
+                os.remove(temp_path)
+
+    def remove_disk_entry(self, key : str) -> None:
+        if(self.shared_tier is not None):
+            self.shared_tier.invalidate(key)
+            return
+        if(self.cache_dir is None):
+            return
+        try:
+            os.remove(self.get_disk_path(key))
+        except OSError:
+            pass
+
+    def store_in_memory(self, key : str, entry : dict) -> None:
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while(len(self.entries) > self.max_size):
+            self.entries.popitem(last=False)
+
+    def get(self, key : str, fingerprint : dict | None = None) -> dict | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if(entry is not None):
+                if(self.is_valid(entry, fingerprint)):
+                    self.entries.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return entry["schema"]
+                self.invalidate(key)
+
+            entry = self.read_disk_entry(key)
+            if(entry is not None):
+                if(self.is_valid(entry, fingerprint)):
+                    self.store_in_memory(key, entry)
+                    self.counters["disk_hits"] += 1
+                    return entry["schema"]
+                self.invalidate(key)
+
+            self.counters["misses"] += 1
+            return None
+
+    def get_recent_entry(self, key : str, max_age : float) -> dict | None:
+        # The persistent tier is read first, because another worker process may have refreshed the entry since this one cached it.
+        entry = self.read_disk_entry(key)
+        if(entry is None or time.time() - entry["created_at"] > max_age):
+            return None
+        with self.lock:
+            self.store_in_memory(key, entry)
+        return entry
+
+    def set(self, key : str, schema : dict, fingerprint : dict | None = None) -> None:
+        entry = {"schema" : schema, "created_at" : time.time(), "fingerprint" : fingerprint}
+        with self.lock:
+            self.store_in_memory(key, entry)
+        self.write_disk_entry(key, entry)
+
+    def invalidate(self, key : str) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+        self.remove_disk_entry(key)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+        if(self.shared_tier is not None):
+            self.shared_tier.clear()
+            return
+        if(self.cache_dir is None):
+            return
+        for file_name in os.listdir(self.cache_dir):
+            if(file_name.endswith(".json")):
+                self.remove_disk_entry(file_name[: -len(".json")])
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            lookups = hits + self.counters["misses"]
+            return {
+                **self.counters,
+                "hits" : hits,
+                "hit_rate" : hits / lookups if lookups else 0.0,
+                "size" : len(self.entries),
+            }
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable
+from src.DBReader import AsyncMongoReader
+from src.Schemas import QueryInput
+from src.Constant import SCHEMA_CATALOG_REFRESH_INTERVAL, SCHEMA_CATALOG_REFRESH_JITTER, SCHEMA_CATALOG_MAX_AGE, SCHEMA_CATALOG_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaCatalog:
+    def __init__(
+        self,
+        reader_factory : Callable[[str, str], AsyncMongoReader],
+        databases : list[dict] | None = None,
+        refresh_interval : float = SCHEMA_CATALOG_REFRESH_INTERVAL,
+        refresh_jitter : float = SCHEMA_CATALOG_REFRESH_JITTER,
+        max_age : float = SCHEMA_CATALOG_MAX_AGE,
+        concurrency : int = SCHEMA_CATALOG_CONCURRENCY,
+    ) -> None:
+        self.reader_factory = reader_factory
+        self.databases = databases or []
+        self.refresh_interval = refresh_interval
+        self.refresh_jitter = refresh_jitter
+        self.max_age = max_age
+        self.concurrency = concurrency
+        self.entries : dict[tuple, dict] = {}
+        self.refreshing : set[tuple] = set()
+        self.lock = threading.Lock()
+        self.counters = {"hits" : 0, "stale_hits" : 0, "misses" : 0, "refreshes" : 0, "adopted" : 0, "refresh_errors" : 0}
+        self.loop : asyncio.AbstractEventLoop | None = None
+        self.task : asyncio.Task | None = None
+        self.semaphore : asyncio.Semaphore | None = None
+
+    def get_catalog_keys(self) -> list[tuple]:
+        # Entries are matched against the request fields, so missing ones take the same defaults as a request.
+        keys = []
+        for database in self.databases:
+            connection_url = database.get("connection_url", os.environ.get("connection_url"))
+            database_name = database.get("database_name", os.environ.get("database_name"))
+            example_count = database.get("max_output_count", QueryInput.model_fields["max_output_count"].default)
+            keys.extend((connection_url, database_name, collection_name, example_count) for collection_name in database["collection_list"])
+        return keys
+
+    def get_refresh_delay(self) -> float:
+        # Jitter keeps several workers from introspecting the same databases at the same moment.
+        return max(self.refresh_interval * (1 + random.uniform(-self.refresh_jitter, self.refresh_jitter)), 1.0)
+
+    def lookup(self, connection_url : str, database_name : str, collection_list : list[str], example_count : int) -> tuple[dict[str, dict], dict[str, list[list[str]]]] | None:
+        # A stale schema is served as is and refreshed in the background, so a request never waits on introspection here.
+        keys = [(connection_url, database_name, collection_name, example_count) for collection_name in collection_list]
+        with self.lock:
+            entries = [self.entries.get(key) for key in keys]
+            if(any(entry is None for entry in entries)):
+                self.counters["misses"] += 1
+                return None
+            stale_keys = [key for key, entry in zip(keys, entries) if time.time() - entry["refreshed_at"] > self.max_age]
+            self.counters["stale_hits" if len(stale_keys) > 0 else "hits"] += 1
+
+        for key in stale_keys:
+            self.schedule_refresh(key)
+        return {key[2] : entry["schema"] for key, entry in zip(keys, entries)}, {key[2] : entry["indexes"] for key, entry in zip(keys, entries)}
+
+    def schedule_refresh(self, key : tuple) -> None:
+        if(self.loop is None or self.loop.is_closed()):
+            return
+        with self.lock:
+            if(key in self.refreshing):
+                return
+            self.refreshing.add(key)
+        asyncio.run_coroutine_threadsafe(self.refresh_collection(key), self.loop)
+
+    def adopt_shared_entry(self, key : tuple, reader : AsyncMongoReader) -> bool:
+        # With a shared schema cache, a schema another worker refreshed recently is reused instead of introspected again.
+        if(reader.schema_cache is None):
+            return False
+        schema_entry = reader.schema_cache.get_recent_entry(reader.get_schema_cache_key(key[2], key[3]), self.refresh_interval / 2)
+        index_entry = reader.schema_cache.get_recent_entry(reader.get_index_cache_key(key[2]), self.refresh_interval / 2)
+        if(schema_entry is None or index_entry is None):
+            return False
+        with self.lock:
+            self.entries[key] = {"schema" : schema_entry["schema"], "indexes" : index_entry["schema"], "refreshed_at" : min(schema_entry["created_at"], index_entry["created_at"])}
+            self.counters["adopted"] += 1
+        return True
+
+    async def refresh_collection(self, key : tuple) -> None:
+        connection_url, database_name, collection_name, example_count = key
+        try:
+            async with self.semaphore:
+                reader = self.reader_factory(connection_url, database_name)
+                if(await asyncio.to_thread(self.adopt_shared_entry, key, reader)):
+                    return
+                schema, indexes = await asyncio.gather(
+                    reader.infer_collection_schema_json(collection_name, example_count),
+                    reader.get_collection_indexes(collection_name),
+                )
+            # The request-path cache is kept in step, so agents without the catalog see the same schema.
+            if(reader.schema_cache is not None):
+                await asyncio.to_thread(reader.schema_cache.set, reader.get_schema_cache_key(collection_name, example_count), schema)
+                await asyncio.to_thread(reader.schema_cache.set, reader.get_index_cache_key(collection_name), indexes)
+            with self.lock:
+                self.entries[key] = {"schema" : schema, "indexes" : indexes, "refreshed_at" : time.time()}
+                self.counters["refreshes"] += 1
+        except Exception as e:
+            with self.lock:
+                self.counters["refresh_errors"] += 1
+            logger.warning("schema catalog refresh failed for %s.%s: %s", database_name, collection_name, e)
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    async def refresh_all(self) -> None:
+        keys = []
+        with self.lock:
+            for key in self.get_catalog_keys():
+                if(key not in self.refreshing):
+                    self.refreshing.add(key)
+                    keys.append(key)
+        await asyncio.gather(*[self.refresh_collection(key) for key in keys])
+
+    async def run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await self.refresh_all()
+            logger.info("schema catalog refreshed %d collections in %.2f seconds", len(self.get_catalog_keys()), time.perf_counter() - start)
+            await asyncio.sleep(self.get_refresh_delay())
+
+    async def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        if(len(self.databases) > 0):
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if(self.task is not None):
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        self.loop = None
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            ages = [time.time() - entry["refreshed_at"] for entry in self.entries.values()]
+            return {
+                **self.counters,
+                "collections" : len(self.get_catalog_keys()),
+                "warm" : len(self.entries),
+                "refreshing" : len(self.refreshing),
+                "oldest_age" : round(max(ages), 1) if len(ages) > 0 else None,
+            }
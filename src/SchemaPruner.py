@@ -0,0 +1,84 @@
+import math
+from collections import Counter
+from src.TextIndex import TfidfIndex, tokenize
+from src.Constant import SCHEMA_PRUNING_MAX_COLLECTIONS, SCHEMA_PRUNING_MAX_FIELDS, SCHEMA_PRUNING_MIN_SCORE, SCHEMA_PRUNING_RELATIVE_SCORE, SCHEMA_PRUNING_EXAMPLE_COUNT
+
+
+class SchemaPruner:
+    def __init__(
+        self,
+        max_collections : int = SCHEMA_PRUNING_MAX_COLLECTIONS,
+        max_fields : int = SCHEMA_PRUNING_MAX_FIELDS,
+        min_score : float = SCHEMA_PRUNING_MIN_SCORE,
+        relative_score : float = SCHEMA_PRUNING_RELATIVE_SCORE,
+        example_count : int = SCHEMA_PRUNING_EXAMPLE_COUNT,
+    ) -> None:
+        self.max_collections = max_collections
+        self.max_fields = max_fields
+        self.min_score = min_score
+        self.relative_score = relative_score
+        self.example_count = example_count
+
+    @staticmethod
+    def get_trigrams(token : str) -> Counter:
+        padded = f"#{token}#"
+        return Counter(padded[index : index + 3] for index in range(len(padded) - 2))
+
+    @staticmethod
+    def cosine(left : Counter, right : Counter) -> float:
+        dot = sum(count * right.get(gram, 0) for gram, count in left.items())
+        if(dot == 0):
+            return 0.0
+        return dot / (math.sqrt(sum(count * count for count in left.values())) * math.sqrt(sum(count * count for count in right.values())))
+
+    def get_name_similarity(self, query_trigrams : list[Counter], name : str) -> float:
+        # Character trigrams match inflections and spellings ("countries" and "country") that exact tokens miss.
+        name_trigrams = [self.get_trigrams(token) for token in tokenize(name)]
+        if(len(query_trigrams) == 0 or len(name_trigrams) == 0):
+            return 0.0
+        return max(self.cosine(query_gram, name_gram) for query_gram in query_trigrams for name_gram in name_trigrams)
+
+    def get_field_text(self, collection_name : str, key : str, data : dict) -> str:
+        return " ".join([collection_name, key, *[str(value) for value in data.get("Example_values", [])[: self.example_count]]])
+
+    def score_schema(self, query : str, collection_schema : dict[str, dict]) -> tuple[dict[str, float], dict[str, dict[str, float]]]:
+        index = TfidfIndex()
+        for collection_name, schema in collection_schema.items():
+            for key, data in schema.items():
+                index.add(f"{collection_name}\x00{key}", self.get_field_text(collection_name, key, data))
+        lexical_scores = dict(index.search(query, max(len(index), 1)))
+
+        query_trigrams = [self.get_trigrams(token) for token in set(tokenize(query))]
+        collection_scores : dict[str, float] = {}
+        field_scores : dict[str, dict[str, float]] = {}
+        for collection_name, schema in collection_schema.items():
+            field_scores[collection_name] = {
+                key : max(lexical_scores.get(f"{collection_name}\x00{key}", 0.0), self.get_name_similarity(query_trigrams, key))
+                for key in schema.keys()
+            }
+            collection_scores[collection_name] = max([self.get_name_similarity(query_trigrams, collection_name), *field_scores[collection_name].values()])
+
+        return collection_scores, field_scores
+
+    def prune(self, query : str, collection_schema : dict[str, dict]) -> dict[str, dict] | None:
+        collection_scores, field_scores = self.score_schema(query, collection_schema)
+        if(len(collection_scores) == 0):
+            return None
+
+        best_score = max(collection_scores.values())
+        threshold = max(self.min_score, best_score * self.relative_score)
+        ranked = sorted((name for name, score in collection_scores.items() if score >= threshold), key=lambda name : collection_scores[name], reverse=True)
+        selected = set(ranked[: self.max_collections])
+        if(len(selected) == 0):
+            return None
+
+        pruned : dict[str, dict] = {}
+        for collection_name, schema in collection_schema.items():
+            if(collection_name not in selected):
+                continue
+            keys = set(sorted(schema.keys(), key=lambda key : field_scores[collection_name][key], reverse=True)[: self.max_fields])
+            pruned[collection_name] = {key : data for key, data in schema.items() if key in keys}
+
+        if(sum(len(schema) for schema in pruned.values()) == sum(len(schema) for schema in collection_schema.values())):
+            return None
+        return pruned
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from src.Constant import MISTRAL_CODE_MODEL, MISTRAL_LLM_TEMPERATURE, MONGODB, OPENAI_GPT4_MODEL, description_msg
+from src.Constant import MISTRAL_CODE_MODEL, MISTRAL_LLM_TEMPERATURE, MONGODB, OPENAI_GPT4_MODEL, JOB_PRIORITY_NORMAL, description_msg
 import os
 
 
@@ -14,6 +14,13 @@ class QueryInput(BaseModel):
     database_type : str = MONGODB
     llm_name : str = OPENAI_GPT4_MODEL
     temperature : float = MISTRAL_LLM_TEMPERATURE
+    use_answer_cache : bool = True
+    use_llm_cache : bool = True
+    speculative_candidates : int | None = None
+    max_iterations : int | None = None
+    max_seconds : float | None = None
+    max_tokens : int | None = None
+    max_mongo_ms : int | None = None
 
 class PipelineCode(BaseModel):
     mongodb_pipeline: list[dict] | None | str = None
@@ -34,12 +41,40 @@ class GraphState(BaseModel):
     messages: list
     generation: PipelineCode | None
     iterations: int
+    analysis: "AnalyzeConditions | None" = None
+    analysis_source: str | None = None
+    collection_schema: dict | None = None
+    collection_indexes: dict | None = None
+    result_count: int | None = None
+    reached_max_count: bool = False
+    attempts: list[dict] = []
+    tokens_saved: int = 0
+    budget_exhausted: str | None = None
 
 class TaskResponse(BaseModel):
     output: str | None = None
     error: str | None = None
     error_data: str | dict | None = None
 
+class BatchQueryInput(QueryInput):
+    queries : list[str]
+    max_concurrency : int | None = None
+
+class JobInput(QueryInput):
+    priority : str = JOB_PRIORITY_NORMAL
+    webhook_url : str | None = None
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+    priority: str
+    created_at: float
+    started_at: float | None = None
+    finished_at: float | None = None
+    output: str | None = None
+    error: str | None = None
+    error_data: str | dict | None = None
+
 class AnalyzeConditions(BaseModel):
     intermediate_query : bool
     reason_for_intermediate_query : str
@@ -48,4 +83,7 @@ class AnalyzeConditions(BaseModel):
     contains_raw_output : bool
     reason_for_contains_raw_output : str
     incorrect_query : bool
-    reason_for_incorrect_query : str
\ No newline at end of file
+    reason_for_incorrect_query : str
+
+
+GraphState.model_rebuild()
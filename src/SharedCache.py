@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+from bson import json_util
+
+
+class SQLiteCacheTier:
+    def __init__(self, path : str, table : str, max_size : int, ttl : float) -> None:
+        self.path = path
+        self.table = table
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection : sqlite3.Connection | None = None
+        self.pid : int | None = None
+        self.counters = {"hits" : 0, "misses" : 0, "expired" : 0, "evicted" : 0}
+
+    def connect(self) -> sqlite3.Connection:
+        # A connection opened before a fork cannot be used by the child, so every process opens its own.
+        if(self.connection is None or self.pid != os.getpid()):
+            self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5.0)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)")
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_created_at ON {self.table} (created_at)")
+            self.pid = os.getpid()
+        return self.connection
+
+    def get(self, key : str) -> Any | None:
+        with self.lock:
+            connection = self.connect()
+            row = connection.execute(f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if(row is None):
+                self.counters["misses"] += 1
+                return None
+
+            value, created_at = row
+            if(time.time() - created_at > self.ttl):
+                connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self.counters["expired"] += 1
+                self.counters["misses"] += 1
+                return None
+
+            self.counters["hits"] += 1
+            return json_util.loads(value)
+
+    def set(self, key : str, value : Any) -> None:
+        # Values go through extended JSON, so dates and ObjectIds in pipelines keep their types.
+        with self.lock:
+            connection = self.connect()
+            connection.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, created_at) VALUES (?, ?, ?)", (key, json_util.dumps(value), time.time()))
+            evicted = connection.execute(
+                f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_size,),
+            ).rowcount
+            self.counters["evicted"] += max(evicted, 0)
+
+    def invalidate(self, key : str) -> None:
+        with self.lock:
+            self.connect().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self.lock:
+            self.connect().execute(f"DELETE FROM {self.table}")
+
+    def get_stats(self) -> dict:
+        # Counters are kept per process; the size is the shared one.
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate" : self.counters["hits"] / lookups if lookups else 0.0,
+                "size" : self.connect().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0],
+            }
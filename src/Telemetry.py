@@ -0,0 +1,213 @@
+import bisect
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from src.Constant import TELEMETRY_SERVICE_NAME, TELEMETRY_LATENCY_BUCKETS, TELEMETRY_DOCUMENT_BUCKETS, TELEMETRY_RATIO_BUCKETS, LLM_TOKEN_PRICES
+
+try:
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+except ImportError:
+    trace = None
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, sample_rate : float) -> None:
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record : logging.LogRecord) -> bool:
+        # Warnings and errors are always kept; only the chatty levels are sampled.
+        if(record.levelno >= logging.WARNING):
+            return True
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+
+def configure_logging(level : str, sample_rate : float) -> None:
+    logging.basicConfig(level=level.upper(), format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(SamplingFilter(sample_rate))
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.help : dict[str, tuple[str, str]] = {}
+        self.counters : dict[str, dict[tuple, float]] = {}
+        self.histograms : dict[str, dict[tuple, list]] = {}
+        self.buckets : dict[str, list[float]] = {}
+
+    def register_counter(self, name : str, description : str) -> None:
+        self.help[name] = ("counter", description)
+        self.counters[name] = {}
+
+    def register_histogram(self, name : str, description : str, buckets : list[float]) -> None:
+        self.help[name] = ("histogram", description)
+        self.histograms[name] = {}
+        self.buckets[name] = sorted(buckets)
+
+    def increment(self, name : str, value : float = 1.0, **labels : str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.counters[name][key] = self.counters[name].get(key, 0.0) + value
+
+    def observe(self, name : str, value : float, **labels : str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.histograms[name].get(key)
+            if(series is None):
+                series = [[0] * len(self.buckets[name]), 0.0, 0]
+                self.histograms[name][key] = series
+            index = bisect.bisect_left(self.buckets[name], value)
+            if(index < len(self.buckets[name])):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @staticmethod
+    def format_labels(labels : tuple, extra : tuple = ()) -> str:
+        pairs = [*labels, *extra]
+        if(len(pairs) == 0):
+            return ""
+        escaped = []
+        for key, value in pairs:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            escaped.append(f'{key}="{value}"')
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name, (metric_type, description) in self.help.items():
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                if(metric_type == "counter"):
+                    for labels, value in self.counters[name].items():
+                        lines.append(f"{name}{self.format_labels(labels)} {value}")
+                    continue
+
+                for labels, (bucket_counts, total, count) in self.histograms[name].items():
+                    cumulative = 0
+                    for bound, bucket_count in zip(self.buckets[name], bucket_counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{self.format_labels(labels, (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_bucket{self.format_labels(labels, (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{self.format_labels(labels)} {total}")
+                    lines.append(f"{name}_count{self.format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class Telemetry:
+    def __init__(self, service_name : str = TELEMETRY_SERVICE_NAME, otlp_endpoint : str | None = None, token_prices : dict[str, tuple[float, float]] | None = None) -> None:
+        self.token_prices = token_prices if token_prices is not None else LLM_TOKEN_PRICES
+        self.metrics = MetricsRegistry()
+        self.metrics.register_histogram("querygen_stage_duration_seconds", "Duration of each agent stage.", TELEMETRY_LATENCY_BUCKETS)
+        self.metrics.register_counter("querygen_stage_errors_total", "Agent stages that raised an exception.")
+        self.metrics.register_counter("querygen_llm_calls_total", "LLM calls by model and operation.")
+        self.metrics.register_histogram("querygen_llm_latency_seconds", "LLM call latency by model and operation.", TELEMETRY_LATENCY_BUCKETS)
+        self.metrics.register_counter("querygen_llm_tokens_total", "LLM tokens by model and direction.")
+        self.metrics.register_counter("querygen_llm_cost_usd_total", "Estimated LLM cost in US dollars.")
+        self.metrics.register_histogram("querygen_request_cached_token_ratio", "Share of each request's prompt tokens served from the provider prompt cache.", TELEMETRY_RATIO_BUCKETS)
+        self.metrics.register_histogram("querygen_mongo_documents_returned", "Documents returned by executed pipelines.", TELEMETRY_DOCUMENT_BUCKETS)
+        self.metrics.register_counter("querygen_requests_total", "Requests by endpoint and outcome.")
+        self.metrics.register_counter("querygen_speculative_rounds_total", "Speculative generation rounds by winning candidate.")
+        self.metrics.register_counter("querygen_budget_exhausted_total", "Requests stopped by an exhausted budget, by limit.")
+        self.metrics.register_counter("querygen_llm_router_events_total", "LLM router retries, failovers and hedged requests by model.")
+        self.metrics.register_counter("querygen_llm_cache_events_total", "LLM response cache hits, misses and coalesced calls.")
+
+        self.tracer = None
+        self.tracer_provider = None
+        if(otlp_endpoint is not None):
+            if(trace is None):
+                logger.warning("OTLP endpoint is configured but opentelemetry is not installed; traces are disabled")
+            else:
+                self.tracer_provider = TracerProvider(resource=Resource.create({"service.name" : service_name}))
+                self.tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=otlp_endpoint)))
+                self.tracer = self.tracer_provider.get_tracer(service_name)
+
+    @contextmanager
+    def span(self, stage : str, attach : bool = True, **attributes : object) -> Iterator[dict]:
+        # The yielded dict collects attributes known only once the stage finished, such as token or document counts.
+        otel_span = None
+        if(self.tracer is not None):
+            if(attach):
+                span_context = self.tracer.start_as_current_span(f"querygen.{stage}")
+                otel_span = span_context.__enter__()
+            else:
+                span_context = None
+                otel_span = self.tracer.start_span(f"querygen.{stage}")
+
+        start_time = time.perf_counter()
+        failed = False
+        try:
+            yield attributes
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            duration = time.perf_counter() - start_time
+            self.metrics.observe("querygen_stage_duration_seconds", duration, stage=stage)
+            if(failed):
+                self.metrics.increment("querygen_stage_errors_total", stage=stage)
+
+            if(otel_span is not None):
+                for key, value in attributes.items():
+                    if(isinstance(value, (str, bool, int, float))):
+                        otel_span.set_attribute(f"querygen.{key}", value)
+                if(failed):
+                    otel_span.set_status(trace.Status(trace.StatusCode.ERROR))
+                if(span_context is not None):
+                    span_context.__exit__(None, None, None)
+                else:
+                    otel_span.end()
+
+    def record_llm_call(self, model : str, operation : str, latency : float, prompt_tokens : int | None, completion_tokens : int | None, cached_tokens : int | None = None) -> None:
+        self.metrics.increment("querygen_llm_calls_total", model=model, operation=operation)
+        self.metrics.observe("querygen_llm_latency_seconds", latency, model=model, operation=operation)
+        if(prompt_tokens is None or completion_tokens is None):
+            return
+
+        self.metrics.increment("querygen_llm_tokens_total", prompt_tokens, model=model, type="prompt")
+        self.metrics.increment("querygen_llm_tokens_total", completion_tokens, model=model, type="completion")
+        if(cached_tokens is not None):
+            self.metrics.increment("querygen_llm_tokens_total", cached_tokens, model=model, type="cached_prompt")
+        if(model in self.token_prices):
+            prompt_price, completion_price = self.token_prices[model]
+            self.metrics.increment("querygen_llm_cost_usd_total", (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000000, model=model)
+
+    def record_request_usage(self, usage : dict) -> None:
+        if(usage["prompt_tokens"] > 0):
+            self.metrics.observe("querygen_request_cached_token_ratio", usage["cached_token_ratio"])
+
+    def record_documents(self, document_count : int) -> None:
+        self.metrics.observe("querygen_mongo_documents_returned", document_count)
+
+    def record_request(self, endpoint : str, status : str) -> None:
+        self.metrics.increment("querygen_requests_total", endpoint=endpoint, status=status)
+
+    def record_speculative_round(self, winner : int | None) -> None:
+        self.metrics.increment("querygen_speculative_rounds_total", winner=str(winner) if winner is not None else "none")
+
+    def record_budget_exhausted(self, limit : str) -> None:
+        self.metrics.increment("querygen_budget_exhausted_total", limit=limit)
+
+    def record_llm_router_event(self, event : str, model : str) -> None:
+        self.metrics.increment("querygen_llm_router_events_total", event=event, model=model)
+
+    def record_llm_cache_event(self, event : str) -> None:
+        self.metrics.increment("querygen_llm_cache_events_total", event=event)
+
+    def render_prometheus(self) -> str:
+        return self.metrics.render()
+
+    def shutdown(self) -> None:
+        if(self.tracer_provider is not None):
+            self.tracer_provider.shutdown()
@@ -0,0 +1,81 @@
+import math
+import re
+from collections import Counter
+from src.Constant import TEXT_INDEX_REFRESH_CHANGES
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "give", "how", "i", "in", "is", "it", "me", "many",
+    "of", "on", "or", "show", "tell", "that", "the", "their", "there", "this", "to", "was", "were", "what", "which", "who", "with",
+}
+
+
+def tokenize(text : str) -> list[str]:
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text)
+    return [token for token in re.findall(r"[a-z0-9]+", text.lower()) if token not in STOP_WORDS]
+
+
+class TfidfIndex:
+    def __init__(self, refresh_changes : int = TEXT_INDEX_REFRESH_CHANGES) -> None:
+        self.documents : dict[str, Counter] = {}
+        self.document_frequency : Counter = Counter()
+        self.vectors : dict[str, dict[str, float]] | None = None
+        self.refresh_changes = refresh_changes
+        self.changes = 0
+
+    def record_change(self) -> None:
+        # Other vectors keep their slightly stale IDF weights until enough documents changed to rebuild them all.
+        self.changes += 1
+        if(self.changes >= self.refresh_changes):
+            self.vectors = None
+
+    def add(self, document_id : str, text : str) -> None:
+        self.remove(document_id)
+        terms = Counter(tokenize(text))
+        self.documents[document_id] = terms
+        self.document_frequency.update(terms.keys())
+        if(self.vectors is not None):
+            self.vectors[document_id] = self.vectorize(terms)
+            self.record_change()
+
+    def remove(self, document_id : str) -> None:
+        terms = self.documents.pop(document_id, None)
+        if(terms is None):
+            return
+        self.document_frequency.subtract(terms.keys())
+        self.document_frequency += Counter()
+        if(self.vectors is not None):
+            self.vectors.pop(document_id, None)
+            self.record_change()
+
+    def get_idf(self, term : str) -> float:
+        return math.log((1 + len(self.documents)) / (1 + self.document_frequency.get(term, 0))) + 1
+
+    def vectorize(self, terms : Counter) -> dict[str, float]:
+        vector = {term : (1 + math.log(count)) * self.get_idf(term) for term, count in terms.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        if(norm == 0):
+            return {}
+        return {term : weight / norm for term, weight in vector.items()}
+
+    def search(self, text : str, top_k : int, document_ids : set[str] | None = None) -> list[tuple[str, float]]:
+        if(self.vectors is None):
+            self.vectors = {document_id : self.vectorize(terms) for document_id, terms in self.documents.items()}
+            self.changes = 0
+
+        query_vector = self.vectorize(Counter(tokenize(text)))
+        if(len(query_vector) == 0):
+            return []
+
+        scores = []
+        for document_id, vector in self.vectors.items():
+            if(document_ids is not None and document_id not in document_ids):
+                continue
+            score = sum(weight * vector.get(term, 0.0) for term, weight in query_vector.items())
+            if(score > 0):
+                scores.append((document_id, score))
+
+        scores.sort(key=lambda item : item[1], reverse=True)
+        return scores[:top_k]
+
+    def __len__(self) -> int:
+        return len(self.documents)
@@ -1,10 +1,19 @@
 from mistralai.client import MistralClient
+from mistralai.async_client import MistralAsyncClient
 from mistralai.models.chat_completion import ChatMessage
 from src.Schemas import PipelineCode
 from mistralai.models.chat_completion import ChatCompletionResponse
+import hashlib
 import json
-from openai import OpenAI
+import logging
+import time
+from typing import AsyncIterator, Callable
+from openai import OpenAI, AsyncOpenAI
 from openai.types.chat.chat_completion import ChatCompletion
+from src.Telemetry import Telemetry
+from src.Constant import OPENAI_PROMPT_CACHE_KEY
+
+logger = logging.getLogger(__name__)
 
 class BaseLLM:
     def __init__(self) -> None:
@@ -16,72 +25,185 @@ class BaseLLM:
     def get_chat_content(self) -> dict:
         pass
 
+    def get_chat_role(self) -> str:
+        pass
+
     def invoke(self) -> None:
         pass
 
+    async def invoke_async(self) -> None:
+        pass
+
+    async def stream_async(self) -> AsyncIterator[str]:
+        return
+        yield
+
+    def convert_messages(self, messages : list, source_llm : "BaseLLM") -> list:
+        if(source_llm is self):
+            return messages
+        return [self.get_chat_message(role=source_llm.get_chat_role(message), content=source_llm.get_chat_content(message)) for message in messages]
+
+    def get_operation(self, tools : list | None, return_tool : bool) -> str:
+        if(return_tool == True and tools):
+            return tools[0]["function"]["name"]
+        return "completion"
+
+    def record_usage(self, attributes : dict, model : str, operation : str, start_time : float, usage : object, usage_callback : Callable[[int | None, int | None, int | None], None] | None = None) -> None:
+        latency = time.perf_counter() - start_time
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        cached_tokens = self.get_cached_tokens(usage)
+        attributes.update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cached_tokens=cached_tokens)
+        self.telemetry.record_llm_call(model, operation, latency, prompt_tokens, completion_tokens, cached_tokens)
+        if(usage_callback is not None):
+            usage_callback(prompt_tokens, completion_tokens, cached_tokens)
+        logger.info("llm call model=%s operation=%s latency_ms=%.1f prompt_tokens=%s completion_tokens=%s cached_tokens=%s", model, operation, latency * 1000, prompt_tokens, completion_tokens, cached_tokens)
+
+    def get_cached_tokens(self, usage : object) -> int | None:
+        # Providers that report prompt caching put the reused prefix length under prompt_tokens_details.
+        details = getattr(usage, "prompt_tokens_details", None)
+        return getattr(details, "cached_tokens", None)
+
+    def log_response(self, content : object) -> None:
+        logger.debug("llm response: %s", content)
+
 class MistralLLM(BaseLLM):
-    def __init__(self, mistral_client : MistralClient) -> None:
+    def __init__(self, mistral_client : MistralClient, mistral_async_client : MistralAsyncClient | None = None, telemetry : Telemetry | None = None) -> None:
         self.mistral_client = mistral_client
+        self.mistral_async_client = mistral_async_client
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
 
     def get_chat_message(self, content : str, role : str) -> ChatMessage:
         return ChatMessage(role=role, content=content)
-    
+
     def get_chat_content(self, message : ChatMessage) -> dict:
         return message.content
-    
-    def invoke(self, model : str, messages : list[ChatMessage], temperature : float, tools : dict = None, return_tool : bool = True) -> ChatCompletionResponse | dict:
-        print("--------------")
-        print(self.get_chat_content(messages[-1]))
-        print("--------------")
-        
-        response = self.mistral_client.chat(model=model, messages=messages, tools=tools, tool_choice="any", temperature = temperature)
+
+    def get_chat_role(self, message : ChatMessage) -> str:
+        return message.role
+
+    def parse_response(self, response : ChatCompletionResponse, return_tool : bool) -> str | dict:
         if(return_tool == True):
             tool_call = response.choices[0].message.tool_calls
 
             function_call_argument = json.loads(tool_call[0].function.arguments)
 
-            print("==============")
-            print(function_call_argument)
-            print("==============")
+            self.log_response(function_call_argument)
 
             return function_call_argument
         else:
-            print("==============")
-            print(response.choices[0].message.content)
-            print("==============")
+            self.log_response(response.choices[0].message.content)
             return response.choices[0].message.content
 
+    def invoke(self, model : str, messages : list[ChatMessage], temperature : float, tools : dict = None, return_tool : bool = True, usage_callback : Callable[[int | None, int | None, int | None], None] | None = None) -> ChatCompletionResponse | dict:
+        logger.debug("llm request: %s", self.get_chat_content(messages[-1]))
+
+        operation = self.get_operation(tools, return_tool)
+        with self.telemetry.span("llm", model=model, operation=operation) as attributes:
+            start_time = time.perf_counter()
+            response = self.mistral_client.chat(model=model, messages=messages, tools=tools, tool_choice="any", temperature = temperature)
+            self.record_usage(attributes, model, operation, start_time, response.usage, usage_callback)
+        return self.parse_response(response, return_tool)
+
+    async def invoke_async(self, model : str, messages : list[ChatMessage], temperature : float, tools : dict = None, return_tool : bool = True, usage_callback : Callable[[int | None, int | None, int | None], None] | None = None) -> ChatCompletionResponse | dict:
+        if(self.mistral_async_client is None):
+            raise Exception("Not Implemented", "Async Mistral client is not configured")
+
+        logger.debug("llm request: %s", self.get_chat_content(messages[-1]))
+
+        operation = self.get_operation(tools, return_tool)
+        with self.telemetry.span("llm", model=model, operation=operation) as attributes:
+            start_time = time.perf_counter()
+            response = await self.mistral_async_client.chat(model=model, messages=messages, tools=tools, tool_choice="any", temperature = temperature)
+            self.record_usage(attributes, model, operation, start_time, response.usage, usage_callback)
+        return self.parse_response(response, return_tool)
+
+    async def stream_async(self, model : str, messages : list[ChatMessage], temperature : float, usage_callback : Callable[[int | None, int | None, int | None], None] | None = None) -> AsyncIterator[str]:
+        if(self.mistral_async_client is None):
+            raise Exception("Not Implemented", "Async Mistral client is not configured")
+
+        with self.telemetry.span("llm", attach=False, model=model, operation="stream") as attributes:
+            start_time = time.perf_counter()
+            usage = None
+            async for chunk in self.mistral_async_client.chat_stream(model=model, messages=messages, temperature = temperature):
+                usage = chunk.usage or usage
+                if(len(chunk.choices) > 0 and chunk.choices[0].delta.content):
+                    yield chunk.choices[0].delta.content
+            self.record_usage(attributes, model, "stream", start_time, usage, usage_callback)
+
 
 class OpenAILLM(BaseLLM):
-    def __init__(self, openai_client : OpenAI) -> None:
+    def __init__(self, openai_client : OpenAI, openai_async_client : AsyncOpenAI | None = None, telemetry : Telemetry | None = None, prompt_cache_key : bool = OPENAI_PROMPT_CACHE_KEY) -> None:
         self.openai_client = openai_client
+        self.openai_async_client = openai_async_client
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.prompt_cache_key = prompt_cache_key
 
     def get_chat_message(self, content : str, role : str) -> dict:
         return {"role": role, "content": content}
-    
+
     def get_chat_content(self, message : dict) -> dict:
         return message["content"]
-    
-    def invoke(self, model : str, messages : list[dict], temperature : float, tools : dict = None, return_tool : bool = True) ->  ChatCompletion | dict:
+
+    def get_chat_role(self, message : dict) -> str:
+        return message["role"]
+
+    def get_prompt_cache_arguments(self, messages : list[dict]) -> dict:
+        # Requests sharing a system prompt are routed to the same cache shard, which raises the prefix hit rate.
+        if(self.prompt_cache_key == False or len(messages) == 0 or self.get_chat_role(messages[0]) != "system"):
+            return {}
+        return {"prompt_cache_key" : hashlib.sha256(self.get_chat_content(messages[0]).encode()).hexdigest()[:32]}
+
+    def get_request_arguments(self, model : str, messages : list[dict], temperature : float, tools : dict, return_tool : bool) -> dict:
         if(return_tool == True):
-            print("--------------")
-            print(self.get_chat_content(messages[-1]))
-            print("--------------")
-            response = self.openai_client.chat.completions.create(model=model, messages=messages, tools=tools, tool_choice="required",  temperature = temperature)
+            return {"model" : model, "messages" : messages, "tools" : tools, "tool_choice" : "required", "temperature" : temperature, **self.get_prompt_cache_arguments(messages)}
+        else:
+            return {"model" : model, "messages" : messages, "temperature" : temperature, **self.get_prompt_cache_arguments(messages)}
 
+    def parse_response(self, response : ChatCompletion, return_tool : bool) -> str | dict:
+        if(return_tool == True):
             tool_call = response.choices[0].message.tool_calls
             function_call_argument = json.loads(tool_call[0].function.arguments)
 
-            print("==============")
-            print(function_call_argument)
-            print("==============")
+            self.log_response(function_call_argument)
             return function_call_argument
         else:
-            print("--------------")
-            print(self.get_chat_content(messages[-1]))
-            print("--------------")
-            response = self.openai_client.chat.completions.create(model=model, messages=messages, temperature = temperature)
-            print("==============")
-            print(response.choices[0].message.content)
-            print("==============")
-            return response.choices[0].message.content
\ No newline at end of file
+            self.log_response(response.choices[0].message.content)
+            return response.choices[0].message.content
+
+    def invoke(self, model : str, messages : list[dict], temperature : float, tools : dict = None, return_tool : bool = True, usage_callback : Callable[[int | None, int | None, int | None], None] | None = None) ->  ChatCompletion | dict:
+        logger.debug("llm request: %s", self.get_chat_content(messages[-1]))
+
+        operation = self.get_operation(tools, return_tool)
+        with self.telemetry.span("llm", model=model, operation=operation) as attributes:
+            start_time = time.perf_counter()
+            response = self.openai_client.chat.completions.create(**self.get_request_arguments(model, messages, temperature, tools, return_tool))
+            self.record_usage(attributes, model, operation, start_time, response.usage, usage_callback)
+        return self.parse_response(response, return_tool)
+
+    async def invoke_async(self, model : str, messages : list[dict], temperature : float, tools : dict = None, return_tool : bool = True, usage_callback : Callable[[int | None, int | None, int | None], None] | None = None) ->  ChatCompletion | dict:
+        if(self.openai_async_client is None):
+            raise Exception("Not Implemented", "Async OpenAI client is not configured")
+
+        logger.debug("llm request: %s", self.get_chat_content(messages[-1]))
+
+        operation = self.get_operation(tools, return_tool)
+        with self.telemetry.span("llm", model=model, operation=operation) as attributes:
+            start_time = time.perf_counter()
+            response = await self.openai_async_client.chat.completions.create(**self.get_request_arguments(model, messages, temperature, tools, return_tool))
+            self.record_usage(attributes, model, operation, start_time, response.usage, usage_callback)
+        return self.parse_response(response, return_tool)
+
+    async def stream_async(self, model : str, messages : list[dict], temperature : float, usage_callback : Callable[[int | None, int | None, int | None], None] | None = None) -> AsyncIterator[str]:
+        if(self.openai_async_client is None):
+            raise Exception("Not Implemented", "Async OpenAI client is not configured")
+
+        with self.telemetry.span("llm", attach=False, model=model, operation="stream") as attributes:
+            start_time = time.perf_counter()
+            usage = None
+            stream = await self.openai_async_client.chat.completions.create(model=model, messages=messages, temperature = temperature, stream=True, stream_options={"include_usage" : True}, **self.get_prompt_cache_arguments(messages))
+            async for chunk in stream:
+                usage = chunk.usage or usage
+                if(len(chunk.choices) > 0 and chunk.choices[0].delta.content):
+                    yield chunk.choices[0].delta.content
+            self.record_usage(attributes, model, "stream", start_time, usage, usage_callback)
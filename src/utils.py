@@ -1,7 +1,49 @@
+import asyncio
+import json
+import math
 import os
+from typing import AsyncIterator
 from fastapi.security import HTTPAuthorizationCredentials
+from src.Constant import STREAM_FORMAT_SSE, STREAM_EVENT_HEARTBEAT
 
 
 def check_token(api_key: HTTPAuthorizationCredentials) -> None:
     if api_key.credentials != os.environ["API_KEY"]:
         raise Exception("Invalid API key")
+
+
+def get_inclusion_confidence(coverage : float, threshold : float, sample_count : int) -> float:
+    # Normal approximation of the probability that the true key frequency is above the threshold.
+    variance = max(coverage * (1 - coverage), 1 / sample_count) / sample_count
+    z_score = (coverage - threshold) / math.sqrt(variance)
+    return 0.5 * (1 + math.erf(z_score / math.sqrt(2)))
+
+
+def format_stream_event(event : dict, stream_format : str) -> str:
+    payload = json.dumps(event["data"], default=str)
+    if(stream_format == STREAM_FORMAT_SSE):
+        return f"event: {event['event']}\ndata: {payload}\n\n"
+    return json.dumps({"event" : event["event"], "data" : event["data"]}, default=str) + "\n"
+
+
+async def with_heartbeat(events : AsyncIterator[dict], interval : float) -> AsyncIterator[dict]:
+    # Emits a heartbeat whenever the agent is silent for longer than interval, so idle proxies keep the stream open.
+    events = aiter(events)
+    next_event = asyncio.ensure_future(anext(events))
+    try:
+        while True:
+            done, _ = await asyncio.wait([next_event], timeout=interval)
+            if(len(done) == 0):
+                yield {"event" : STREAM_EVENT_HEARTBEAT, "data" : {}}
+                continue
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            yield event
+            next_event = asyncio.ensure_future(anext(events))
+    finally:
+        # The agent is closed once its pending step has stopped, so its own cleanup runs before the stream ends.
+        next_event.cancel()
+        await asyncio.gather(next_event, return_exceptions=True)
+        await events.aclose()
@@ -0,0 +1,7 @@
+import os
+
+# QueryInput reads its defaults from the environment when src.Schemas is imported.
+os.environ.setdefault("connection_url", "mongodb://localhost:27017")
+os.environ.setdefault("collection_list", '["orders"]')
+os.environ.setdefault("database_name", "test")
+os.environ.setdefault("query", "How many orders are there?")
@@ -0,0 +1,92 @@
+from datetime import datetime, timezone
+import pytest
+from src.DateCoercer import DateCoercer
+
+SCHEMA = {
+    "orders" : {
+        "created_at" : {"data_type" : ["date"]},
+        "code" : {"data_type" : ["string"]},
+        "status" : {"data_type" : ["string"]},
+        "amount" : {"data_type" : ["double"]},
+    },
+}
+
+JANUARY_FIRST = datetime(2024, 1, 1)
+
+# Each case is a pipeline on the orders collection and the pipeline expected after coercion.
+CASES = [
+    pytest.param(
+        [{"$match" : {"created_at" : {"$gte" : "2024-01-01"}}}],
+        [{"$match" : {"created_at" : {"$gte" : JANUARY_FIRST}}}],
+        id="typed-date-field",
+    ),
+    pytest.param(
+        [{"$match" : {"created_at" : "2024-01-01T10:30:00Z"}}],
+        [{"$match" : {"created_at" : datetime(2024, 1, 1, 10, 30, tzinfo=timezone.utc)}}],
+        id="typed-date-field-datetime",
+    ),
+    pytest.param(
+        [{"$match" : {"shipped_at" : {"$lt" : "2024-1-1"}}}],
+        [{"$match" : {"shipped_at" : {"$lt" : JANUARY_FIRST}}}],
+        id="untyped-field",
+    ),
+    pytest.param(
+        [{"$match" : {"code" : "2024-01-01"}}],
+        [{"$match" : {"code" : "2024-01-01"}}],
+        id="string-field-with-date-like-value",
+    ),
+    pytest.param(
+        [{"$match" : {"status" : "shipped", "amount" : {"$gt" : 10}}}],
+        [{"$match" : {"status" : "shipped", "amount" : {"$gt" : 10}}}],
+        id="non-date-values",
+    ),
+    pytest.param(
+        [{"$match" : {"$and" : [{"created_at" : {"$gte" : "2024-01-01"}}, {"code" : {"$ne" : "2024-01-01"}}]}}],
+        [{"$match" : {"$and" : [{"created_at" : {"$gte" : JANUARY_FIRST}}, {"code" : {"$ne" : "2024-01-01"}}]}}],
+        id="nested-and",
+    ),
+    pytest.param(
+        [{"$match" : {"$expr" : {"$and" : [{"$gte" : ["$created_at", "2024-01-01"]}, {"$eq" : ["$code", "2024-01-01"]}]}}}],
+        [{"$match" : {"$expr" : {"$and" : [{"$gte" : ["$created_at", JANUARY_FIRST]}, {"$eq" : ["$code", "2024-01-01"]}]}}}],
+        id="nested-expr",
+    ),
+    pytest.param(
+        [{"$match" : {"created_at" : {"$in" : ["2024-01-01", "2024-01-02"]}, "code" : {"$in" : ["2024-01-01", "A1"]}}}],
+        [{"$match" : {"created_at" : {"$in" : [JANUARY_FIRST, datetime(2024, 1, 2)]}, "code" : {"$in" : ["2024-01-01", "A1"]}}}],
+        id="operator-array",
+    ),
+    pytest.param(
+        [{"$match" : {"$expr" : {"$in" : ["$code", ["2024-01-01", "A1"]]}}}],
+        [{"$match" : {"$expr" : {"$in" : ["$code", ["2024-01-01", "A1"]]}}}],
+        id="expression-operator-array-on-string-field",
+    ),
+    pytest.param(
+        [{"$project" : {"code" : 1}}, {"$match" : {"code" : "2024-01-01"}}],
+        [{"$project" : {"code" : 1}}, {"$match" : {"code" : JANUARY_FIRST}}],
+        id="reshaped-field",
+    ),
+]
+
+
+@pytest.mark.parametrize("pipeline, expected", CASES)
+def test_coerce(pipeline, expected):
+    assert DateCoercer(SCHEMA).coerce(pipeline, "orders") == expected
+
+
+@pytest.mark.parametrize("pipeline, expected", CASES[:1] + [
+    pytest.param(
+        [{"$match" : {"code" : "2024-01-01"}}],
+        [{"$match" : {"code" : JANUARY_FIRST}}],
+        id="string-field-without-schema",
+    ),
+])
+def test_coerce_without_schema_converts_every_date(pipeline, expected):
+    assert DateCoercer().coerce(pipeline, "orders") == expected
+
+
+def test_coerce_does_not_modify_the_pipeline():
+    pipeline = [{"$match" : {"created_at" : {"$gte" : "2024-01-01"}}}]
+
+    DateCoercer(SCHEMA).coerce(pipeline, "orders")
+
+    assert pipeline == [{"$match" : {"created_at" : {"$gte" : "2024-01-01"}}}]
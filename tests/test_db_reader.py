@@ -0,0 +1,124 @@
+import asyncio
+import pytest
+from src.DBReader import MongoReader, AsyncMongoReader
+from src.MongoClientRegistry import MongoClientRegistry
+
+mongomock = pytest.importorskip("mongomock")
+
+
+class RecordingCursor:
+    def __init__(self, cursor : object) -> None:
+        self.cursor = cursor
+        self.closed = False
+
+    def __iter__(self) -> object:
+        return iter(self.cursor)
+
+    def __enter__(self) -> "RecordingCursor":
+        return self
+
+    def __exit__(self, *exc_info : object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.closed = True
+        self.cursor.close()
+
+
+class AsyncRecordingCursor(RecordingCursor):
+    async def to_list(self, length : int | None = None) -> list[dict]:
+        return [document for document, _ in zip(self.cursor, range(length))]
+
+    async def close(self) -> None:
+        RecordingCursor.close(self)
+
+
+class RecordingCollection:
+    # Records what the reader sends to mongomock and the cursors it opens.
+    def __init__(self, collection : object, cursor_class : type) -> None:
+        self.collection = collection
+        self.cursor_class = cursor_class
+        self.pipelines : list[list[dict]] = []
+        self.options : list[dict] = []
+        self.cursors : list[RecordingCursor] = []
+
+    def aggregate(self, pipeline : list[dict], **options : object) -> RecordingCursor:
+        self.pipelines.append(pipeline)
+        self.options.append(options)
+        self.cursors.append(self.cursor_class(self.collection.aggregate(pipeline, **options)))
+        return self.cursors[-1]
+
+
+def make_reader(reader_class : type, cursor_class : type, document_count : int) -> tuple[MongoReader, RecordingCollection]:
+    client = mongomock.MongoClient()
+    client["test"]["orders"].insert_many([{"number" : index} for index in range(document_count)])
+    registry = MongoClientRegistry(client_factory=lambda url, **options : client, health_check_interval=0)
+    reader = reader_class("mongodb://localhost:27017", "test", registry, execution_max_time_ms=1000, allow_disk_use=False)
+    collection = RecordingCollection(client["test"]["orders"], cursor_class)
+    reader.get_collection = lambda collection_name : collection
+    return reader, collection
+
+
+def fetch(reader_class : type, pipeline : list[dict], max_output_count : int, document_count : int = 10, max_time_ms : int | None = None) -> tuple[list[str], bool, RecordingCollection]:
+    if(reader_class is AsyncMongoReader):
+        reader, collection = make_reader(reader_class, AsyncRecordingCursor, document_count)
+        output_data, reached_max_count = asyncio.run(reader.fetch_pipeline_results("orders", pipeline, max_output_count, max_time_ms))
+    else:
+        reader, collection = make_reader(reader_class, RecordingCursor, document_count)
+        output_data, reached_max_count = reader.fetch_pipeline_results("orders", pipeline, max_output_count, max_time_ms)
+    return output_data, reached_max_count, collection
+
+
+READERS = [pytest.param(MongoReader, id="sync"), pytest.param(AsyncMongoReader, id="async")]
+
+
+@pytest.mark.parametrize("reader_class", READERS)
+def test_fetch_appends_one_limit_and_detects_truncation(reader_class):
+    output_data, reached_max_count, collection = fetch(reader_class, [{"$sort" : {"number" : 1}}], 3)
+
+    assert collection.pipelines == [[{"$sort" : {"number" : 1}}, {"$limit" : 4}]]
+    assert len(output_data) == 3
+    assert reached_max_count == True
+    assert all(cursor.closed for cursor in collection.cursors)
+
+
+@pytest.mark.parametrize("reader_class", READERS)
+def test_fetch_keeps_a_smaller_limit(reader_class):
+    output_data, reached_max_count, collection = fetch(reader_class, [{"$sort" : {"number" : 1}}, {"$limit" : 2}], 3)
+
+    assert collection.pipelines == [[{"$sort" : {"number" : 1}}, {"$limit" : 2}]]
+    assert len(output_data) == 2
+    assert reached_max_count == False
+    assert all(cursor.closed for cursor in collection.cursors)
+
+
+@pytest.mark.parametrize("reader_class", READERS)
+def test_fetch_exactly_max_output_count_is_not_truncated(reader_class):
+    output_data, reached_max_count, collection = fetch(reader_class, [{"$match" : {}}], 5, document_count=5)
+
+    assert len(output_data) == 5
+    assert reached_max_count == False
+    assert collection.options == [{"batchSize" : 6, "maxTimeMS" : 1000, "allowDiskUse" : False}]
+
+
+@pytest.mark.parametrize("reader_class", READERS)
+def test_fetch_uses_the_shorter_budget_time(reader_class):
+    _, _, collection = fetch(reader_class, [{"$match" : {}}], 5, max_time_ms=200)
+
+    assert collection.options[0]["maxTimeMS"] == 200
+
+
+@pytest.mark.parametrize("pipeline, expected", [
+    pytest.param([{"$match" : {}}], [{"$match" : {}}, {"$limit" : 6}], id="no-limit"),
+    pytest.param([{"$match" : {}}, {"$limit" : 6}], [{"$match" : {}}, {"$limit" : 6}], id="limit-at-fetch-count"),
+    pytest.param([{"$match" : {}}, {"$limit" : 100}], [{"$match" : {}}, {"$limit" : 100}, {"$limit" : 6}], id="larger-limit"),
+    pytest.param([{"$count" : "orders"}], [{"$count" : "orders"}], id="count"),
+    pytest.param([], [{"$limit" : 6}], id="empty"),
+])
+def test_prepare_execution_pipeline(pipeline, expected):
+    reader, _ = make_reader(MongoReader, RecordingCursor, 1)
+
+    prepared = reader.prepare_execution_pipeline(pipeline, 5)
+
+    assert prepared == expected
+    assert reader.prepare_execution_pipeline(prepared, 5) == expected
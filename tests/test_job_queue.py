@@ -0,0 +1,200 @@
+import asyncio
+import threading
+import time
+import uuid
+import pytest
+from fastapi import HTTPException
+from src.JobQueue import JobManager, SQLiteJobStore, MemoryJobStore
+from src.Schemas import JobInput, JobResponse
+from src.Constant import JOB_STATUS_QUEUED, JOB_STATUS_RUNNING, JOB_STATUS_SUCCEEDED, JOB_STATUS_CANCELLED
+
+
+def make_job(priority : int = 1) -> dict:
+    return {"id" : uuid.uuid4().hex, "status" : JOB_STATUS_QUEUED, "priority" : priority, "input" : "{}", "webhook_url" : None, "created_at" : time.time()}
+
+
+def test_sqlite_pop_next_claims_each_job_once(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    stores = [SQLiteJobStore(path) for _ in range(4)]
+    job_ids = [make_job()["id"] for _ in range(200)]
+    for job_id in job_ids:
+        stores[0].add({**make_job(), "id" : job_id})
+
+    claimed : list[str] = []
+    claimed_lock = threading.Lock()
+
+    def claim(store : SQLiteJobStore) -> None:
+        while True:
+            job = store.pop_next()
+            if(job is None):
+                return
+            with claimed_lock:
+                claimed.append(job["id"])
+
+    # Each store has its own connection, like worker processes sharing the file.
+    threads = [threading.Thread(target=claim, args=(store,)) for store in stores for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == sorted(job_ids)
+    assert stores[0].count(JOB_STATUS_RUNNING) == len(job_ids)
+
+
+def test_sqlite_pop_next_follows_priority_then_order(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+    low, first, second = make_job(2), make_job(0), make_job(0)
+    for job in [low, first, second]:
+        store.add(job)
+
+    assert [store.pop_next()["id"] for _ in range(3)] == [first["id"], second["id"], low["id"]]
+    assert store.pop_next() is None
+
+
+def test_sqlite_recover_requeues_jobs_after_lease_expiry(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+    stale, alive = make_job(), make_job()
+    store.add(stale)
+    store.add(alive)
+    store.pop_next()
+    store.pop_next()
+
+    lease_start = time.time()
+    store.touch([alive["id"]])
+    store.update(stale["id"], heartbeat_at=lease_start - 60)
+
+    assert store.recover(lease_start - 30) == 1
+    assert store.get(stale["id"])["status"] == JOB_STATUS_QUEUED
+    assert store.get(stale["id"])["started_at"] is None
+    assert store.get(alive["id"])["status"] == JOB_STATUS_RUNNING
+    assert store.pop_next()["id"] == stale["id"]
+
+
+def test_sqlite_recover_keeps_leases_that_are_still_held(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+    store.add(make_job())
+    store.pop_next()
+
+    assert store.recover(time.time() - 30) == 0
+    assert store.count(JOB_STATUS_RUNNING) == 1
+
+
+def test_memory_pop_next_skips_cancelled_jobs():
+    store = MemoryJobStore()
+    cancelled, queued = make_job(0), make_job(1)
+    store.add(cancelled)
+    store.add(queued)
+    store.update(cancelled["id"], status=JOB_STATUS_CANCELLED)
+
+    assert store.pop_next()["id"] == queued["id"]
+    assert store.pop_next() is None
+
+
+async def wait_for_status(manager : JobManager, job_id : str, status : str) -> None:
+    for _ in range(200):
+        if(manager.get(job_id).status == status):
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} never reached {status}")
+
+
+def test_manager_worker_moves_on_while_webhook_is_sent():
+    async def scenario() -> None:
+        webhook_started = asyncio.Event()
+        webhook_released = asyncio.Event()
+        notified : list[str] = []
+
+        class SlowWebhookManager(JobManager):
+            async def notify(self, webhook_url : str, job : JobResponse) -> None:
+                webhook_started.set()
+                await webhook_released.wait()
+                notified.append(job.job_id)
+
+        async def runner(query_input) -> str:
+            return query_input.query
+
+        manager = SlowWebhookManager(worker_count=1, poll_interval=0.01, webhook_allowed_hosts=["hooks.test"])
+        await manager.start(runner)
+        try:
+            first = manager.submit(JobInput(query="first", collection_list=["orders"], webhook_url="http://hooks.test/done"))
+            await asyncio.wait_for(webhook_started.wait(), 1)
+            second = manager.submit(JobInput(query="second", collection_list=["orders"]))
+            # The single worker finishes the second job while the first job's webhook is still waiting.
+            await wait_for_status(manager, second.job_id, JOB_STATUS_SUCCEEDED)
+            assert notified == []
+            webhook_released.set()
+            await asyncio.sleep(0.01)
+            assert notified == [first.job_id]
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_manager_cancels_running_job():
+    async def scenario() -> None:
+        started = asyncio.Event()
+
+        async def runner(query_input) -> str:
+            started.set()
+            await asyncio.sleep(10)
+            return query_input.query
+
+        manager = JobManager(worker_count=1, poll_interval=0.01)
+        await manager.start(runner)
+        try:
+            job = manager.submit(JobInput(query="slow", collection_list=["orders"]))
+            await asyncio.wait_for(started.wait(), 1)
+            # cancel is called from the HTTP thread pool, so it hands the cancellation over to the loop.
+            await asyncio.to_thread(manager.cancel, job.job_id)
+            await wait_for_status(manager, job.job_id, JOB_STATUS_CANCELLED)
+            assert manager.get_stats()["running"] == 0
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_cancel_only_changes_the_status_it_expects(tmp_path):
+    for store in [MemoryJobStore(), SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))]:
+        job = make_job()
+        store.add(job)
+        store.pop_next()
+
+        # The job was claimed after the caller read it as queued, so the queued cancellation must not apply.
+        assert store.cancel(job["id"], JOB_STATUS_QUEUED) == False
+        assert store.get(job["id"])["status"] == JOB_STATUS_RUNNING
+        assert store.cancel(job["id"], JOB_STATUS_RUNNING) == True
+        assert store.get(job["id"])["status"] == JOB_STATUS_CANCELLED
+        assert store.cancel("missing", JOB_STATUS_QUEUED) == False
+
+
+@pytest.mark.parametrize("webhook_url, allowed", [
+    ("https://8.8.8.8/hooks/done", True),
+    ("http://8.8.8.8/hooks/done", False),
+    ("https://127.0.0.1/hooks/done", False),
+    ("https://localhost/hooks/done", False),
+    ("https://10.0.0.5/hooks/done", False),
+    ("https://169.254.169.254/latest/meta-data", False),
+    ("https://[::1]/hooks/done", False),
+    ("file:///etc/passwd", False),
+])
+def test_webhook_must_be_https_on_a_public_host(webhook_url, allowed):
+    assert (JobManager().check_webhook_url(webhook_url) is None) == allowed
+
+
+def test_webhook_allowlist_replaces_the_public_host_check():
+    manager = JobManager(webhook_allowed_hosts=["hooks.internal"])
+
+    assert manager.check_webhook_url("http://hooks.internal/done") is None
+    assert manager.check_webhook_url("https://ci.hooks.internal/done") is None
+    assert manager.check_webhook_url("https://8.8.8.8/done") is not None
+    assert manager.check_webhook_url("https://evilhooks.internal/done") is not None
+
+
+def test_submit_rejects_a_private_webhook():
+    with pytest.raises(HTTPException) as error:
+        JobManager().submit(JobInput(query="q", collection_list=["orders"], webhook_url="https://127.0.0.1/done"))
+
+    assert error.value.status_code == 400
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+import pytest
+from src.LLMCache import LLMResponseCache
+from src.SharedCache import SQLiteCacheTier
+
+
+def test_call_reuses_the_stored_response():
+    cache = LLMResponseCache()
+    calls : list[int] = []
+
+    def fetch() -> dict:
+        calls.append(1)
+        return {"pipeline" : [{"$match" : {"status" : "paid"}}]}
+
+    first = cache.call("key", fetch)
+    first["pipeline"].clear()
+
+    # Hits are copies, so a caller mutating its response does not change the cached one.
+    assert cache.call("key", fetch) == {"pipeline" : [{"$match" : {"status" : "paid"}}]}
+    assert len(calls) == 1
+    assert cache.get_stats()["memory_hits"] == 1
+
+
+def test_call_does_not_store_empty_responses():
+    cache = LLMResponseCache()
+    cache.call("key", lambda : "")
+
+    assert cache.get("key") is None
+
+
+def test_call_coalesces_concurrent_threads():
+    cache = LLMResponseCache()
+    release = threading.Event()
+    calls : list[int] = []
+
+    def fetch() -> str:
+        calls.append(1)
+        release.wait(1)
+        return "answer"
+
+    results : list[str] = []
+    threads = [threading.Thread(target=lambda : results.append(cache.call("key", fetch))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 1
+    while(cache.get_stats()["coalesced"] < 4 and time.monotonic() < deadline):
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["answer"] * 5
+    assert len(calls) == 1
+
+
+def test_call_async_coalesces_concurrent_calls():
+    cache = LLMResponseCache()
+    calls : list[int] = []
+
+    async def fetch() -> str:
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def scenario() -> list[str]:
+        return await asyncio.gather(*[cache.call_async("key", fetch) for _ in range(5)])
+
+    assert asyncio.run(scenario()) == ["answer"] * 5
+    assert len(calls) == 1
+    assert cache.get_stats()["coalesced"] == 4
+
+
+def test_follower_retries_after_its_leader_is_cancelled():
+    cache = LLMResponseCache()
+    calls : list[str] = []
+
+    async def scenario() -> str:
+        leader_started = asyncio.Event()
+
+        async def slow_fetch() -> str:
+            calls.append("leader")
+            leader_started.set()
+            await asyncio.sleep(10)
+            return "leader"
+
+        async def fetch() -> str:
+            calls.append("follower")
+            return "follower"
+
+        leader = asyncio.create_task(cache.call_async("key", slow_fetch))
+        await leader_started.wait()
+        follower = asyncio.create_task(cache.call_async("key", fetch))
+        await asyncio.sleep(0)
+        # A lost hedge cancels the leader; its follower must not inherit the cancellation.
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(scenario()) == "follower"
+    assert calls == ["leader", "follower"]
+    assert cache.get_stats()["in_flight"] == 0
+
+
+def test_follower_receives_the_leader_error():
+    cache = LLMResponseCache()
+
+    async def fetch() -> str:
+        await asyncio.sleep(0.01)
+        raise ValueError("provider failed")
+
+    async def scenario() -> list:
+        return await asyncio.gather(*[cache.call_async("key", fetch) for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert cache.get("key") is None
+
+
+def test_disk_tier_answers_a_new_process(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    writer = LLMResponseCache(disk_tier=SQLiteCacheTier(path, "llm", 100, 60.0))
+    asyncio.run(writer.set_async("key", {"answer" : 42}))
+
+    reader = LLMResponseCache(disk_tier=SQLiteCacheTier(path, "llm", 100, 60.0))
+    assert asyncio.run(reader.get_async("key")) == {"answer" : 42}
+    assert reader.get("key") == {"answer" : 42}
+    assert (reader.get_stats()["disk_hits"], reader.get_stats()["memory_hits"]) == (1, 1)
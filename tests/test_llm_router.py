@@ -0,0 +1,133 @@
+import asyncio
+import time
+import pytest
+from src.llm import BaseLLM
+from src.LLMRouter import LLMRouter, TokenBucket
+
+
+class StatusError(Exception):
+    def __init__(self, status_code : int) -> None:
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+class FakeLLM(BaseLLM):
+    def __init__(self, output : str, errors : list[Exception] | None = None, delay : float = 0.0) -> None:
+        self.output = output
+        self.errors = list(errors or [])
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = False
+
+    def get_chat_message(self, content : str, role : str) -> dict:
+        return {"role" : role, "content" : content}
+
+    def get_chat_content(self, message : dict) -> str:
+        return message["content"]
+
+    def get_chat_role(self, message : dict) -> str:
+        return message["role"]
+
+    def next_output(self) -> str:
+        self.calls += 1
+        if(len(self.errors) > 0):
+            raise self.errors.pop(0)
+        return self.output
+
+    def invoke(self, model : str, messages : list, temperature : float, tools : dict = None, return_tool : bool = True, usage_callback = None) -> str:
+        return self.next_output()
+
+    async def invoke_async(self, model : str, messages : list, temperature : float, tools : dict = None, return_tool : bool = True, usage_callback = None) -> str:
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return self.next_output()
+
+
+def make_router(backends : dict[str, BaseLLM], **options) -> LLMRouter:
+    options = {"max_retries" : 0, "retry_backoff" : 0.0, "retry_max_backoff" : 0.0, "timeout" : 5.0, **options}
+    return LLMRouter(backends, **options)
+
+
+MESSAGES = [{"role" : "user", "content" : "hello"}]
+
+
+def test_invoke_fails_over_on_retryable_error():
+    primary = FakeLLM("primary", errors=[StatusError(503)])
+    secondary = FakeLLM("secondary")
+    router = make_router({"primary" : primary, "secondary" : secondary})
+
+    assert router.invoke("primary", MESSAGES, 0.0) == "secondary"
+    assert (primary.calls, secondary.calls) == (1, 1)
+
+
+def test_invoke_raises_non_retryable_error_without_failover():
+    primary = FakeLLM("primary", errors=[StatusError(400)])
+    secondary = FakeLLM("secondary")
+    router = make_router({"primary" : primary, "secondary" : secondary})
+
+    with pytest.raises(StatusError):
+        router.invoke("primary", MESSAGES, 0.0)
+    assert secondary.calls == 0
+
+
+def test_invoke_retries_on_the_same_backend_before_failing_over():
+    primary = FakeLLM("primary", errors=[ConnectionError("reset")])
+    secondary = FakeLLM("secondary")
+    router = make_router({"primary" : primary, "secondary" : secondary}, max_retries=1)
+
+    assert router.invoke("primary", MESSAGES, 0.0) == "primary"
+    assert (primary.calls, secondary.calls) == (2, 0)
+
+
+def test_invoke_async_fails_over_on_retryable_error():
+    primary = FakeLLM("primary", errors=[StatusError(429)])
+    secondary = FakeLLM("secondary")
+    router = make_router({"primary" : primary, "secondary" : secondary})
+
+    assert asyncio.run(router.invoke_async("primary", MESSAGES, 0.0)) == "secondary"
+
+
+def test_unhealthy_backend_is_tried_last():
+    primary = FakeLLM("primary", errors=[StatusError(500)])
+    secondary = FakeLLM("secondary")
+    router = make_router({"primary" : primary, "secondary" : secondary}, failure_threshold=1, failure_cooldown=60.0)
+
+    router.invoke("primary", MESSAGES, 0.0)
+    assert [backend.model for backend in router.get_route("primary")] == ["secondary", "primary"]
+
+
+def test_hedge_winner_cancels_the_slow_primary():
+    primary = FakeLLM("primary", delay=5.0)
+    secondary = FakeLLM("secondary", delay=0.01)
+    router = make_router({"primary" : primary, "secondary" : secondary}, hedge_delay=0.05)
+
+    async def scenario() -> str:
+        output = await router.invoke_async("primary", MESSAGES, 0.0)
+        # Let the cancellation reach the losing call.
+        await asyncio.sleep(0)
+        return output
+
+    started = time.monotonic()
+    assert asyncio.run(scenario()) == "secondary"
+    assert time.monotonic() - started < 1.0
+    assert primary.cancelled and primary.calls == 0
+
+
+def test_hedge_is_not_started_when_primary_answers_in_time():
+    primary = FakeLLM("primary", delay=0.0)
+    secondary = FakeLLM("secondary")
+    router = make_router({"primary" : primary, "secondary" : secondary}, hedge_delay=0.5)
+
+    assert asyncio.run(router.invoke_async("primary", MESSAGES, 0.0)) == "primary"
+    assert secondary.calls == 0
+
+
+def test_token_bucket_delays_once_the_burst_is_spent():
+    bucket = TokenBucket(rate=10.0, capacity=2)
+
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
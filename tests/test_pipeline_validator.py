@@ -0,0 +1,93 @@
+from src.PipelineValidator import PipelineValidator
+
+SCHEMA = {
+    "orders" : {
+        "_id" : {"data_type" : ["objectId"]},
+        "status" : {"data_type" : ["string"]},
+        "amount" : {"data_type" : ["double"]},
+        "customer_id" : {"data_type" : ["objectId"]},
+        "created_at" : {"data_type" : ["date"]},
+    },
+}
+
+
+def make_validator() -> PipelineValidator:
+    return PipelineValidator(["orders", "customers"], SCHEMA)
+
+
+def is_clean(verdict) -> bool:
+    return not (verdict.intermediate_query or verdict.contains_DML_operation or verdict.contains_raw_output or verdict.incorrect_query)
+
+
+def test_empty_pipeline_is_intermediate():
+    verdict = make_validator().validate("orders", [])
+
+    assert verdict.intermediate_query
+
+
+def test_stage_with_several_operators_is_incorrect():
+    verdict = make_validator().validate("orders", [{"$match" : {"status" : "paid"}, "$limit" : 5}])
+
+    assert verdict.incorrect_query
+
+
+def test_write_stage_is_dml():
+    verdict = make_validator().validate("orders", [{"$group" : {"_id" : "$status"}}, {"$out" : "report"}])
+
+    assert verdict.contains_DML_operation
+
+
+def test_unknown_stage_is_incorrect():
+    verdict = make_validator().validate("orders", [{"$filter" : {"status" : "paid"}}, {"$limit" : 5}])
+
+    assert verdict.incorrect_query
+
+
+def test_inaccessible_collections_are_incorrect():
+    validator = make_validator()
+
+    assert validator.validate("payments", [{"$count" : "total"}]).incorrect_query
+    assert validator.validate("orders", [{"$lookup" : {"from" : "payments", "localField" : "_id", "foreignField" : "order_id", "as" : "payments"}}, {"$count" : "total"}]).incorrect_query
+    assert validator.validate("orders", [{"$unionWith" : "payments"}, {"$count" : "total"}]).incorrect_query
+
+
+def test_raw_documents_without_limit_are_raw_output():
+    verdict = make_validator().validate("orders", [{"$match" : {"status" : "paid"}}])
+
+    assert verdict.contains_raw_output
+
+
+def test_self_contained_aggregation_is_approved():
+    verdict = make_validator().validate("orders", [{"$match" : {"status" : "paid"}}, {"$group" : {"_id" : "$status", "total" : {"$sum" : "$amount"}}}])
+
+    assert verdict is not None and is_clean(verdict)
+
+
+def test_dollar_literal_in_match_is_not_a_field():
+    validator = make_validator()
+    pipeline = [{"$match" : {"status" : "$100"}}, {"$group" : {"_id" : None, "total" : {"$sum" : "$amount"}}}]
+
+    assert validator.get_input_fields(pipeline) == {"status", "amount"}
+    assert is_clean(validator.validate("orders", pipeline))
+
+
+def test_expr_in_match_reads_field_paths():
+    pipeline = [{"$match" : {"$expr" : {"$gt" : ["$amount", "$discount"]}}}, {"$count" : "total"}]
+
+    assert make_validator().get_input_fields(pipeline) == {"amount", "discount"}
+
+
+def test_unknown_field_is_left_to_the_llm():
+    # Sparse fields are missing from the inferred schema, so an unknown field is not rejected locally.
+    pipeline = [{"$match" : {"deleted_at" : None}}, {"$count" : "total"}]
+
+    assert make_validator().validate("orders", pipeline) is None
+
+
+def test_inconclusive_pipelines_are_left_to_the_llm():
+    validator = make_validator()
+
+    assert validator.validate("orders", [{"$match" : {"status" : "paid"}}, {"$limit" : 5}]) is None
+    assert validator.validate("orders", [{"$group" : {"_id" : "$customer_id", "total" : {"$sum" : "$amount"}}}]) is None
+    assert validator.validate("orders", [{"$lookup" : {"from" : "customers", "localField" : "customer_id", "foreignField" : "_id", "as" : "customer"}}, {"$count" : "total"}]) is None
+    assert PipelineValidator(["orders"]).validate("orders", [{"$count" : "total"}]) is None
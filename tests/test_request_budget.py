@@ -0,0 +1,119 @@
+import asyncio
+import json
+import pytest
+from src.llm import BaseLLM
+from src.DBReader import BaseDBReader
+from src.DBAgent import AsyncDBQueryAgent
+from src.RequestBudget import BudgetController
+from src.Schemas import QueryInput
+from src.Constant import BUDGET_LIMIT_ITERATIONS, BUDGET_LIMIT_WALL_CLOCK, BUDGET_LIMIT_TOKENS, BUDGET_LIMIT_MONGO_TIME, STREAM_EVENT_FINAL_ANSWER
+
+
+class StubLLM(BaseLLM):
+    def __init__(self, delay : float = 0.0, usage : tuple[int, int] = (0, 0)) -> None:
+        self.delay = delay
+        self.usage = usage
+        self.generations = 0
+
+    def get_chat_message(self, content : str, role : str) -> dict:
+        return {"role" : role, "content" : content}
+
+    def get_chat_content(self, message : dict) -> str:
+        return message["content"]
+
+    def get_chat_role(self, message : dict) -> str:
+        return message["role"]
+
+    async def invoke_async(self, model : str, messages : list, temperature : float, tools : dict = None, return_tool : bool = True, usage_callback = None) -> str | dict:
+        await asyncio.sleep(self.delay)
+        if(usage_callback is not None):
+            usage_callback(*self.usage)
+
+        operation = self.get_operation(tools, return_tool)
+        if(operation == "test_mongo_pipeline"):
+            self.generations += 1
+            return {"collection_name" : "orders", "mongodb_pipeline" : json.dumps([{"$group" : {"_id" : "$status", "count" : {"$sum" : 1}}}]), "query_analysis_failed" : False}
+        if(operation == "analyze_mongodb_pipeline"):
+            verdict = {}
+            for condition in ["intermediate_query", "contains_DML_operation", "contains_raw_output", "incorrect_query"]:
+                verdict[condition] = False
+                verdict[f"reason_for_{condition}"] = "Stub verdict."
+            return verdict
+        return "Stub answer."
+
+
+class FailingReader(BaseDBReader):
+    # Every execution fails after the delay, so the agent keeps retrying until a limit stops it.
+    def __init__(self, delay : float = 0.0) -> None:
+        self.delay = delay
+        self.executions = 0
+
+    async def fetch_pipeline_results(self, collection_name : str, pipeline_query : list[dict], max_output_count : int, max_time_ms : int | None = None) -> tuple[list[str], bool]:
+        self.executions += 1
+        await asyncio.sleep(self.delay)
+        raise RuntimeError("execution failed")
+
+
+def run_stream_loop(llm : StubLLM, reader : FailingReader, **limits) -> list[dict]:
+    # Server limits of 0 leave every limit to the request.
+    agent = AsyncDBQueryAgent(llm, reader, use_rule_validator=False, explain_cost_budget=0, budget_controller=BudgetController(max_iterations=0, max_seconds=0, max_tokens=0, max_mongo_ms=0))
+    input_parameters = QueryInput(query="How many orders per status?", collection_list=["orders"], database_name="test", connection_url="mongodb://localhost:27017", **limits)
+    agent.start_budget(input_parameters)
+    state = agent.build_initial_state("orders: status", input_parameters, None, None, ["orders"], [])
+
+    async def collect() -> list[dict]:
+        return [event async for event in agent.stream_loop(state, input_parameters, stream_tokens=False)]
+
+    return asyncio.run(collect())
+
+
+def get_final_answer(events : list[dict]) -> dict:
+    assert events[-1]["event"] == STREAM_EVENT_FINAL_ANSWER
+    return events[-1]["data"]
+
+
+def test_iteration_limit_stops_the_loop():
+    llm = StubLLM()
+    reader = FailingReader()
+
+    answer = get_final_answer(run_stream_loop(llm, reader, max_iterations=2))
+
+    assert answer["budget_exhausted"] == BUDGET_LIMIT_ITERATIONS
+    assert llm.generations == 2
+    assert reader.executions == 2
+
+
+def test_wall_clock_limit_stops_the_loop():
+    llm = StubLLM(delay=0.02)
+
+    answer = get_final_answer(run_stream_loop(llm, FailingReader(), max_iterations=100, max_seconds=0.1))
+
+    assert answer["budget_exhausted"] == BUDGET_LIMIT_WALL_CLOCK
+    assert 1 <= llm.generations < 100
+
+
+def test_token_limit_stops_the_loop():
+    # Each attempt makes a generation and an analysis call of 1100 tokens each.
+    llm = StubLLM(usage=(1000, 100))
+
+    answer = get_final_answer(run_stream_loop(llm, FailingReader(), max_iterations=100, max_tokens=5000))
+
+    assert answer["budget_exhausted"] == BUDGET_LIMIT_TOKENS
+    assert llm.generations == 3
+
+
+def test_mongo_time_limit_stops_the_loop():
+    # A failed execution still spends its database time.
+    reader = FailingReader(delay=0.03)
+
+    answer = get_final_answer(run_stream_loop(StubLLM(), reader, max_iterations=100, max_mongo_ms=50))
+
+    assert answer["budget_exhausted"] == BUDGET_LIMIT_MONGO_TIME
+    assert reader.executions == 2
+
+
+@pytest.mark.parametrize("limits", [{"max_iterations" : 1}, {"max_tokens" : 1}])
+def test_exhausted_answer_reports_the_last_attempt(limits):
+    answer = get_final_answer(run_stream_loop(StubLLM(usage=(1, 0)), FailingReader(), **limits))
+
+    assert "$group" in answer["output"]